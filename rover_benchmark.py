@@ -0,0 +1,383 @@
+#!/usr/bin/python3
+
+# ##############################################################################
+#
+# Rover client end-to-end benchmark
+#
+# Runs the client engine against the local rover simulator and measures:
+#
+#   control     control frames/s reaching the rover, frame interval jitter,
+#               input event to send latency and control round trip to the
+#               $MOT echo, the stick reversed every millisecond
+#   latency     control frame to $MOT telemetry round trip
+#   telemetry   high-rate telemetry ingest: datagrams received against
+#               sent, kernel drops, processing time per datagram and CPU
+#   video       relay throughput and client CPU seconds per MB, for each
+#               relay mode, unpaced synthetic stream
+#   gui         GUI status update cost: queue post and refresh (needs Tk and
+#               a display, skipped otherwise)
+#
+# Results are written as JSON. With --baseline, results are compared with
+# an earlier run and the exit status is 1 when a figure is worse by more
+# than --tolerance.
+#
+# Usage:
+#   rover_benchmark.py [--config FILE] [--duration S] [--only NAMES]
+#                      [--loss P] [--latency S] [--jitter S]
+#                      [--output FILE] [--baseline FILE] [--tolerance X]
+#
+# ##############################################################################
+
+import os                       # Operating system interface
+import sys                      # System call
+import time                     # Time acquisition and formatting
+import json                     # Results
+import socket                   # Network communication
+import fnmatch                  # Regression check keys
+import platform                 # Result metadata
+import tempfile                 # Benchmark configuration file
+import subprocess               # Simulator process
+import threading                # Input event thread
+import argparse                 # Command line parsing
+import rover_control            # Control link and inputs
+import rover_telemetry          # Telemetry decoding
+import rover_engine             # Client engine
+import rover_config             # Configuration file
+import rover_metrics            # Statistics summaries
+import rover_log                # Event log
+
+# Simulator program
+SIMULATOR = os.path.join(os.path.dirname(os.path.abspath(__file__)),'rover_simulator.py')
+
+# Benchmark defaults
+BENCH_DURATION = 5.0
+BENCH_LATENCY_COUNT = 200
+BENCH_PROBE_PORT = 17007
+BENCH_GUI_UPDATES = 10000
+BENCH_TOLERANCE = 0.2
+BENCH_INPUT_INTERVAL = 0.001
+BENCH_TELEMETRY_RATE = 500
+BENCH_TELEMETRY_SENSORS = 20
+BENCHMARKS = ('control','latency','telemetry','video','gui')
+
+# Options passed to every simulator run (--loss, --latency, --jitter,
+# --probe-port)
+simulator_args = []
+
+# Regression checks: result key pattern, +1 higher is better, -1 lower is better
+CHECKS = (
+    ('control.frames_per_s',+1),
+    ('control.interval_ms.p99',-1),
+    ('control.input_latency_ms.mean',-1),
+    ('control.rtt_ms.p99',-1),
+    ('latency.rtt_ms.p50',-1),
+    ('latency.rtt_ms.p99',-1),
+    ('telemetry.received_ratio',+1),
+    ('telemetry.packet_us',-1),
+    ('video.*.mb_per_s',+1),
+    ('video.*.cpu_s_per_mb',-1),
+    ('gui.*_us',-1),
+)
+
+# ------------------------------------------------------------------------------
+# write_config(settings,path) - rover.conf for the benchmark run
+# ------------------------------------------------------------------------------
+def write_config(settings,path):
+    with open(path,'w') as f:
+        for name,kind,default,check in rover_config.SETTINGS:
+            if name == 'CONTROL_PROFILES': continue
+            f.write("{} = {}\n".format(name,getattr(settings,name)))
+        # drive profiles are written as PROFILE_<name> lines
+        for name,spec in settings.CONTROL_PROFILES:
+            f.write("{}{} = {}\n".format(rover_config.PROFILE_PREFIX,name,spec))
+
+# ------------------------------------------------------------------------------
+# Simulator(config,*args) - rover simulator process, context manager
+# ------------------------------------------------------------------------------
+class Simulator:
+
+    def __init__(self,config,*args):
+        self.cmdline = [sys.executable,SIMULATOR,'--config',config,'--quiet','--stats'] + simulator_args + list(args)
+        self.process = None
+        self.stats = None
+
+    def __enter__(self):
+        self.process = subprocess.Popen(self.cmdline,stdout=subprocess.PIPE,universal_newlines=True)
+        if self.process.stdout.readline().strip() != 'ready':
+            self.process.kill()
+            raise RuntimeError("rover simulator did not start")
+        return self
+
+    def __exit__(self,exc_type,exc_value,traceback):
+        self.process.terminate()
+        out,_ = self.process.communicate(timeout=10)
+        lines = out.strip().splitlines()
+        self.stats = json.loads(lines[-1]) if lines else None
+
+# ------------------------------------------------------------------------------
+# ReversingInput(interval) - full forward / full reverse every interval
+# seconds from an input thread, like a stick moved faster than max rate
+# ------------------------------------------------------------------------------
+class ReversingInput(rover_control.ManualInput):
+
+    def __init__(self,interval=BENCH_INPUT_INTERVAL):
+        super().__init__()
+        self.interval = interval
+        self.running = True
+        self.thread = threading.Thread(target=self.run,name='bench-input',daemon=True)
+
+    def run(self):
+        axis = 1.0
+        while self.running:
+            axis = -axis
+            self.set_axes(axis,-axis)
+            time.sleep(self.interval)
+
+# ------------------------------------------------------------------------------
+# bench_control(settings,config,duration)
+# ------------------------------------------------------------------------------
+def bench_control(settings,config,duration):
+    engine = rover_engine.RoverEngine(settings).start()
+    source = ReversingInput()
+    with Simulator(config,'--telemetry-rate','0') as sim:
+        engine.start_telemetry()
+        engine.start_control(source=source)
+        source.thread.start()
+        time.sleep(duration)
+        source.running = False
+        engine.stop()
+    stats = sim.stats
+    latency = engine.metrics.histogram('rover_control_input_latency_seconds')
+    labels = {'kind':'axes','rover':settings.NAME}
+    count = latency.get(**labels)
+    rtt = {k: v * 1000 if k != 'count' else v for k,v in engine.rover().control_rtt.summary().items()}
+    return {
+        'max_rate': settings.CONTROL_MAX_RATE,
+        'frames': stats['control_frames'],
+        'frames_per_s': stats['control_rate'],
+        'interval_ms': stats['control_interval_ms'],
+        'input_events': source.events,
+        'input_latency_ms': {
+            'count': count,
+            'mean': latency.sums.get(tuple(sorted(labels.items())),0) / max(1,count) * 1000,
+            'p50_le': (latency.quantile(0.50,**labels) or 0) * 1000,
+            'p99_le': (latency.quantile(0.99,**labels) or 0) * 1000,
+        },
+        'rtt_ms': rtt,
+    }
+
+# ------------------------------------------------------------------------------
+# bench_latency(settings,config,count) - one frame in flight at a time
+# ------------------------------------------------------------------------------
+def bench_latency(settings,config,count):
+    telemetry = socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
+    telemetry.bind(('0.0.0.0',settings.CLIENT_TELEMETRY_PORT))
+    telemetry.settimeout(1.0)
+    rtts = []
+    lost = 0
+    with Simulator(config,'--telemetry-rate','0') as sim, \
+            rover_control.ControlLink(settings.ROVER_IP,settings.ROVER_CONTROL_PORT,settings.CONTROL_FRAME_FORMAT) as link:
+        for i in range(count):
+            value = i % 100 + 1
+            sent = time.perf_counter()
+            link.send_axes(0,value,0,0)
+            try:
+                while True:
+                    tag,record = rover_telemetry.decode_sentence(telemetry.recv(512))
+                    if tag == b'$MOT' and record.motor == value: break
+                rtts.append((time.perf_counter() - sent) * 1000)
+            except socket.timeout:
+                lost += 1
+    telemetry.close()
+    return {'frames': count,'lost': lost,'rtt_ms': rover_metrics.summarize(rtts)}
+
+# ------------------------------------------------------------------------------
+# bench_telemetry(settings,config,duration) - $MOT and sensor sentences in
+# bursts, BENCH_TELEMETRY_RATE times a second
+# ------------------------------------------------------------------------------
+def bench_telemetry(settings,config,duration):
+    engine = rover_engine.RoverEngine(settings)
+    with Simulator(config,'--telemetry-rate',str(BENCH_TELEMETRY_RATE),'--sensors',str(BENCH_TELEMETRY_SENSORS)) as sim:
+        engine.start()
+        engine.start_telemetry()
+        time.sleep(1)
+        receiver = engine.telemetry.receiver
+        start = (receiver.datagrams,receiver.process_time,time.process_time(),time.monotonic())
+        time.sleep(duration)
+        datagrams,process_time = receiver.datagrams - start[0],receiver.process_time - start[1]
+        cpu,wall = time.process_time() - start[2],time.monotonic() - start[3]
+        received,drops,max_batch = receiver.datagrams,receiver.kernel_drops,receiver.max_batch
+        engine.stop()
+    return {
+        'rate': BENCH_TELEMETRY_RATE,
+        'sensors': BENCH_TELEMETRY_SENSORS,
+        'sent': sim.stats['telemetry_sent'],
+        'received': received,
+        'received_ratio': received / (received + drops) if received else None,
+        'received_per_s': datagrams / wall,
+        'kernel_drops': drops,
+        'max_batch': max_batch,
+        'rcvbuf': receiver.rcvbuf,
+        'packet_us': process_time / datagrams * 1e6 if datagrams else None,
+        'cpu_s_per_10k': cpu / datagrams * 10000 if datagrams else None,
+    }
+
+# ------------------------------------------------------------------------------
+# bench_video(settings,config,duration) - one run per relay mode
+# ------------------------------------------------------------------------------
+def bench_video(settings,config,duration):
+    results = {}
+    modes = (('copy',rover_config.Settings(**dict(vars(settings),VIDEO_RELAY_MODE='copy',VIDEO_LOW_LATENCY=0))),
+             ('splice',rover_config.Settings(**dict(vars(settings),VIDEO_RELAY_MODE='splice',VIDEO_LOW_LATENCY=0))),
+             ('low-latency',rover_config.Settings(**dict(vars(settings),VIDEO_LOW_LATENCY=1))))
+    for mode,mode_settings in modes:
+        engine = rover_engine.RoverEngine(mode_settings)
+        with Simulator(config,'--fps','0') as sim:
+            engine.start()
+            engine.start_video(player_cmd=[])
+            # first report once connected
+            time.sleep(1.5)
+            bytes_start,cpu_start,wall_start = engine.metrics.value('rover_video_bytes_total'),time.process_time(),time.monotonic()
+            time.sleep(duration)
+            relayed = engine.metrics.value('rover_video_bytes_total') - bytes_start
+            cpu,wall = time.process_time() - cpu_start,time.monotonic() - wall_start
+            engine.stop()
+        mb = relayed / 1048576
+        results[mode] = {
+            'mb': mb,
+            'mb_per_s': mb / wall,
+            'cpu_s': cpu,
+            'cpu_s_per_mb': cpu / mb if mb else None,
+            'sent_mb': sim.stats['video_bytes'] / 1048576,
+        }
+    return results
+
+# ------------------------------------------------------------------------------
+# bench_gui(count) - status callback and log box refresh cost
+# ------------------------------------------------------------------------------
+def bench_gui(count):
+    try:
+        import tkinter
+        import rover_client_GUI as gui
+        tk_win = tkinter.Tk()
+    except Exception as e:
+        return {'skipped': str(e) or type(e).__name__}
+    tk_win.withdraw()
+    gui.tk_win = tk_win
+    for channel in ('system','control','motor','rtt','video'):
+        gui.gui_log_boxes[('rover',channel)] = tkinter.Text(tk_win,width=20,height=1)
+    gui.gui_log_boxes[(None,'status')] = tkinter.Text(tk_win,width=20,height=1)
+
+    # post: the engine status callback, as called from the network thread
+    start = time.perf_counter()
+    for i in range(count):
+        gui.func_engine_status('rover','control',"Control: 7,{},0,0,0".format(i % 100),True)
+    post = (time.perf_counter() - start) / count
+
+    # refresh: drain a refresh period worth of updates and repaint
+    refreshes = max(1,count // 100)
+    refresh_time = 0.0
+    for r in range(refreshes):
+        for i in range(100):
+            gui.func_engine_status('rover',('control','motor','video')[i % 3],"update {} {}".format(r,i),True)
+        start = time.perf_counter()
+        gui.func_gui_refresh()
+        refresh_time += time.perf_counter() - start
+    tk_win.destroy()
+    return {'post_us': post * 1e6,'refresh_us': refresh_time / refreshes * 1e6}
+
+# ------------------------------------------------------------------------------
+# flatten(results) - {'a.b.c': number}
+# ------------------------------------------------------------------------------
+def flatten(results,prefix=''):
+    flat = {}
+    for key,value in results.items():
+        if isinstance(value,dict):
+            flat.update(flatten(value,prefix + key + '.'))
+        elif isinstance(value,(int,float)) and not isinstance(value,bool):
+            flat[prefix + key] = value
+    return flat
+
+# ------------------------------------------------------------------------------
+# compare(results,baseline,tolerance) - list of regression messages
+# ------------------------------------------------------------------------------
+def compare(results,baseline,tolerance):
+    current,previous = flatten(results),flatten(baseline)
+    regressions = []
+    for key,value in current.items():
+        old = previous.get(key)
+        if not old: continue
+        for pattern,direction in CHECKS:
+            if not fnmatch.fnmatchcase(key,pattern): continue
+            change = (value - old) / abs(old) * direction
+            if change < -tolerance:
+                regressions.append("{}: {:.4g} -> {:.4g} ({:+.0%})".format(key,old,value,(value - old) / abs(old)))
+    return regressions
+
+# ##############################################################################
+#
+# Main
+#
+# ##############################################################################
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rover client end-to-end benchmark")
+    parser.add_argument('--config',default=rover_config.ROVER_CONFIG_FILE,help="configuration file, ports and client settings")
+    parser.add_argument('--duration',type=float,default=BENCH_DURATION,help="seconds per measurement")
+    parser.add_argument('--only',default=','.join(BENCHMARKS),help="comma separated benchmarks: " + ','.join(BENCHMARKS))
+    parser.add_argument('--probe-port',type=int,default=BENCH_PROBE_PORT,help="simulator link probe echo port")
+    parser.add_argument('--loss',type=float,default=0.0,help="simulated UDP loss probability")
+    parser.add_argument('--latency',type=float,default=0.0,help="simulated UDP one-way latency in seconds")
+    parser.add_argument('--jitter',type=float,default=0.0,help="simulated UDP latency jitter in seconds")
+    parser.add_argument('--output',default=None,help="JSON results file, default stdout")
+    parser.add_argument('--baseline',default=None,help="JSON results of an earlier run")
+    parser.add_argument('--tolerance',type=float,default=BENCH_TOLERANCE,help="allowed relative regression")
+    args = parser.parse_args()
+
+    simulator_args = ['--loss',str(args.loss),'--latency',str(args.latency),'--jitter',str(args.jitter),
+        '--probe-port',str(args.probe_port)]
+    # events stay in memory, the results go to stdout
+    rover_log.LOG.console = False
+
+    # client and simulator both on this host
+    settings = rover_config.load_settings(args.config)
+    settings.ROVER_IP = '127.0.0.1'
+    settings.LINK_PROBE_UDP_PORT = args.probe_port
+    settings.METRICS_PORT = 0
+    settings.TELEMETRY_RECORD = 0
+    config = os.path.join(tempfile.mkdtemp(prefix='rover-bench-'),'rover.conf')
+    write_config(settings,config)
+
+    results = {
+        'time': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'host': platform.node(),
+        'python': platform.python_version(),
+        'duration': args.duration,
+        'impairment': {'loss': args.loss,'latency': args.latency,'jitter': args.jitter},
+    }
+    for name in args.only.split(','):
+        print("[BENCH]> {}".format(name),file=sys.stderr)
+        if name == 'control':
+            results[name] = bench_control(settings,config,args.duration)
+        elif name == 'latency':
+            results[name] = bench_latency(settings,config,BENCH_LATENCY_COUNT)
+        elif name == 'telemetry':
+            results[name] = bench_telemetry(settings,config,args.duration)
+        elif name == 'video':
+            results[name] = bench_video(settings,config,args.duration)
+        elif name == 'gui':
+            results[name] = bench_gui(BENCH_GUI_UPDATES)
+        else:
+            parser.error("unknown benchmark: {}".format(name))
+
+    text = json.dumps(results,indent=2)
+    if args.output:
+        with open(args.output,'w') as f: f.write(text + '\n')
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline) as f: baseline = json.load(f)
+        regressions = compare(results,baseline,args.tolerance)
+        for msg in regressions: print("[BENCH]> regression: {}".format(msg),file=sys.stderr)
+        sys.exit(1 if regressions else 0)
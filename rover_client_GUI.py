@@ -6,16 +6,19 @@
 #
 # ##############################################################################
 
+# The window is shown first; configuration and engine modules are imported
+# in main once it is up, pygame, NumPy, psutil and PyAV/Pillow when a channel
+# needs them. The event log only needs the standard library.
+
+import time                     # Time acquisition and formatting
+startup_clock = time.perf_counter()
 from tkinter import *           # GUI user interface
-import socket                   # Network communication
-import pygame                   # Joystick interface
 import os                       # Operating system interface
 import sys                      # System call 
-import time                     # Time acquisition and formatting
-import subprocess               # External process control
-import threading                # Thread control
-import psutil                   # Process and system monitoring
-from tendo import singleton     # Mutex 
+import queue                    # Thread-safe GUI update queue
+import fcntl                    # Single instance lock
+import signal                   # Event log dump
+import rover_log                # Event log
 
 # ##############################################################################
 #
@@ -23,20 +26,6 @@ from tendo import singleton     # Mutex
 #
 # ##############################################################################
 
-# Thread control objects
-RUN_CONTROL_THREAD = True
-RUN_VIDEO_THREAD = True
-RUN_TELEMETRY_THREAD = True
-RUN_SUPERVISOR_THREAD = True
-
-# Debug output flags
-DEBUG_OUTPUT = True
-DEBUG_CONTROL = True
-DEBUG_VIDEO = True
-DEBUG_TELEMETRY = True
-DEBUG_SUPERVISOR = True
-DEBUG_SYSTEM = True
-
 # Configuration file name
 ROVER_CONFIG_FILE = 'rover.conf'
 
@@ -48,9 +37,32 @@ screen_y = 50
 btn_width = 16
 btn_heigth = 2
 font_size = 10
+gui_refresh_ms = 100
+video_refresh_ms = 20
+
+# GUI update queue: the network thread posts (log_box,msg,bg) tuples, the Tk
+# main loop drains it every gui_refresh_ms and repaints each log box once
+gui_queue = queue.Queue()
+gui_shown = {}
+
+# engine running every channel of every rover, started once the window is up
+engine = None
 
-# video player process id
-player_pid = None
+# lock file held while the program runs
+gui_lock = None
+
+# (rover,channel) -> log box, only for the log boxes shown; rover is None
+# for the fleet status line
+gui_log_boxes = {}
+
+# rover name -> frame of its status row, and the rover shown as driven
+gui_rover_frames = {}
+gui_driven = None
+
+# in-process video decoder: rover name -> latest picture not shown yet, set
+# by the decoder threads; rover name -> (window,label) showing the pictures
+gui_video_frames = {}
+gui_video_windows = {}
 
 # ##############################################################################
 #
@@ -60,505 +72,323 @@ player_pid = None
 
 # ##############################################################################
 #
-# Thread control functions
+# Channel control functions
+#
+# A rover name selects one rover, None every rover of the fleet.
 #
 # ##############################################################################
 
 # ------------------------------------------------------------------------------
-# start_all_treads()
+# start_all_channels()
 # ------------------------------------------------------------------------------
-def start_all_treads():
-    if DEBUG_OUTPUT: print("[MSG]> start all threads")
-    start_control_thread()
-    start_video_thread()
-    start_telemetry_thread()
+def start_all_channels():
+    if engine is None: return
+    rover_log.info('gui',"start all channels")
+    start_control_channel()
+    start_video_channel()
+    start_telemetry_channel()
 
 # ------------------------------------------------------------------------------
-# stop_all_treads()
+# stop_all_channels()
 # -----------------------------------------------------------------------------
-def stop_all_treads():
-    if DEBUG_OUTPUT: print("[MSG]> stop all threads")
-    stop_control_thread()
-    stop_video_thread()
-    stop_telemetry_thread()
-
-# ##############################################################################
-#
-# Supervisor functions
-#
-# ##############################################################################
+def stop_all_channels():
+    if engine is None: return
+    rover_log.info('gui',"stop all channels")
+    stop_control_channel()
+    stop_video_channel()
+    stop_telemetry_channel()
 
 # ------------------------------------------------------------------------------
-# stop_supervisor_thread()
+# start_control_channel(rover) / stop_control_channel(rover)
 # ------------------------------------------------------------------------------
-def stop_supervisor_thread():
-     global RUN_SUPERVISOR_THREAD
-     if DEBUG_SUPERVISOR: print("[MSG]> stop supervisor thread")
-     RUN_SUPERVISOR_THREAD=False
+def start_control_channel(rover=None):
+    engine.start_control(0,rover=rover)
 
-# ------------------------------------------------------------------------------
-# start_supervisor_thread()
-# ------------------------------------------------------------------------------
-def start_supervisor_thread():
-    if DEBUG_SUPERVISOR: print("[MSG]> start supervisor thread")
-    t = threading.Thread(name='supervisor',target=start_supervisor, args=())
-    t.daemon = True
-    t.start()
+def stop_control_channel(rover=None):
+    engine.stop_control(rover)
 
 # ------------------------------------------------------------------------------
-# start_supervisor()
+# start_video_channel(rover) / stop_video_channel(rover)
 # ------------------------------------------------------------------------------
-def start_supervisor():
-    global RUN_SUPERVISOR_THREAD
-    while True:
-        if(RUN_SUPERVISOR_THREAD == False): sys.exit()
-        for t in threading.enumerate():
-            if (t.is_alive):
-                if DEBUG_SUPERVISOR: print("[MSG]> {0} is alive".format(t.name))
-        time.sleep(1)
+def start_video_channel(rover=None):
+    for name in engine.rovers:
+        if rover and name != rover: continue
+        engine.start_video(video_geometry(name),rover=name)
 
-# ##############################################################################
-#
-# Control functions
-#
-# ##############################################################################
+def stop_video_channel(rover=None):
+    engine.stop_video(rover)
 
 # ------------------------------------------------------------------------------
-# stop_control_thread()
+# prepare_video_players() - standby players, started once the engine runs
 # ------------------------------------------------------------------------------
-def stop_control_thread():
-    global RUN_CONTROL_THREAD
-    global control_log
-    if DEBUG_CONTROL: print("[MSG]> stop control thread")
-    RUN_CONTROL_THREAD=False
+def prepare_video_players():
+    for name in engine.rovers:
+        engine.prepare_video(video_geometry(name),rover=name)
 
 # ------------------------------------------------------------------------------
-# start_control_thread()
+# video_geometry(rover) - "x:y" of the player window, read on the Tk thread;
+# player windows of a fleet are cascaded
 # ------------------------------------------------------------------------------
-def start_control_thread():
-    global ROVER_IP
-    global ROVER_CONTROL_PORT
-    global RUN_CONTROL_THREAD
-    global control_log
-
-    if DEBUG_CONTROL: print("[MSG]> start control thread")
-
-    # update GUI information
-    func_success_msg(control_log,"Control: started")
-
-    # set control thread flag to true
-    RUN_CONTROL_THREAD=True
+def video_geometry(rover):
+    global tk_win
 
-    # start control thread
-    t = threading.Thread(name='control',target=start_control, args=(0,ROVER_IP,ROVER_CONTROL_PORT,))
-    t.daemon = True
-    t.start()
+    index = list(engine.rovers).index(rover)
+    win_x = (tk_win.winfo_x() + 200 + index * 40)
+    win_y = (tk_win.winfo_y() - 24 + index * 40)
+    return "{}:{}".format(win_x,win_y)
 
 # ------------------------------------------------------------------------------
-# start_control(device_id,robot_ip,robot_port)
+# start_recording(rover) / stop_recording(rover)
 # ------------------------------------------------------------------------------
-def start_control(device_id,robot_ip,robot_port):
-    global RUN_CONTROL_THREAD
-    global control_log
-    global motor_log
-
-    if DEBUG_CONTROL: print("[MSG]> start_control()")
-
-    if (RUN_CONTROL_THREAD == False): sys.quit()
-
-    # UDP_send_data(data,ip,port)
-    def UDP_send_data(data,ip,port):
-        error_code = 0
-        data=data.encode()
-        UDP_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        UDP_socket.sendto(data,(ip,port))
-        return error_code
-
-    # data_to_pwm(axis_1,axis_2)
-    def data_to_pwm(axis_1,axis_2):
-        deviation = 0.01
-        LF,LR,RL,RR = 0,0,0,0
-        if axis_1 < 0:
-            LF = abs(int (axis_1 * 100))
-        elif axis_1 > 0:
-            LR = abs(int ((axis_1 + deviation ) * 100))
-        if axis_2 < 0:
-            RL = abs(int (axis_2 * 100))
-        elif axis_2 > 0:
-            RR = abs(int ((axis_2 + deviation) * 100))
-        return (LF,LR,RL,RR)
-
-    # function main
-    interference_level = 99
-    LF,LR,RL,RR = 0,0,0,0
-
-    # init pygame object
-    pygame.init()
-    pygame.joystick.init() # main joystick device system
-    clock = pygame.time.Clock()
-
-    # init joystick
-    try:
-        j = pygame.joystick.Joystick(device_id) # create a joystick instance
-        j.init() # init instance
-        if DEBUG_CONTROL: print("[JOY]> Enabled joystick: {}".format(j.get_name()))
-    except pygame.error:
-        if DEBUG_CONTROL: print("[JOY]> no joystick found.")
-        func_error_msg(control_log,"Joystick error")
-
-    try:
-        # get user input and send to control server
-        while RUN_CONTROL_THREAD:
-            control_msg = ""
-            # get button and hat events
-            for e in pygame.event.get():
-                if e.type == pygame.JOYHATMOTION:
-                    hat_data = []
-                    eventID = str(e.type)
-                    hat_data.append(eventID)
-                    hat_data.append(str(j.get_hat(0)[0]))
-                    hat_data.append(str(j.get_hat(0)[1]))
-                    control_msg = ",".join(hat_data)
-
-                elif e.type == pygame.JOYBUTTONDOWN:
-                    bd_data = []
-                    eventID = str(e.type)
-                    bd_data.append(eventID)
-                    for button in range(0,12):
-                        bd_data.append(str(j.get_button(button)))
-                    control_msg = ",".join(bd_data)
-
-                elif e.type == pygame.JOYBUTTONUP:
-                    bu_data = []
-                    eventID = str(e.type)
-                    bu_data.append(eventID)
-                    for button in range(0,12):
-                        bu_data.append(str(j.get_button(button)))
-                    control_msg = ",".join(bu_data)
-
-            # send button and hat control values
-            if control_msg != "":
-                if DEBUG_CONTROL: print("[BTN]> {0}".format(control_msg))
-                UDP_send_data(control_msg,robot_ip, robot_port)
-                func_success_msg(control_log,control_msg)
-
-            # get joystick values
-            control_msg = ""
-            left_j_value = 0
-            right_j_value = 0
-            left_j_value = j.get_axis(1)
-            right_j_value = j.get_axis(2)
-
-            # format joystick values as control message
-            if (left_j_value or right_j_value):
-                LF,LR,RL,RR=0,0,0,0
-                LF,LR,RL,RR = data_to_pwm(left_j_value,right_j_value)
-                if LF < interference_level: LF=0
-                if LR < interference_level: LR=0
-                if RL < interference_level: RL=0
-                if RR < interference_level: RR=0
-                control_msg = '7,{},{},{},{}'.format(LF,LR,RL,RR)
-
-            # send joystick control message
-            if control_msg != "":
-                if DEBUG_CONTROL: print("[JOY]> {0}".format(control_msg))
-                UDP_send_data(control_msg,robot_ip, robot_port)
-                control_msg = "Control: " + str(control_msg)
-                func_success_msg(control_log,control_msg)
-
-            clock.tick(100)
-
-    finally:
-         func_error_msg(control_log,"Control: stopped")
-         func_error_msg(motor_log,"Motor: no data")
+def start_recording(rover=None):
+    engine.start_recording(rover)
 
-# ##############################################################################
-#
-# Video functions
-#
-# ##############################################################################
+def stop_recording(rover=None):
+    engine.stop_recording(rover)
 
 # ------------------------------------------------------------------------------
-# stop_video_thread()
+# next_profile(rover) - next drive profile, shown in the control log box
 # ------------------------------------------------------------------------------
-def stop_video_thread():
-    global RUN_VIDEO_THREAD
-    global player_pid
-    global video_log
-
-    if DEBUG_VIDEO: print("[MSG]> stop video thread")
-
-    # set video thread to False
-    RUN_VIDEO_THREAD=False
-
-    # kill stream player program
-    try:
-        if psutil.pid_exists(player_pid):
-            if DEBUG_VIDEO: print("[MSG]> kill video player - pid: {}".format(player_pid))
-            p = psutil.Process(int(player_pid))
-            p.kill()
-    finally:
-        player_pid = None
+def next_profile(rover):
+    engine.next_profile(rover)
 
 # ------------------------------------------------------------------------------
-# start_video_thread()
+# export_rtt(rover) - control round-trip histogram to a file, the file name
+# is shown in the control log box
 # ------------------------------------------------------------------------------
-def start_video_thread():
-    global ROVER_IP
-    global ROVER_VIDEO_PORT
-    global RUN_VIDEO_THREAD
-    global video_log
-
-    if DEBUG_VIDEO: print("[MSG]> start video thread")
-
-    # update GUI information
-    func_success_msg(video_log,"Video: started")
-
-    # set video thread to True
-    RUN_VIDEO_THREAD=True
-
-    # start video thread
-    t = threading.Thread(name='video',target=start_video, args=(ROVER_IP,ROVER_VIDEO_PORT))
-    t.daemon = True
-    t.start()
+def export_rtt(rover):
+    engine.export_rtt(rover)
 
 # ------------------------------------------------------------------------------
-# start_video(robot_ip,robot_port)
+# start_telemetry_channel(rover) / stop_telemetry_channel(rover)
 # ------------------------------------------------------------------------------
-def start_video(robot_ip,robot_port):
-    global RUN_VIDEO_THREAD
-    global tk_win
-    global video_log
-    global player_pid
-    PKT_SIZE = 1024
-
-    # stream player window information
-    win_x = (tk_win.winfo_x() + 200)
-    win_y = (tk_win.winfo_y() - 24)
-    geometry_string = "{}:{}".format(win_x,win_y)
-
-    # stream player command line
-    #cmdline = ['mplayer','-fps','40','-geometry',geometry_string,'-xy', '800','-msglevel','all=-1','-cache','256','-']
-    cmdline = ['mplayer','-fps','48','-geometry',geometry_string,'-xy', '800','-msglevel','all=-1','-nocache','-']
-
-    if DEBUG_VIDEO: print("[MSG]> start_video()")
-
-    if (RUN_VIDEO_THREAD == False): sys.quit()
+def start_telemetry_channel(rover=None):
+    engine.start_telemetry(rover)
 
-    # check if rover is up
-    if (func_icmp_echo_request(robot_ip) == -1):
-        if DEBUG_VIDEO: print("[MSG]> error: network")
-        func_error_msg(video_log,"Error: rover is down")
-        return
+def stop_telemetry_channel(rover=None):
+    engine.stop_telemetry(rover)
 
-    # connect to video server
-    try:
-        client_socket = socket.socket()
-        client_socket.connect((robot_ip,robot_port))
-        if DEBUG_VIDEO: print("[MSG]> success: connected to {}:{}".format(robot_ip,robot_port))
-    except Exception as e:
-        if DEBUG_VIDEO: print("[MSG]> X error: {}".format(str(e)))
-        if DEBUG_VIDEO: print("[MSG]> error: not connected to {}:{}".format(robot_ip,robot_port))
-        func_error_msg(video_log,"Error: socket connect")
-
-    # recv data from video server and send player
-    else:
-        data_recv = 0
-        try:
-            # open video player
-            player = subprocess.Popen(cmdline, stdin=subprocess.PIPE)
-            player_pid = player.pid
-            if DEBUG_VIDEO: print("[MSG]> player pid: {}".format(player_pid))
-
-            while True:
-                #receive data from video server
-                data = client_socket.recv(PKT_SIZE)
-
-                # check for video thread flag
-                if(RUN_VIDEO_THREAD == False):
-                    break
-                else:
-                    # calculate total amount of data received
-                    data_recv += len(data)
-                    if not data:
-                        if DEBUG_VIDEO: print('[MSG]> error: connection closed')
-                        func_error_msg(video_log,"Error: connection")
-                        break
-
-                    # send receive data to stream player
-                    player.stdin.write(data)
-                    func_success_msg(video_log,data_recv)
-
-        except Exception as e:
-            if DEBUG_VIDEO: print("[MSG]> error: {}".format(str(e)))
-            func_error_msg(video_log,"Error: network")
-        finally:
-            player.terminate()
-            client_socket.close()
-            time.sleep(1)
-            func_error_msg(video_log,"Video: channel closed")
-            if DEBUG_VIDEO: print("[MSG]> video channel closed")
+# ------------------------------------------------------------------------------
+# func_drive_btn(rover) - the gamepad drives this rover
+# ------------------------------------------------------------------------------
+def func_drive_btn(rover):
+    engine.select_rover(rover)
 
 # ##############################################################################
 #
-# Telemetry functions
+# System functions
 #
 # ##############################################################################
 
 # ------------------------------------------------------------------------------
-# stop_telemetry_thread()
+# func_ping_rover(rover) - shows the cached link state, never blocks; the
+# rover server's answer to a system 'ping' follows in the same log box
 # ------------------------------------------------------------------------------
-def stop_telemetry_thread():
-    global RUN_TELEMETRY_THREAD
-    if DEBUG_TELEMETRY: print("[MSG]> stop telemetry thread")
-    RUN_TELEMETRY_THREAD = False
+def func_ping_rover(rover):
+    system_log = gui_log_boxes[(rover,'system')]
+    state = engine.link_state(rover)
+    if state.up:
+        func_success_msg(system_log,'System: rover is UP {:.1f} ms'.format(state.rtt * 1000))
+        engine.ping(rover)
+        return True
+    elif state.up is None:
+        func_error_msg(system_log,'System: probing rover')
+        return False
+    else:
+        func_error_msg(system_log,'System: rover is DOWN')
+        return False
 
 # ------------------------------------------------------------------------------
-# start_telemetry_thread()
+# func_shutdown_btn(rover)
 # ------------------------------------------------------------------------------
-def start_telemetry_thread():
-    global RUN_TELEMETRY_THREAD
-    RUN_TELEMETRY_THREAD = True
-    if DEBUG_TELEMETRY: print("[MSG]> start telemetry thread")
-    t = threading.Thread(name='telemetry',target=start_telemetry, args=(ROVER_IP,ROVER_TELEMETRY_PORT,CLIENT_TELEMETRY_PORT))
-    t.daemon = True
-    t.start()
+def func_shutdown_btn(rover):
+    engine.system_command("sudo shutdown -h now",rover)
+    if GUI_SHOW_SYSTEM: func_error_msg(gui_log_boxes[(rover,'system')],'System: shutdown Rover')
+    if GUI_SHOW_CONTROL: stop_control_channel(rover)
+    if GUI_SHOW_VIDEO: stop_video_channel(rover)
 
 # ------------------------------------------------------------------------------
-# start_telemetry()
+# func_reboot_btn(rover)
 # ------------------------------------------------------------------------------
-def start_telemetry(robot_ip,robot_port,client_port):
-    global RUN_TELEMETRY_THREAD
-    global telemetry_log
-    PKT_SIZE = 1024
-
-    if DEBUG_TELEMETRY: print("[MSG]> start_telemetry_client()")
-    if (RUN_TELEMETRY_THREAD == False): sys.quit()
-
-    TEL_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    TEL_socket.bind(('0.0.0.0',client_port))
-    total_bytes_recv = 0
-
-    try:
-        while RUN_TELEMETRY_THREAD:
-            telemetry_data = TEL_socket.recv(PKT_SIZE)
-            telemetry_data = telemetry_data.decode()
-            if not telemetry_data:
-                if DEBUG_TELEMETRY: print('[MSG]> error: connection closed')
-                break
-            if DEBUG_TELEMETRY: print(telemetry_data)
-            d=telemetry_data.split(',')
-            if(d[0] == '$MOT'):
-                if d[1]:
-                    mot_data="Motor: {}".format(d[1])
-                    func_success_msg(motor_log,mot_data)
-
-    except Exception as e:
-        if DEBUG_TELEMETRY: print("[MSG]> exception: {}".format(str(e)))
-    finally:
-        TEL_socket.close()
-        if DEBUG_TELEMETRY: print("[MSG]> telemetry channel closed")
-        func_error_msg(tag_log,"Telemetry stopped")
+def func_reboot_btn(rover):
+    engine.system_command("sudo shutdown -r now",rover)
+    if GUI_SHOW_SYSTEM: func_error_msg(gui_log_boxes[(rover,'system')],'System: reboot Rover')
+    if GUI_SHOW_CONTROL: stop_control_channel(rover)
+    if GUI_SHOW_VIDEO: stop_video_channel(rover)
 
 # ##############################################################################
 #
-# System functions
+# GUI functions
 #
 # ##############################################################################
 
 # ------------------------------------------------------------------------------
-# func_system_cmd(robot_ip,robot_port,msg_string)
+# func_success_msg(log_box,msg) - safe to call from any thread
 # ------------------------------------------------------------------------------
-def func_system_cmd(robot_ip,robot_port,msg_string):
-    PKT_SIZE = 1024
-    global DEBUG_SYSTEM
-    try:
-        client_socket = socket.socket()
-        client_socket.connect((robot_ip,robot_port))
-        if DEBUG_SYSTEM: print("[MSG]> success: connected to {}:{}".format(robot_ip,robot_port))
-    except Exception as e:
-        if DEBUG_SYSTEM: print("[MSG]> error: {}".format(str(e)))
-        if DEBUG_SYSTEM: print("[MSG]> error: not connected to {}:{}".format(robot_ip,robot_port))
-    try:
-        client_socket.sendall(msg_string.encode())
-    finally:
-        client_socket.shutdown(socket.SHUT_RDWR)
-        client_socket.close()
+def func_success_msg(log_box,msg):
+    gui_queue.put((log_box,msg,'green'))
 
 # ------------------------------------------------------------------------------
-# func_ping_rover()
+# func_error_msg(log_box,msg) - safe to call from any thread
 # ------------------------------------------------------------------------------
-def func_ping_rover():
-    global ROVER_IP
-    global system_log
-    ret = func_icmp_echo_request(ROVER_IP)
-    if(ret == 1):
-        func_success_msg(system_log,'System: rover is UP')
-        return True
-    else:
-        func_error_msg(system_log,'System: rover is DOWN')
-        return False
+def func_error_msg(log_box,msg):
+    gui_queue.put((log_box,msg,'red'))
 
 # ------------------------------------------------------------------------------
-# func_shutdown_btn()
+# func_engine_status(rover,channel,msg,ok) - engine status callback, any thread
 # ------------------------------------------------------------------------------
-def func_shutdown_btn():
-    global system_log
-    func_system_cmd(ROVER_IP,ROVER_SYSTEM_PORT,"sudo shutdown -h now")
-    if GUI_SHOW_SYSTEM: func_error_msg(system_log,'System: shutdown Rover')
-    if GUI_SHOW_CONTROL: stop_control_thread()
-    if GUI_SHOW_VIDEO: stop_video_thread()
+def func_engine_status(rover,channel,msg,ok):
+    log_box = gui_log_boxes.get((rover,channel))
+    if log_box is None: return
+    if ok:
+        func_success_msg(log_box,msg)
+    else:
+        func_error_msg(log_box,msg)
 
 # ------------------------------------------------------------------------------
-# func_reboot_btn()
+# func_video_frame(rover,image) - in-process decoder callback, decoder thread;
+# only the latest picture is kept
 # ------------------------------------------------------------------------------
-def func_reboot_btn():
-    global system_log
-    func_system_cmd(ROVER_IP,ROVER_SYSTEM_PORT,"sudo shutdown -r now")
-    if GUI_SHOW_SYSTEM: func_error_msg(system_log,'System: reboot Rover')
-    if GUI_SHOW_CONTROL: stop_control_thread()
-    if GUI_SHOW_VIDEO: stop_video_thread()
+def func_video_frame(rover,image):
+    gui_video_frames[rover] = image
 
 # ------------------------------------------------------------------------------
-# func_icmp_echo_request(ip)
+# func_video_refresh() - show decoded pictures, runs on a Tk after() timer
 # ------------------------------------------------------------------------------
-def func_icmp_echo_request(ip):
-    icmp_delay = 2
-    try:
-        ret = subprocess.call("ping -c 1 -W {} {}".format(icmp_delay,ip), shell=True)
-        if DEBUG_SYSTEM: print(ret)
-    except:
-        return -1
-    if (ret == 0): return 1
-    else: return -1
-
-# ##############################################################################
-#
-# GUI functions
-#
-# ##############################################################################
+def func_video_refresh():
+    global tk_win
 
-# ------------------------------------------------------------------------------
-# func_success_msg(log_box,msg)
-# ------------------------------------------------------------------------------
-def func_success_msg(log_box,msg):
+    for rover in list(gui_video_frames):
+        image = gui_video_frames.pop(rover)
+        window = gui_video_windows.get(rover)
+        if image is None:
+            # end of stream
+            if window: window[0].destroy()
+            gui_video_windows.pop(rover,None)
+            continue
+        if window is None:
+            top = Toplevel(tk_win)
+            top.title("{} video".format(rover))
+            x,y = video_geometry(rover).split(':')
+            top.geometry("+{}+{}".format(x,y))
+            # closing the window stops the video channel
+            top.protocol("WM_DELETE_WINDOW", lambda rover=rover: stop_video_channel(rover))
+            label = Label(top)
+            label.pack(fill=BOTH, expand=1)
+            window = gui_video_windows[rover] = (top,label)
+        from PIL import ImageTk
+        photo = ImageTk.PhotoImage(image)
+        window[1]['image'] = photo
+        # Tk keeps no reference of its own
+        window[1].image = photo
+
+    tk_win.after(video_refresh_ms,func_video_refresh)
+
+# ------------------------------------------------------------------------------
+# func_paint_msg(log_box,msg,bg) - Tk main thread only
+# ------------------------------------------------------------------------------
+def func_paint_msg(log_box,msg,bg):
     log_box['state'] = 'normal'
-    log_box.delete(1.0, 2.0)
+    log_box.delete(1.0, 'end')
     log_box.insert('end',msg)
-    log_box['bg'] = 'green'
+    log_box['bg'] = bg
     log_box['fg'] = 'white'
     log_box['state'] = 'disabled'
 
 # ------------------------------------------------------------------------------
-# func_error_msg(log_box,msg)
+# func_log_box(parent,text,height) - read-only status box
 # ------------------------------------------------------------------------------
-def func_error_msg(log_box,msg):
-    log_box['state'] = 'normal'
-    log_box.delete(1.0, 2.0)
-    log_box.insert('end',msg)
+def func_log_box(parent,text,height=1):
+    log_box = Text(parent, state='normal', width=20, height=height, wrap='none',font=('TkDefaultFont', font_size))
+    log_box.pack(fill=BOTH)
     log_box['bg'] = 'red'
     log_box['fg'] = 'white'
+    log_box.insert('end',text)
     log_box['state'] = 'disabled'
+    return log_box
+
+# ------------------------------------------------------------------------------
+# func_rover_row(parent,rover,fleet) - buttons and log boxes of one rover
+# ------------------------------------------------------------------------------
+def func_rover_row(parent,rover,fleet):
+    frame = LabelFrame(parent, text=rover)
+    frame.pack(fill=BOTH, expand=1)
+    gui_rover_frames[rover] = frame
+
+    if fleet:
+        drive_btn = Button(frame, text="Drive", command=lambda: func_drive_btn(rover))
+        drive_btn.pack(fill=BOTH, expand=1)
+
+    if GUI_SHOW_SYSTEM:
+        #system buttons
+        ping_rover_btn = Button(frame, text="Ping Rover", command=lambda: func_ping_rover(rover))
+        ping_rover_btn.pack(fill=BOTH, expand=1)
+        reboot_rover_btn = Button(frame, text="Reboot Rover", command=lambda: func_reboot_btn(rover))
+        reboot_rover_btn.pack(fill=BOTH, expand=1)
+        shutdown_rover_btn = Button(frame, text="Shutdown Rover", command=lambda: func_shutdown_btn(rover))
+        shutdown_rover_btn.pack(fill=BOTH, expand=1)
+        #system log box
+        gui_log_boxes[(rover,'system')] = func_log_box(frame,'System: no data')
+
+    if GUI_SHOW_CONTROL:
+        # control buttons
+        start_control_btn = Button(frame, text="Start control", command=lambda: start_control_channel(rover))
+        start_control_btn.pack(fill=BOTH, expand=1)
+        stop_control_btn = Button(frame, text="Stop control", command=lambda: stop_control_channel(rover))
+        stop_control_btn.pack(fill=BOTH, expand=1)
+        next_profile_btn = Button(frame, text="Next profile", command=lambda: next_profile(rover))
+        next_profile_btn.pack(fill=BOTH, expand=1)
+        # control and motor log boxes
+        gui_log_boxes[(rover,'control')] = func_log_box(frame,'Control: no data')
+        gui_log_boxes[(rover,'motor')] = func_log_box(frame,'Motor: no data')
+        # control round trip, control frame to $MOT echo
+        gui_log_boxes[(rover,'rtt')] = func_log_box(frame,'RTT p50/p99/max\nno data',2)
+        export_rtt_btn = Button(frame, text="Export latency", command=lambda: export_rtt(rover))
+        export_rtt_btn.pack(fill=BOTH, expand=1)
+
+    if GUI_SHOW_VIDEO:
+        # video buttons
+        start_video_btn = Button(frame, text="Start video", command=lambda: start_video_channel(rover))
+        start_video_btn.pack(fill=BOTH, expand=1)
+        stop_video_btn = Button(frame, text="Stop video", command=lambda: stop_video_channel(rover))
+        stop_video_btn.pack(fill=BOTH, expand=1)
+        # recording buttons, the video stream stays connected
+        start_record_btn = Button(frame, text="Start recording", command=lambda: start_recording(rover))
+        start_record_btn.pack(fill=BOTH, expand=1)
+        stop_record_btn = Button(frame, text="Stop recording", command=lambda: stop_recording(rover))
+        stop_record_btn.pack(fill=BOTH, expand=1)
+        # video log box
+        gui_log_boxes[(rover,'video')] = func_log_box(frame,'Video: no data')
+
+# ------------------------------------------------------------------------------
+# func_gui_refresh() - drain the GUI update queue, runs on a Tk after() timer
+# ------------------------------------------------------------------------------
+def func_gui_refresh():
+    global tk_win
+    global gui_driven
+
+    # mark the rover driven by the gamepad, switched from the GUI or a button
+    if len(gui_rover_frames) > 1 and engine is not None and engine.active != gui_driven:
+        for name,frame in gui_rover_frames.items():
+            frame['text'] = "{} [driven]".format(name) if name == engine.active else name
+        gui_driven = engine.active
+
+    # keep only the latest update per log box
+    latest = {}
+    try:
+        while True:
+            log_box,msg,bg = gui_queue.get_nowait()
+            latest[log_box] = (str(msg),bg)
+    except queue.Empty:
+        pass
+
+    # repaint log boxes whose content actually changed
+    for log_box,update in latest.items():
+        if gui_shown.get(log_box) != update:
+            func_paint_msg(log_box,*update)
+            gui_shown[log_box] = update
+
+    tk_win.after(gui_refresh_ms,func_gui_refresh)
 
 # ##############################################################################
 #
@@ -566,53 +396,83 @@ def func_error_msg(log_box,msg):
 #
 # ##############################################################################
 
-# ------------------------------------------------------------------------------
-# func_get_setting(setting)
-# ------------------------------------------------------------------------------
-def func_get_setting(setting):
-    f = open(ROVER_CONFIG_FILE, 'r')
-    x = f.readlines()
-    f.close()
-    for item in x:
-        item=item.rstrip("\r\n").replace(" ","")
-        s,v=item.split("=")
-        if(s == setting):return v
-    return False
-
 # ------------------------------------------------------------------------------
 # func_exit_btn()
 # ------------------------------------------------------------------------------
 def func_exit_btn():
     global tk_win
-    global player_pid
-
-    global RUN_CONTROL_THREAD
-    global RUN_VIDEO_THREAD
-    global RUN_TELEMETRY_THREAD
-    global RUN_SUPERVISOR_THREAD
-
-    if DEBUG_SYSTEM: print("[MSG]> exit_btn()")
 
-    RUN_CONTROL_THREAD = False
-    RUN_VIDEO_THREAD = False
-    RUN_TELEMETRY_THREAD = False
-    RUN_SUPERVISOR_THREAD = False
+    rover_log.info('gui',"exit_btn()")
 
     try:
-        if psutil.pid_exists(player_pid):
-            if DEBUG_OUTPUT: print("[MSG]> kill video player - pid: {}".format(player_pid))
-            p = psutil.Process(int(player_pid))
-            p.kill()
-            player_pid = None
+        # cancels every channel: sockets closed, video player killed
+        if engine is not None: engine.stop()
 
     finally:
-        if DEBUG_OUTPUT: print("[MSG]> quit tk window")
+        rover_log.info('gui',"quit tk window")
         tk_win.destroy()
 
-        if DEBUG_OUTPUT: print("[MSG]> exit program")
+        rover_log.info('gui',"exit program")
+        # the kill skips the exit handlers
+        rover_log.LOG.stop()
         os.system("kill {}".format(os.getpid()))
         sys.exit()
 
+# ------------------------------------------------------------------------------
+# func_dump_btn() - last LOG_DUMP_SECONDS of the event log to a file, also
+# on SIGUSR1
+# ------------------------------------------------------------------------------
+def func_dump_btn():
+    if engine is None: return
+    engine.dump_log()
+
+# ------------------------------------------------------------------------------
+# func_single_instance() - False when another client holds the lock
+# ------------------------------------------------------------------------------
+def func_single_instance():
+    global gui_lock
+    gui_lock = open(os.path.join(os.environ.get('TMPDIR','/tmp'),'rover_client_GUI.lock'),'w')
+    try:
+        fcntl.lockf(gui_lock,fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        return False
+    return True
+
+# ------------------------------------------------------------------------------
+# process_age() - seconds since the process was started, 0 when unknown
+# ------------------------------------------------------------------------------
+def process_age():
+    try:
+        with open('/proc/self/stat') as f:
+            # fields after the command name, which may contain spaces
+            started = int(f.read().rsplit(')',1)[1].split()[19]) / os.sysconf('SC_CLK_TCK')
+        with open('/proc/uptime') as f:
+            return max(0.0,float(f.read().split()[0]) - started)
+    except (OSError,ValueError,IndexError):
+        return 0.0
+
+# ------------------------------------------------------------------------------
+# StartupProfile() - time spent in each start-up phase
+# ------------------------------------------------------------------------------
+class StartupProfile:
+
+    def __init__(self):
+        now = time.perf_counter()
+        # interpreter start-up, up to the first line of this program
+        self.origin = now - process_age()
+        self.phases = [('interpreter',startup_clock - self.origin,startup_clock - self.origin)]
+        self.last = startup_clock
+
+    def mark(self,phase):
+        now = time.perf_counter()
+        self.phases.append((phase,now - self.last,now - self.origin))
+        self.last = now
+
+    def report(self):
+        print("[STARTUP]> {:<16} {:>8} {:>8}".format('phase','ms','at ms'))
+        for phase,duration,at in self.phases:
+            print("[STARTUP]> {:<16} {:8.1f} {:8.1f}".format(phase,duration * 1000,at * 1000))
+
 # ##############################################################################
 #
 # Main
@@ -620,121 +480,93 @@ def func_exit_btn():
 # ##############################################################################
 
 if __name__ == "__main__":
+    startup = StartupProfile()
+    rover_log.LOG.start()
+    startup.mark('libraries')
+
     # --------------------------------------------------------------------------
     # Check if an instance of the program is already running.
     # --------------------------------------------------------------------------
-    try:
-        me = singleton.SingleInstance()
-    except:
-        if DEBUG_OUTPUT: print("[MSG]> error: program is already running")
+    if not func_single_instance():
+        rover_log.error('gui',"program is already running")
         sys.exit()
+    startup.mark('single instance')
 
     # --------------------------------------------------------------------------
-    # Get configuration values from file
-    # --------------------------------------------------------------------------
-    try:
-        ROVER_IP = func_get_setting('ROVER_IP')
-        ROVER_SYSTEM_PORT = int(func_get_setting('ROVER_SYSTEM_PORT'))
-        ROVER_CONTROL_PORT = int(func_get_setting('ROVER_CONTROL_PORT'))
-        ROVER_VIDEO_PORT = int(func_get_setting('ROVER_VIDEO_PORT'))
-        ROVER_TELEMETRY_PORT = int(func_get_setting('ROVER_TELEMETRY_PORT'))
-        CLIENT_TELEMETRY_PORT = int(func_get_setting('CLIENT_TELEMETRY_PORT'))
-        GUI_SHOW_SYSTEM = int(func_get_setting('GUI_SHOW_SYSTEM'))
-        GUI_SHOW_CONTROL = int(func_get_setting('GUI_SHOW_CONTROL'))
-        GUI_SHOW_VIDEO = int(func_get_setting('GUI_SHOW_VIDEO'))
-
-        if DEBUG_OUTPUT: print("ROVER_IP: {}".format(ROVER_IP))
-        if DEBUG_OUTPUT: print("ROVER_CONTROL_PORT: {}".format(ROVER_CONTROL_PORT))
-        if DEBUG_OUTPUT: print("ROVER_VIDEO_PORT: {}".format(ROVER_VIDEO_PORT))
-        if DEBUG_OUTPUT: print("ROVER_TELEMETRY_PORT: {}".format(ROVER_TELEMETRY_PORT))
-        if DEBUG_OUTPUT: print("CLIENT_TELEMETRY_PORT: {}".format(CLIENT_TELEMETRY_PORT))
-        if DEBUG_OUTPUT: print("ROVER_SYSTEM_PORT: {}".format(ROVER_SYSTEM_PORT))
-        if DEBUG_OUTPUT: print("GUI_SHOW_CONTROL: {}".format(GUI_SHOW_CONTROL))
-        if DEBUG_OUTPUT: print("GUI_SHOW_VIDEO: {}".format(GUI_SHOW_VIDEO))
-        if DEBUG_OUTPUT: print("GUI_SHOW_SYSTEM: {}".format(GUI_SHOW_SYSTEM))
-
-    except Exception as e:
-        if DEBUG_OUTPUT: print("[MSG]> error: configuration file rover.conf")
-        if DEBUG_OUTPUT: print(str(e))
-        sys.exit(-1)
-
-    # --------------------------------------------------------------------------
-    # Start supervision thread
-    # --------------------------------------------------------------------------
-    start_supervisor_thread()
-
-    # --------------------------------------------------------------------------
-    # Define Tk user interface
+    # Show the Tk window first
     # --------------------------------------------------------------------------
     geometry_string = "{}x{}+{}+{}".format(screen_width,screen_height,screen_x,screen_y)
-    if DEBUG_SYSTEM: print("[MSG]> geometry: {}".format(geometry_string))
-    
+    rover_log.info('gui',"geometry: {}",geometry_string)
+
     # Create GUI object
     tk_win = Tk()
     tk_win.title("Rover Control")
     tk_win.geometry(geometry_string)
-    
-    # Define GUI layout
-    start_btn = Button(tk_win, text="Start", command=start_all_treads)
+
+    start_btn = Button(tk_win, text="Start", command=start_all_channels)
     start_btn.pack(fill=BOTH, expand=1)
-    stop_btn = Button(tk_win, text="Stop", command=stop_all_treads)
+    stop_btn = Button(tk_win, text="Stop", command=stop_all_channels)
     stop_btn.pack(fill=BOTH, expand=1)
-    
-    if GUI_SHOW_SYSTEM:
-        #system buttons
-        ping_rover_btn = Button(tk_win, text="Ping Rover", command=func_ping_rover)
-        ping_rover_btn.pack(fill=BOTH, expand=1)
-        reboot_rover_btn = Button(tk_win, text="Reboot Rover", command=func_reboot_btn)
-        reboot_rover_btn.pack(fill=BOTH, expand=1)
-        shutdown_rover_btn = Button(tk_win, text="Shutdown Rover", command=func_shutdown_btn)
-        shutdown_rover_btn.pack(fill=BOTH, expand=1)
-        #system log box
-        system_log = Text(tk_win, state='normal', width=20, height=1, wrap='none',font=('TkDefaultFont', font_size))
-        system_log.pack(fill=BOTH)
-        system_log['bg'] = 'red'
-        system_log['fg'] = 'white'
-        system_log.insert('end','System: no data')
-        system_log['state'] = 'disabled'
-        
-    if GUI_SHOW_CONTROL:
-        # control buttons
-        start_control_btn = Button(tk_win, text="Start control", command=start_control_thread)
-        start_control_btn.pack(fill=BOTH, expand=1)
-        stop_control_btn = Button(tk_win, text="Stop control", command=stop_control_thread)
-        stop_control_btn.pack(fill=BOTH, expand=1)
-        # control log box
-        control_log = Text(tk_win, state='normal', width=20, height=1, wrap='none',font=('TkDefaultFont', font_size))
-        control_log.pack(fill=BOTH)
-        control_log['bg'] = 'red'
-        control_log['fg'] = 'white'
-        control_log.insert('end','Control: no data')
-        control_log['state'] = 'disabled'
-        # motor log box
-        motor_log = Text(tk_win, state='normal', width=20, height=1, wrap='none',font=('TkDefaultFont', font_size))
-        motor_log.pack(fill=BOTH)
-        motor_log['bg'] = 'red'
-        motor_log['fg'] = 'white'
-        motor_log.insert('end','Motor: no data')
-        motor_log['state'] = 'disabled'
+    tk_win.update()
+    startup.mark('window')
 
-    if GUI_SHOW_VIDEO:
-        # video buttons
-        start_video_btn = Button(tk_win, text="Start video", command=start_video_thread)
-        start_video_btn.pack(fill=BOTH, expand=1)
-        stop_video_btn = Button(tk_win, text="Stop video", command=stop_video_thread)
-        stop_video_btn.pack(fill=BOTH, expand=1)
-        # video log box
-        video_log = Text(tk_win, state='normal', width=20, height=1, wrap='none',font=('TkDefaultFont', font_size))
-        video_log.pack(fill=BOTH)
-        video_log['bg'] = 'red'
-        video_log['fg'] = 'white'
-        video_log.insert('end','Video: no data')
-        video_log['state'] = 'disabled'
+    # --------------------------------------------------------------------------
+    # Get configuration values from file
+    # --------------------------------------------------------------------------
+    import rover_config             # Configuration file
+    try:
+        fleet = rover_config.load_fleet(ROVER_CONFIG_FILE)
+        GUI_SHOW_SYSTEM = fleet[0].GUI_SHOW_SYSTEM
+        GUI_SHOW_CONTROL = fleet[0].GUI_SHOW_CONTROL
+        GUI_SHOW_VIDEO = fleet[0].GUI_SHOW_VIDEO
+        config_error = None
 
+    except Exception as e:
+        rover_log.error('gui',"configuration file {}: {}",ROVER_CONFIG_FILE,str(e))
+        fleet = []
+        config_error = e
+    startup.mark('configuration')
+
+    # --------------------------------------------------------------------------
+    # Define the rest of the Tk user interface
+    # --------------------------------------------------------------------------
+    # one status row per rover
+    for settings in fleet:
+        func_rover_row(tk_win,settings.NAME,len(fleet) > 1)
+    if len(fleet) > 1:
+        # the window takes the height it needs
+        tk_win.geometry("")
+
+    # status log box
+    gui_log_boxes[(None,'status')] = func_log_box(tk_win,'Status: no data',2)
+
+    dump_btn = Button(tk_win, text="Dump log", command=func_dump_btn)
+    dump_btn.pack(fill=BOTH, expand=1)
     exit_btn = Button(tk_win, text="Exit", command=func_exit_btn)
     exit_btn.pack(fill=BOTH, expand=1)
+    tk_win.update()
+    startup.mark('layout')
+
+    if config_error is None:
+        # ----------------------------------------------------------------------
+        # Start network event loop, supervision, link probing and metrics
+        # ----------------------------------------------------------------------
+        import rover_engine             # Channels, without user interface
+        startup.mark('engine import')
+        engine = rover_engine.RoverEngine(fleet,func_engine_status,ROVER_CONFIG_FILE,func_video_frame).start()
+        startup.mark('engine start')
+        # players are started in the background, the window stays responsive
+        prepare_video_players()
+        signal.signal(signal.SIGUSR1,lambda signum,frame: func_dump_btn())
+    else:
+        # no rover to control, the error stays on screen until Exit
+        func_error_msg(gui_log_boxes[(None,'status')],"Config error:\n{}".format(str(config_error)))
+
+    if '--startup-profile' in sys.argv[1:]: startup.report()
 
     # --------------------------------------------------------------------------
     # Start Tk main activity
     # --------------------------------------------------------------------------
+    func_gui_refresh()
+    func_video_refresh()
     tk_win.mainloop()
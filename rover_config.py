@@ -0,0 +1,345 @@
+# ##############################################################################
+#
+# Rover client configuration
+#
+# rover.conf is parsed once into one Settings object per rover: every value
+# converted to its type, checked, and defaulted when the setting is optional.
+# Errors name the file and line:
+#
+#   rover.conf:12: CONTROL_MAX_RATE = fast: not a float
+#
+# File format, one setting per line; blank lines and lines starting with '#'
+# are ignored, spaces around names and values are not significant:
+#
+#   # comment
+#   NAME = value
+#   rover.NAME = value          (one rover of ROVERS only)
+#   PROFILE_name = spec         (drive profile, see rover_control.py)
+#
+# ConfigWatcher polls the file modification time and hands every new valid
+# fleet to the engine, which applies it to the running channels.
+#
+# ##############################################################################
+
+import os                       # File modification time
+import collections              # Drive profile order
+import shlex                    # Player command line check
+import asyncio                  # Watcher coroutine
+import rover_control            # Control defaults
+import rover_video              # Video defaults
+import rover_player             # Video player defaults
+import rover_telemetry          # Telemetry defaults
+import rover_recorder           # Recorder defaults
+import rover_link               # Link prober defaults
+import rover_system             # System link defaults
+import rover_net                # Reconnect defaults
+import rover_log                # Event log defaults
+
+# ##############################################################################
+#
+# Global definitions
+#
+# ##############################################################################
+
+# Configuration file name
+ROVER_CONFIG_FILE = 'rover.conf'
+
+# Rover name when rover.conf does not list ROVERS
+ROVER_DEFAULT_NAME = 'rover'
+
+# Seconds between two checks of the configuration file, and time given to
+# an editor to finish writing it
+CONFIG_RELOAD_INTERVAL = 1.0
+CONFIG_SETTLE_TIME = 0.2
+
+# Value checks: (test, description)
+PORT = (lambda v: 0 < v < 65536,'not a port number 1-65535')
+PORT_OR_OFF = (lambda v: 0 <= v < 65536,'not a port number 0-65535')
+FLAG = (lambda v: v in (0,1),'not 0 or 1')
+POSITIVE = (lambda v: v > 0,'not positive')
+NOT_NEGATIVE = (lambda v: v >= 0,'negative')
+NOT_EMPTY = (lambda v: v != '','empty')
+NAMES = (lambda v: all(n and '.' not in n for n in v.split(',')),'not a list of rover names')
+ANY = (lambda v: True,'')
+
+def one_of(*values):
+    return (lambda v: v in values,'not one of ' + ', '.join(values))
+
+def parses(parse,description):
+    def test(v):
+        try:
+            parse(v)
+        except ValueError:
+            return False
+        return True
+    return (test,description)
+
+COMMAND_LINE = parses(shlex.split,'not a command line')
+LEVELS = parses(rover_video.parse_levels,'not a list of bitrate[:WxH] in decreasing bitrate order')
+LOG_LEVELS = parses(rover_log.parse_levels,'not a list of channel=level')
+
+# Settings read from the configuration file: (name, type, default, check),
+# a setting without default is required
+SETTINGS = (
+    ('ROVERS',str,ROVER_DEFAULT_NAME,NAMES),
+    ('ROVER_IP',str,None,NOT_EMPTY),
+    ('ROVER_SYSTEM_PORT',int,None,PORT),
+    ('ROVER_CONTROL_PORT',int,None,PORT),
+    ('ROVER_VIDEO_PORT',int,None,PORT),
+    ('ROVER_TELEMETRY_PORT',int,None,PORT),
+    ('CLIENT_TELEMETRY_PORT',int,None,PORT),
+    ('SYSTEM_PROTOCOL',str,rover_system.PROTOCOL_RAW,one_of(rover_system.PROTOCOL_FRAMED,rover_system.PROTOCOL_RAW)),
+    ('SYSTEM_TIMEOUT',float,rover_system.COMMAND_TIMEOUT,POSITIVE),
+    ('GUI_SHOW_SYSTEM',int,1,FLAG),
+    ('GUI_SHOW_CONTROL',int,1,FLAG),
+    ('GUI_SHOW_VIDEO',int,1,FLAG),
+    ('CONTROL_FRAME_FORMAT',str,rover_control.FRAME_FORMAT_CSV,
+        one_of(rover_control.FRAME_FORMAT_BINARY,rover_control.FRAME_FORMAT_CSV)),
+    ('CONTROL_MAX_RATE',float,50,POSITIVE),
+    ('CONTROL_DELTA',int,2,NOT_NEGATIVE),
+    ('CONTROL_HEARTBEAT',float,0.5,POSITIVE),
+    ('CONTROL_SWITCH_BUTTON',int,rover_control.SWITCH_BUTTON,NOT_NEGATIVE),
+    ('CONTROL_PROFILES',tuple,rover_control.DEFAULT_PROFILES,None),
+    ('CONTROL_PROFILE',str,rover_control.DEFAULT_PROFILES[0][0],NOT_EMPTY),
+    ('CONTROL_PROFILE_BUTTON',int,rover_control.PROFILE_BUTTON,NOT_NEGATIVE),
+    ('CONTROL_RTT_WINDOW',float,rover_control.RTT_WINDOW,POSITIVE),
+    ('CONTROL_RTT_DIR',str,'latency',NOT_EMPTY),
+    ('VIDEO_PLAYER',str,rover_player.PLAYER_MPLAYER,one_of(*rover_player.PLAYERS)),
+    ('VIDEO_PLAYER_CMD',str,'',COMMAND_LINE),
+    ('VIDEO_PLAYER_FPS',float,rover_player.PLAYER_FPS,POSITIVE),
+    ('VIDEO_PLAYER_STANDBY',int,1,FLAG),
+    ('VIDEO_RELAY_MODE',str,rover_video.RELAY_MODE_AUTO,
+        one_of(rover_video.RELAY_MODE_AUTO,rover_video.RELAY_MODE_SPLICE,rover_video.RELAY_MODE_COPY)),
+    ('VIDEO_READ_SIZE',int,rover_video.RELAY_READ_SIZE,POSITIVE),
+    ('VIDEO_LOW_LATENCY',int,0,FLAG),
+    ('VIDEO_MAX_FRAMES',int,rover_video.JITTER_MAX_FRAMES,POSITIVE),
+    ('VIDEO_LATENCY_BUDGET',float,rover_video.JITTER_LATENCY_BUDGET,POSITIVE),
+    ('VIDEO_RECORD',int,0,FLAG),
+    ('VIDEO_RECORD_DIR',str,'video',NOT_EMPTY),
+    ('VIDEO_RECORD_SEGMENT_SIZE',int,rover_video.RECORD_SEGMENT_SIZE,POSITIVE),
+    ('VIDEO_RECORD_SEGMENT_TIME',float,rover_video.RECORD_SEGMENT_TIME,POSITIVE),
+    ('VIDEO_RECORD_QUEUE',int,rover_video.RECORD_QUEUE_SIZE,POSITIVE),
+    ('VIDEO_ADAPTIVE',int,0,FLAG),
+    ('VIDEO_ADAPT_LEVELS',str,rover_video.ADAPT_LEVELS,LEVELS),
+    ('VIDEO_ADAPT_COMMAND',str,rover_video.ADAPT_COMMAND,NOT_EMPTY),
+    ('VIDEO_ADAPT_DOWN_TIME',float,rover_video.ADAPT_DOWN_TIME,POSITIVE),
+    ('VIDEO_ADAPT_UP_TIME',float,rover_video.ADAPT_UP_TIME,POSITIVE),
+    ('TELEMETRY_HISTORY',int,rover_telemetry.TELEMETRY_HISTORY,POSITIVE),
+    ('TELEMETRY_RECORD',int,0,FLAG),
+    ('TELEMETRY_RECORD_DIR',str,'telemetry',NOT_EMPTY),
+    ('TELEMETRY_RECORD_SIZE',int,rover_recorder.RECORD_FILE_SIZE,POSITIVE),
+    ('TELEMETRY_RCVBUF',int,rover_net.RECEIVE_BUFFER,POSITIVE),
+    ('TELEMETRY_BATCH',int,rover_net.RECEIVE_BATCH,POSITIVE),
+    ('LINK_PROBE_INTERVAL',float,rover_link.PROBE_INTERVAL,POSITIVE),
+    ('LINK_PROBE_TIMEOUT',float,rover_link.PROBE_TIMEOUT,POSITIVE),
+    ('LINK_PROBE_UDP_PORT',int,rover_link.PROBE_UDP_PORT,PORT),
+    ('RECONNECT_MAX_DELAY',float,rover_net.RECONNECT_MAX_DELAY,POSITIVE),
+    ('METRICS_PORT',int,0,PORT_OR_OFF),
+    ('CONFIG_RELOAD_INTERVAL',float,CONFIG_RELOAD_INTERVAL,NOT_NEGATIVE),
+    ('LOG_LEVEL',str,rover_log.LOG_LEVEL,one_of(*rover_log.LEVELS)),
+    ('LOG_LEVELS',str,'',LOG_LEVELS),
+    ('LOG_FILE',str,'',ANY),
+    ('LOG_RING_SIZE',int,rover_log.LOG_RING_SIZE,POSITIVE),
+    ('LOG_DUMP_SECONDS',float,rover_log.LOG_DUMP_SECONDS,POSITIVE),
+    ('LOG_DUMP_DIR',str,rover_log.LOG_DUMP_DIR,NOT_EMPTY),
+)
+
+# Settings made of several lines, not set by name: CONTROL_PROFILES holds
+# the (name, spec) of every PROFILE_<name> line, after DEFAULT_PROFILES
+COLLECTED_SETTINGS = ('ROVERS','CONTROL_PROFILES')
+PROFILE_PREFIX = 'PROFILE_'
+
+# Settings only read at start-up, a change is reported but needs a restart
+RESTART_SETTINGS = ('ROVERS','GUI_SHOW_SYSTEM','GUI_SHOW_CONTROL','GUI_SHOW_VIDEO','TELEMETRY_HISTORY')
+
+# ------------------------------------------------------------------------------
+# ConfigError - invalid configuration file
+# ------------------------------------------------------------------------------
+class ConfigError(ValueError):
+    pass
+
+# ##############################################################################
+#
+# Settings functions
+#
+# ##############################################################################
+
+# ------------------------------------------------------------------------------
+# Settings() - one attribute per entry of SETTINGS, plus the rover NAME
+# ------------------------------------------------------------------------------
+class Settings:
+
+    def __init__(self,**values):
+        self.NAME = ROVER_DEFAULT_NAME
+        for name,kind,default,check in SETTINGS:
+            setattr(self,name,default)
+        for name,value in values.items():
+            setattr(self,name,value)
+
+    # changes(other) - names of the settings that differ
+    def changes(self,other):
+        return [name for name,kind,default,check in SETTINGS if getattr(self,name) != getattr(other,name)]
+
+# ------------------------------------------------------------------------------
+# read_config(config_file) - {name: (value,line)}, name possibly prefixed
+# with a rover name
+# ------------------------------------------------------------------------------
+def read_config(config_file=ROVER_CONFIG_FILE):
+    entries = {}
+    with open(config_file,'r') as f:
+        for line_number,line in enumerate(f,1):
+            line = line.strip()
+            if not line or line.startswith('#'): continue
+            name,sep,value = line.partition('=')
+            name,value = name.strip(),value.strip()
+            if not sep or not name:
+                raise ConfigError("{}:{}: expected NAME = value: {}".format(config_file,line_number,line))
+            if name in entries:
+                raise ConfigError("{}:{}: {} already set on line {}".format(config_file,line_number,name,entries[name][1]))
+            entries[name] = (value,line_number)
+    return entries
+
+# ------------------------------------------------------------------------------
+# parse_fleet(entries,config_file) - Settings of every rover in ROVERS
+# ------------------------------------------------------------------------------
+def parse_fleet(entries,config_file=ROVER_CONFIG_FILE):
+    kinds = {setting[0]: setting for setting in SETTINGS}
+
+    def convert(key,name):
+        text,line_number = entries[key]
+        name,kind,default,check = kinds[name]
+        try:
+            value = kind(text)
+        except ValueError:
+            raise ConfigError("{}:{}: {} = {}: not {} {}".format(config_file,line_number,key,text,
+                'an' if kind is int else 'a',kind.__name__))
+        test,description = check
+        if not test(value):
+            # the value as written, not as converted
+            raise ConfigError("{}:{}: {} = {}: {}".format(config_file,line_number,key,text,description))
+        return value
+
+    names = convert('ROVERS','ROVERS').split(',') if 'ROVERS' in entries else [ROVER_DEFAULT_NAME]
+    names = [name.strip() for name in names]
+    if len(set(names)) != len(names):
+        raise ConfigError("{}: duplicate rover name in ROVERS: {}".format(config_file,','.join(names)))
+
+    # every name must be a setting or a profile, possibly of a listed rover
+    for key,(value,line_number) in entries.items():
+        rover,dot,name = key.rpartition('.')
+        if name.startswith(PROFILE_PREFIX) and len(name) > len(PROFILE_PREFIX):
+            if dot and rover not in names:
+                raise ConfigError("{}:{}: unknown rover {}".format(config_file,line_number,rover))
+            try:
+                rover_control.DriveProfile.parse(name[len(PROFILE_PREFIX):],value)
+            except ValueError as e:
+                raise ConfigError("{}:{}: {} = {}: {}".format(config_file,line_number,key,value,str(e)))
+            continue
+        if name not in kinds or name == 'CONTROL_PROFILES' or (dot and (rover not in names or name == 'ROVERS')):
+            raise ConfigError("{}:{}: unknown setting {}".format(config_file,line_number,key))
+
+    fleet = []
+    for rover in names:
+        settings = Settings(NAME=rover,ROVERS=','.join(names))
+        for name,kind,default,check in SETTINGS:
+            if name in COLLECTED_SETTINGS: continue
+            key = "{}.{}".format(rover,name)
+            if key not in entries: key = name
+            if key in entries:
+                setattr(settings,name,convert(key,name))
+            elif default is None:
+                raise ConfigError("{}: missing setting {}".format(config_file,name))
+            rover_log.debug('config',"{}.{}: {}",rover,name,getattr(settings,name))
+        settings.CONTROL_PROFILES = parse_profiles(entries,rover)
+        if settings.CONTROL_PROFILE not in dict(settings.CONTROL_PROFILES):
+            key = "{}.CONTROL_PROFILE".format(rover)
+            if key not in entries: key = 'CONTROL_PROFILE'
+            where = "{}:{}".format(config_file,entries[key][1]) if key in entries else config_file
+            raise ConfigError("{}: CONTROL_PROFILE = {}: no such profile".format(where,settings.CONTROL_PROFILE))
+        # raw commands are not answered: the level steps would never be confirmed
+        if settings.VIDEO_ADAPTIVE and settings.SYSTEM_PROTOCOL != rover_system.PROTOCOL_FRAMED:
+            key = "{}.VIDEO_ADAPTIVE".format(rover)
+            if key not in entries: key = 'VIDEO_ADAPTIVE'
+            raise ConfigError("{}:{}: VIDEO_ADAPTIVE = 1: needs SYSTEM_PROTOCOL = {}".format(config_file,entries[key][1],
+                rover_system.PROTOCOL_FRAMED))
+        rover_log.debug('config',"{}.CONTROL_PROFILES: {}",rover,', '.join(name for name,spec in settings.CONTROL_PROFILES))
+        fleet.append(settings)
+    return fleet
+
+# ------------------------------------------------------------------------------
+# parse_profiles(entries,rover) - (name, spec) of the drive profiles of a
+# rover: the defaults, then PROFILE_ lines in file order, its own replacing
+# the common ones
+# ------------------------------------------------------------------------------
+def parse_profiles(entries,rover):
+    profiles = collections.OrderedDict(rover_control.DEFAULT_PROFILES)
+    for owner in ('',rover):
+        for key,(value,line_number) in entries.items():
+            prefix,dot,name = key.rpartition('.')
+            if prefix == owner and name.startswith(PROFILE_PREFIX):
+                profiles[name[len(PROFILE_PREFIX):]] = value
+    return tuple(profiles.items())
+
+# ------------------------------------------------------------------------------
+# load_fleet(config_file) - settings of every rover listed in ROVERS, raises
+# ConfigError on an invalid file and OSError on an unreadable one
+# ------------------------------------------------------------------------------
+def load_fleet(config_file=ROVER_CONFIG_FILE):
+    return parse_fleet(read_config(config_file),config_file)
+
+# ------------------------------------------------------------------------------
+# load_settings(config_file,rover) - settings of one rover, the first one of
+# ROVERS by default
+# ------------------------------------------------------------------------------
+def load_settings(config_file=ROVER_CONFIG_FILE,rover=None):
+    fleet = load_fleet(config_file)
+    for settings in fleet:
+        if rover is None or settings.NAME == rover: return settings
+    raise ConfigError("{}: rover {} not in ROVERS".format(config_file,rover))
+
+# ##############################################################################
+#
+# Hot reload
+#
+# ##############################################################################
+
+# ------------------------------------------------------------------------------
+# ConfigWatcher(config_file,interval) - polls the file modification time
+# ------------------------------------------------------------------------------
+class ConfigWatcher:
+
+    def __init__(self,config_file=ROVER_CONFIG_FILE,interval=CONFIG_RELOAD_INTERVAL):
+        self.config_file = config_file
+        self.interval = interval
+        self.reloads = 0
+        self.errors = 0
+        self.stamp = self._stamp()
+
+    def _stamp(self):
+        try:
+            st = os.stat(self.config_file)
+        except OSError:
+            return None
+        return (st.st_mtime_ns,st.st_size,st.st_ino)
+
+    # run(changed) - watch until cancelled; changed(fleet,error) gets the new
+    # fleet, or None and the error of a file that does not load. An invalid
+    # file is reported once and the running configuration kept.
+    async def run(self,changed):
+        while True:
+            await asyncio.sleep(self.interval)
+            stamp = self._stamp()
+            if stamp is None or stamp == self.stamp: continue
+            # let the editor finish writing
+            await asyncio.sleep(CONFIG_SETTLE_TIME)
+            if self._stamp() != stamp: continue
+            self.stamp = stamp
+            rover_log.info('config',"configuration file changed: {}",self.config_file)
+            try:
+                fleet = load_fleet(self.config_file)
+            except (ConfigError,OSError) as e:
+                self.errors += 1
+                changed(None,e)
+                continue
+            self.reloads += 1
+            changed(fleet,None)
@@ -0,0 +1,576 @@
+# ##############################################################################
+#
+# Rover control link
+#
+# One UDP socket per control session. Axis frames are sent either as the
+# legacy CSV message '7,LF,LR,RL,RR' or as a fixed-size binary record:
+#
+#   offset  size  field
+#   0       1     magic (0xA5) - never an ASCII digit, so the rover can tell
+#                 binary frames apart from CSV messages on the same port
+#   1       1     message type (7 = motor axis frame, same id as CSV)
+#   2       4     sequence number (uint32, wraps)
+#   6       4     timestamp in ms (uint32, monotonic clock, wraps)
+#   10      4     LF, LR, RL, RR pwm values (uint8 each, 0-100)
+#
+# All fields are network byte order. The rover keeps the last sequence
+# number it applied and drops any frame that is older (reordered) or whose
+# timestamp lags the newest one by more than its stale limit.
+#
+# The sequence number is also the frame id: the rover echoes the id of the
+# last frame it applied in its $MOT telemetry ('$MOT,motor,id'), and the
+# client times the control round trip from it. CSV messages carry no id.
+#
+# ##############################################################################
+
+import socket                   # Network communication
+import struct                   # Binary frame packing
+import threading                # Joystick event thread
+import time                     # Time acquisition and formatting
+
+# pygame is slow to import and initialize, load_pygame() brings it in when
+# the first joystick is opened
+pygame = None
+pygame_loaded = False
+
+# Frame formats
+FRAME_FORMAT_BINARY = 'binary'
+FRAME_FORMAT_CSV = 'csv'
+
+# Binary frame layout
+FRAME_MAGIC = 0xA5
+FRAME_TYPE_MOTOR = 7
+FRAME_STRUCT = struct.Struct('!BBIIBBBB')
+
+# Motor values of an explicit stop frame
+STOP_FRAME = (0,0,0,0)
+
+# Motor values below this level are sent as 0
+INTERFERENCE_LEVEL = 99
+
+# Gamepad buttons reported in button messages
+JOYSTICK_BUTTONS = 12
+
+# Gamepad button switching the driven rover (Logitech F310 'back')
+SWITCH_BUTTON = 6
+
+# Gamepad button switching the drive profile (Logitech F310 'start')
+PROFILE_BUTTON = 7
+
+# Gamepad axes of the left and right motors
+AXIS_LEFT = 1
+AXIS_RIGHT = 2
+
+# Seconds between two reads of an input source that does not report events
+POLL_INTERVAL = 0.01
+
+# Seconds of control round trips kept in the latency histogram, and frames
+# waiting for their $MOT echo
+RTT_WINDOW = 60.0
+RTT_PENDING = 256
+
+# Input event to control frame send latency histogram buckets, seconds
+INPUT_LATENCY_BUCKETS = (0.0001,0.00025,0.0005,0.001,0.002,0.005,0.01,0.02,0.05,0.1)
+
+# ------------------------------------------------------------------------------
+# data_to_pwm(axis_1,axis_2) - stick axes (-1.0..1.0) to (LF,LR,RL,RR)
+# ------------------------------------------------------------------------------
+def data_to_pwm(axis_1,axis_2,interference_level=INTERFERENCE_LEVEL):
+    deviation = 0.01
+    LF,LR,RL,RR = 0,0,0,0
+    # centred stick is a stop frame
+    if not (axis_1 or axis_2): return STOP_FRAME
+    if axis_1 < 0:
+        LF = abs(int (axis_1 * 100))
+    elif axis_1 > 0:
+        LR = abs(int ((axis_1 + deviation ) * 100))
+    if axis_2 < 0:
+        RL = abs(int (axis_2 * 100))
+    elif axis_2 > 0:
+        RR = abs(int ((axis_2 + deviation) * 100))
+    if LF < interference_level: LF=0
+    if LR < interference_level: LR=0
+    if RL < interference_level: RL=0
+    if RR < interference_level: RR=0
+    return (LF,LR,RL,RR)
+
+# ##############################################################################
+#
+# Drive profiles
+#
+# A profile maps the two stick axes to motor pwm values:
+#
+#   mixing      tank: axis 1 drives the left motors, axis 2 the right ones
+#               arcade: axis 1 is throttle, axis 2 steering
+#               legacy: data_to_pwm(), full speed or stop
+#   deadzone    axis fraction around centre read as 0, the rest of the
+#               travel is rescaled to 0..1
+#   expo        0 linear .. 1 cubic, flattens the curve around centre
+#   trim        left,right gain correction, -0.5..0.5, to drive straight
+#   min / max   pwm of the smallest / full stick deflection outside the
+#               deadzone
+#
+# written in rover.conf as 'PROFILE_<name> = <mixing> key=value ...':
+#
+#   PROFILE_fine = arcade deadzone=0.08 expo=0.6 trim=0,-0.04 min=20 max=60
+#
+# compile() turns a profile into a lookup table of AXIS_STEPS x AXIS_STEPS
+# frames, so pwm() is two index computations and a list lookup.
+#
+# ##############################################################################
+
+# Mixing modes
+MIXING_TANK = 'tank'
+MIXING_ARCADE = 'arcade'
+MIXING_LEGACY = 'legacy'
+
+# Lookup table axis quantization: -1.0..1.0 in steps of 0.01
+AXIS_STEPS = 201
+AXIS_HALF = AXIS_STEPS // 2
+
+# Profiles every rover has: (name, spec)
+DEFAULT_PROFILES = (('legacy',MIXING_LEGACY),)
+
+# ------------------------------------------------------------------------------
+# DriveProfile(name,mixing,deadzone,expo,trim,min_pwm,max_pwm)
+# ------------------------------------------------------------------------------
+class DriveProfile:
+
+    def __init__(self,name,mixing=MIXING_TANK,deadzone=0.0,expo=0.0,trim=(0.0,0.0),min_pwm=0,max_pwm=100):
+        if mixing not in (MIXING_TANK,MIXING_ARCADE,MIXING_LEGACY):
+            raise ValueError("unknown mixing: {}".format(mixing))
+        if not 0 <= deadzone < 1: raise ValueError("deadzone not in 0..1: {}".format(deadzone))
+        if not 0 <= expo <= 1: raise ValueError("expo not in 0..1: {}".format(expo))
+        if len(trim) != 2 or not all(-0.5 <= t <= 0.5 for t in trim):
+            raise ValueError("trim not two values in -0.5..0.5: {}".format(trim))
+        if not 0 <= min_pwm <= max_pwm <= 100:
+            raise ValueError("min and max not 0 <= min <= max <= 100: {} {}".format(min_pwm,max_pwm))
+        self.name = name
+        self.mixing = mixing
+        self.deadzone = deadzone
+        self.expo = expo
+        self.trim = tuple(trim)
+        self.min_pwm = min_pwm
+        self.max_pwm = max_pwm
+        self.table = None
+
+    # parse(name,spec) - profile from its rover.conf value, raises ValueError
+    @classmethod
+    def parse(cls,name,spec):
+        words = spec.split()
+        if not words: raise ValueError("empty profile")
+        kwargs = {'mixing': words[0]}
+        for word in words[1:]:
+            key,sep,value = word.partition('=')
+            if not sep: raise ValueError("expected key=value: {}".format(word))
+            if key not in ('deadzone','expo','trim','min','max'):
+                raise ValueError("unknown profile parameter: {}".format(key))
+            try:
+                if key == 'trim': kwargs[key] = tuple(float(v) for v in value.split(','))
+                elif key in ('min','max'): kwargs[key + '_pwm'] = int(value)
+                else: kwargs[key] = float(value)
+            except ValueError as e:
+                raise ValueError("{}: {}".format(word,str(e)))
+        if kwargs['mixing'] == MIXING_LEGACY and len(kwargs) > 1:
+            raise ValueError("legacy profile takes no parameter")
+        return cls(name,**kwargs)
+
+    # shape(value) - deadzone and expo curve of one axis, -1.0..1.0
+    def shape(self,value):
+        a = abs(value)
+        if a <= self.deadzone: return 0.0
+        a = (a - self.deadzone) / (1 - self.deadzone)
+        a = (1 - self.expo) * a + self.expo * a ** 3
+        return a if value > 0 else -a
+
+    # side(value,trim) - (forward,reverse) pwm of one side, negative value
+    # is forward like the stick axes
+    def side(self,value,trim):
+        if value == 0: return (0,0)
+        pwm = int(self.min_pwm + (self.max_pwm - self.min_pwm) * min(1.0,abs(value) * (1 + trim)) + 0.5)
+        return (pwm,0) if value < 0 else (0,pwm)
+
+    # compile() - lookup table of every quantized (axis_1,axis_2), equal
+    # frames share one tuple
+    def compile(self):
+        if self.table is not None: return self
+        axis = [(i - AXIS_HALF) / AXIS_HALF for i in range(AXIS_STEPS)]
+        frames = {}
+        if self.mixing == MIXING_LEGACY:
+            left = [data_to_pwm(v,0)[:2] for v in axis]
+            right = [data_to_pwm(0,v)[2:] for v in axis]
+        elif self.mixing == MIXING_TANK:
+            left = [self.side(self.shape(v),self.trim[0]) for v in axis]
+            right = [self.side(self.shape(v),self.trim[1]) for v in axis]
+        if self.mixing != MIXING_ARCADE:
+            # each side depends on its own axis only
+            self.table = [frames.setdefault(l + r,l + r) for l in left for r in right]
+            return self
+        shaped = [self.shape(v) for v in axis]
+        table = []
+        for throttle in shaped:
+            for steering in shaped:
+                # steering right speeds up the left side, ratio kept when
+                # one side would exceed full speed
+                l,r = throttle - steering,throttle + steering
+                m = max(1.0,abs(l),abs(r))
+                frame = self.side(l / m,self.trim[0]) + self.side(r / m,self.trim[1])
+                table.append(frames.setdefault(frame,frame))
+        self.table = table
+        return self
+
+    # pwm(axis_1,axis_2) - (LF,LR,RL,RR) of the stick axes, -1.0..1.0
+    def pwm(self,axis_1,axis_2):
+        if self.table is None: self.compile()
+        i = int(axis_1 * AXIS_HALF + AXIS_HALF + 0.5)
+        j = int(axis_2 * AXIS_HALF + AXIS_HALF + 0.5)
+        if not (0 <= i < AXIS_STEPS and 0 <= j < AXIS_STEPS):
+            i,j = min(AXIS_STEPS - 1,max(0,i)),min(AXIS_STEPS - 1,max(0,j))
+        return self.table[i * AXIS_STEPS + j]
+
+# ------------------------------------------------------------------------------
+# ControlLink(robot_ip,robot_port,frame_format)
+# ------------------------------------------------------------------------------
+class ControlLink:
+
+    def __init__(self,robot_ip,robot_port,frame_format=FRAME_FORMAT_BINARY):
+        if frame_format not in (FRAME_FORMAT_BINARY,FRAME_FORMAT_CSV):
+            raise ValueError("unknown control frame format: {}".format(frame_format))
+        self.robot_ip = robot_ip
+        self.robot_port = robot_port
+        self.frame_format = frame_format
+        self.sequence = 0
+        self.frames_sent = 0
+        self.bytes_sent = 0
+        self.send_errors = 0
+        self._socket = None
+
+    # open()
+    def open(self):
+        if self._socket is None:
+            self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            # connected UDP socket: destination is resolved once, not per send
+            self._socket.connect((self.robot_ip,self.robot_port))
+        return self
+
+    # close()
+    def close(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+    # retarget(robot_ip,robot_port,frame_format) - new destination for an
+    # open link; the sequence number goes on, so the rover does not take the
+    # next frames for stale ones
+    def retarget(self,robot_ip,robot_port,frame_format=None):
+        frame_format = frame_format or self.frame_format
+        if frame_format not in (FRAME_FORMAT_BINARY,FRAME_FORMAT_CSV):
+            raise ValueError("unknown control frame format: {}".format(frame_format))
+        self.robot_ip = robot_ip
+        self.robot_port = robot_port
+        self.frame_format = frame_format
+        if self._socket is not None:
+            # connecting a UDP socket again only changes its destination
+            self._socket.connect((self.robot_ip,self.robot_port))
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self,exc_type,exc_value,traceback):
+        self.close()
+
+    # encode_axes(LF,LR,RL,RR)
+    def encode_axes(self,LF,LR,RL,RR):
+        if self.frame_format == FRAME_FORMAT_CSV:
+            return '{},{},{},{},{}'.format(FRAME_TYPE_MOTOR,LF,LR,RL,RR).encode()
+        self.sequence = (self.sequence + 1) & 0xFFFFFFFF
+        timestamp = int(time.monotonic() * 1000) & 0xFFFFFFFF
+        return FRAME_STRUCT.pack(FRAME_MAGIC,FRAME_TYPE_MOTOR,self.sequence,timestamp,LF,LR,RL,RR)
+
+    # send_axes(LF,LR,RL,RR)
+    def send_axes(self,LF,LR,RL,RR):
+        return self._send(self.encode_axes(LF,LR,RL,RR))
+
+    # send_message(msg) - button and hat messages stay CSV in every format
+    def send_message(self,msg):
+        return self._send(msg.encode())
+
+    # _send(data) - bytes sent, 0 when the frame did not go out: port
+    # unreachable from an earlier frame (rover server not up yet), network
+    # or host unreachable during a Wi-Fi drop, no buffer space. The link
+    # stays usable, the next frame is tried again.
+    def _send(self,data):
+        try:
+            self.open()
+            sent = self._socket.send(data)
+        except OSError:
+            self.send_errors += 1
+            return 0
+        self.frames_sent += 1
+        self.bytes_sent += sent
+        return sent
+
+# ------------------------------------------------------------------------------
+# TransmitPolicy(max_rate,delta,heartbeat)
+#
+# Decides which motor frames actually go on the wire:
+#   - a change of at least `delta` pwm on any motor is sent, at most
+#     `max_rate` frames per second: a change coming sooner is held back
+#     until next_time()
+#   - returning to centre sends an explicit stop frame right away
+#   - an unchanged state (moving or stopped) is repeated every `heartbeat`
+#     seconds so the rover can tell "stop" apart from "link dead"
+# ------------------------------------------------------------------------------
+class TransmitPolicy:
+
+    def __init__(self,max_rate=50,delta=2,heartbeat=0.5):
+        self.configure(max_rate,delta,heartbeat)
+        self.last_frame = None
+        self.last_time = 0.0
+        # a change held back by max_rate, and the kind of the last frame sent
+        self.pending = False
+        self.last_kind = None
+        self.sent_change = 0
+        self.sent_stop = 0
+        self.sent_heartbeat = 0
+        self.suppressed = 0
+
+    # configure(max_rate,delta,heartbeat) - takes effect on the next update()
+    def configure(self,max_rate=50,delta=2,heartbeat=0.5):
+        if max_rate <= 0:
+            raise ValueError("control max rate must be positive: {}".format(max_rate))
+        self.min_interval = 1.0 / max_rate
+        self.delta = delta
+        self.heartbeat = heartbeat
+
+    # next_time() - monotonic time update() should be called again without
+    # new input: end of the max_rate interval for a held back change, else
+    # the next heartbeat
+    def next_time(self):
+        if self.last_frame is None: return 0.0
+        return self.last_time + (self.min_interval if self.pending else self.heartbeat)
+
+    # update(frame,now) - returns the frame to send, or None
+    def update(self,frame,now=None):
+        if now is None: now = time.monotonic()
+        frame = tuple(frame)
+        elapsed = now - self.last_time
+
+        if self.last_frame is None:
+            kind = 'change'
+        elif frame == STOP_FRAME and self.last_frame != STOP_FRAME:
+            kind = 'stop'
+        elif max(abs(a - b) for a,b in zip(frame,self.last_frame)) >= self.delta:
+            # the sum next_time() returns: woken then, the change goes out
+            kind = 'change' if now >= self.last_time + self.min_interval else None
+            self.pending = kind is None
+        elif elapsed >= self.heartbeat:
+            kind = 'heartbeat'
+            frame = self.last_frame
+        else:
+            # no change worth sending
+            kind = None
+            self.pending = False
+
+        if kind is None:
+            self.suppressed += 1
+            return None
+        self.pending = False
+        self.last_kind = kind
+        if kind == 'change': self.sent_change += 1
+        elif kind == 'stop': self.sent_stop += 1
+        else: self.sent_heartbeat += 1
+        self.last_frame = frame
+        self.last_time = now
+        return frame
+
+# ##############################################################################
+#
+# Control input sources
+#
+# A control channel reads one input source each time it reports an event:
+#   message()      - latest button or hat CSV message since the last call, or ""
+#   axes()         - current (axis_1,axis_2) stick values, -1.0..1.0
+#   pressed        - buttons pressed during the last message() call
+#   released       - buttons released during the last message() call
+#   listen(notify) - notify() is called, from any thread, after every event;
+#                    unlisten(notify) stops it
+#   input_time()   - monotonic time of the oldest event since the last call,
+#                    or None
+#
+# A source without listen() is polled every POLL_INTERVAL.
+#
+# ##############################################################################
+
+# ------------------------------------------------------------------------------
+# filter_buttons(msg,reserved,changed) - message msg without the reserved
+# buttons, which act on the client: shown released in a button message, ""
+# when they are the only buttons changed. Hat messages are unchanged.
+# ------------------------------------------------------------------------------
+def filter_buttons(msg,reserved,changed):
+    fields = msg.split(',')
+    if len(fields) != JOYSTICK_BUTTONS + 1: return msg
+    if changed and all(b in reserved for b in changed): return ""
+    for b in reserved:
+        if 0 <= b < JOYSTICK_BUTTONS: fields[b + 1] = '0'
+    return ",".join(fields)
+
+# ------------------------------------------------------------------------------
+# InputSource() - listeners and event time shared by the input sources
+# ------------------------------------------------------------------------------
+class InputSource:
+
+    def __init__(self):
+        # replaced as a whole, safe to read from any thread
+        self.listeners = ()
+        self.events = 0
+        self._event_time = None
+        self._lock = threading.Lock()
+
+    def listen(self,notify):
+        self.listeners = self.listeners + (notify,)
+
+    def unlisten(self,notify):
+        self.listeners = tuple(n for n in self.listeners if n is not notify)
+
+    def input_time(self):
+        with self._lock:
+            event_time,self._event_time = self._event_time,None
+        return event_time
+
+    # event(now) - record an input event and wake the listeners
+    def event(self,now=None):
+        with self._lock:
+            if self._event_time is None: self._event_time = time.monotonic() if now is None else now
+            self.events += 1
+        self.wake()
+
+    # wake() - listeners read the source again, without a new event
+    def wake(self):
+        for notify in self.listeners: notify()
+
+# ------------------------------------------------------------------------------
+# load_pygame() - import pygame once, None when it is not installed
+# ------------------------------------------------------------------------------
+def load_pygame():
+    global pygame,pygame_loaded
+    if not pygame_loaded:
+        pygame_loaded = True
+        try:
+            import pygame
+        except ImportError:
+            pygame = None
+    return pygame
+
+# ------------------------------------------------------------------------------
+# JoystickInput(device_id) - pygame gamepad, raises ValueError without one
+#
+# A 'joystick' thread opens the gamepad and blocks on the pygame event queue;
+# SDL delivers events on the thread that initialized it. Each axis, button
+# and hat event updates the state read by the control channels as soon as
+# it arrives.
+# ------------------------------------------------------------------------------
+class JoystickInput(InputSource):
+
+    def __init__(self,device_id=0):
+        super().__init__()
+        if load_pygame() is None:
+            raise ValueError("pygame is not installed")
+        self.device_id = device_id
+        self.name = None
+        self.axis_values = (0.0,0.0)
+        self.pressed = []
+        self.released = []
+        self._msg = ""
+        self._pressed = []
+        self._released = []
+        self._error = None
+        self._running = True
+        ready = threading.Event()
+        self._thread = threading.Thread(target=self._run,args=(ready,),name='joystick',daemon=True)
+        self._thread.start()
+        ready.wait()
+        if self._error is not None:
+            raise ValueError(self._error)
+
+    def _run(self,ready):
+        try:
+            # not pygame.init(): audio, fonts and the rest are never used. The
+            # display module only provides the event queue, no window is opened
+            pygame.display.init()
+            pygame.joystick.init() # main joystick device system
+            j = pygame.joystick.Joystick(self.device_id) # create a joystick instance
+            j.init() # init instance
+            self.name = j.get_name()
+            self.axis_values = (j.get_axis(AXIS_LEFT),j.get_axis(AXIS_RIGHT))
+        except pygame.error as e:
+            self._error = "no joystick {}: {}".format(self.device_id,str(e))
+        ready.set()
+        if self._error is not None: return
+
+        while self._running:
+            # blocks without holding the GIL
+            e = pygame.event.wait()
+            now = time.monotonic()
+            if e.type == pygame.JOYAXISMOTION:
+                if e.axis == AXIS_LEFT: self.axis_values = (e.value,self.axis_values[1])
+                elif e.axis == AXIS_RIGHT: self.axis_values = (self.axis_values[0],e.value)
+                else: continue
+            elif e.type == pygame.JOYHATMOTION:
+                with self._lock:
+                    self._msg = ",".join((str(e.type),str(j.get_hat(0)[0]),str(j.get_hat(0)[1])))
+            elif e.type in (pygame.JOYBUTTONDOWN,pygame.JOYBUTTONUP):
+                with self._lock:
+                    self._msg = ",".join([str(e.type)] + [str(j.get_button(b)) for b in range(0,JOYSTICK_BUTTONS)])
+                    if e.type == pygame.JOYBUTTONDOWN: self._pressed.append(e.button)
+                    else: self._released.append(e.button)
+            else:
+                continue
+            self.event(now)
+
+    # close() - stop the event thread
+    def close(self):
+        if self._running and self._error is None:
+            self._running = False
+            # wakes the event thread, SDL event posting is thread safe
+            pygame.event.post(pygame.event.Event(pygame.USEREVENT))
+
+    def message(self):
+        with self._lock:
+            msg,self._msg = self._msg,""
+            self.pressed,self._pressed = self._pressed,[]
+            self.released,self._released = self._released,[]
+        return msg
+
+    def axes(self):
+        return self.axis_values
+
+# ------------------------------------------------------------------------------
+# ManualInput() - driven by set_axes()/send_message() from any thread, for
+# headless runs and automated tests
+# ------------------------------------------------------------------------------
+class ManualInput(InputSource):
+
+    def __init__(self):
+        super().__init__()
+        self.name = 'manual'
+        # replaced as a whole, safe to write from any thread
+        self.axis_values = (0.0,0.0)
+        self.pending = ""
+        self.pressed = []
+        self.released = []
+
+    def set_axes(self,axis_1,axis_2):
+        self.axis_values = (axis_1,axis_2)
+        self.event()
+
+    def send_message(self,msg):
+        self.pending = msg
+        self.event()
+
+    def message(self):
+        msg,self.pending = self.pending,""
+        return msg
+
+    def axes(self):
+        return self.axis_values
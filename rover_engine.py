@@ -0,0 +1,1315 @@
+#!/usr/bin/python3
+
+# ##############################################################################
+#
+# Rover client engine
+#
+# Control, video relay, telemetry, link probing, metrics and system commands
+# for a fleet of rovers, without any user interface. A front-end builds a
+# RoverEngine from the settings in rover.conf, calls its start/stop methods
+# and receives status messages through a callback:
+#
+#   status(rover,channel,msg,ok)
+#
+# rover is the rover name, or None for the fleet 'status' line; channel is
+# one of 'system', 'control', 'motor', 'rtt', 'video' or 'status', ok is False for
+# errors. The callback runs on the network thread and must not block; the
+# Tk GUI queues the message, the headless front-end prints it.
+#
+# With the in-process video decoder, pictures arrive through a second
+# callback, on the decoder thread of the rover:
+#
+#   frames(rover,image)
+#
+# image is a PIL image, None when the stream ends.
+#
+# Every rover runs its channels as tasks of the one network event loop, so
+# a fleet costs sockets and tasks, not threads. The gamepad drives one rover
+# at a time; the others are held stopped. Telemetry from every rover arrives
+# on the one CLIENT_TELEMETRY_PORT and is dispatched by source address.
+#
+# Headless usage:
+#   rover_engine.py [--config FILE] [--rover NAME] [--control] [--video]
+#                   [--telemetry] [--record] [--player CMD] [--system CMD]
+#                   [--rtt-export] [--duration S]
+#
+# ##############################################################################
+
+import os                       # Operating system interface
+import sys                      # System call
+import time                     # Time acquisition and formatting
+import math                     # Frame id check
+import socket                   # Network communication
+import asyncio                  # Channel coroutines
+import collections              # Ordered fleet
+import shlex                    # Player command line parsing
+import signal                   # Headless termination
+import argparse                 # Command line parsing
+import rover_control            # Control link
+import rover_video              # Video relay
+import rover_player             # Video players
+import rover_telemetry          # Telemetry decoding and history
+import rover_recorder           # Telemetry recorder
+import rover_net                # Networking event loop
+import rover_link               # Link prober
+import rover_metrics            # Metrics and exposition endpoint
+import rover_system             # System command link
+import rover_config             # Configuration file and hot reload
+import rover_log                # Event log
+
+# ##############################################################################
+#
+# Global definitions
+#
+# ##############################################################################
+
+# Debug output flag: every telemetry datagram recorded in the event log
+DEBUG_TELEMETRY_DATA = False
+
+# Seconds between two motor status updates from telemetry
+TELEMETRY_STATUS_INTERVAL = 0.1
+
+# ##############################################################################
+#
+# Engine
+#
+# ##############################################################################
+
+# ------------------------------------------------------------------------------
+# RoverEngine(settings,status,config_file,frames) - settings is one Settings
+# or a list, one per rover; with a config_file, changes to the file are
+# applied to the running channels
+#
+# Methods taking rover=None act on every rover, except system_command(),
+# ping() and link_state() which act on the rover driven by the gamepad.
+# ------------------------------------------------------------------------------
+class RoverEngine:
+
+    def __init__(self,settings,status=None,config_file=None,frames=None):
+        if isinstance(settings,rover_config.Settings): settings = [settings]
+        # fleet wide settings come from the first rover
+        self.settings = settings[0]
+        self.status = status or (lambda rover,channel,msg,ok: None)
+        self.frames = frames or (lambda rover,image: None)
+        self.metrics = rover_metrics.REGISTRY
+        self.rovers = collections.OrderedDict((s.NAME,Rover(self,s)) for s in settings)
+        # rover driven by the gamepad
+        self.active = next(iter(self.rovers))
+        # one telemetry listener for the whole fleet
+        self.telemetry = TelemetryListener(self)
+        # gamepad shared by every control channel, opened on first use
+        self.joystick = None
+        # networking event loop running every channel
+        self.net_core = None
+        # configuration file hot reload
+        self.config_watcher = None
+        if config_file and self.settings.CONFIG_RELOAD_INTERVAL > 0:
+            self.config_watcher = rover_config.ConfigWatcher(config_file,self.settings.CONFIG_RELOAD_INTERVAL)
+
+    def success(self,rover,channel,msg):
+        self.status(rover,channel,msg,True)
+
+    def error(self,rover,channel,msg):
+        self.status(rover,channel,msg,False)
+
+    # rover(name) - Rover by name, the driven rover for None
+    def rover(self,name=None):
+        return self.rovers[name or self.active]
+
+    def _selected(self,name):
+        return [self.rovers[name]] if name else list(self.rovers.values())
+
+    # start() - start the event log writer, the event loop, supervisor,
+    # link probers and metrics
+    def start(self):
+        self.configure_log()
+        rover_log.LOG.start()
+        self.net_core = rover_net.NetworkCore().start()
+        rover_log.info('supervisor',"start supervisor channel")
+        self.net_core.start_channel('supervisor',self.supervisor_channel)
+        for rover in self.rovers.values():
+            rover_log.info('system',"start link channel {}",rover.name)
+            self.net_core.start_channel(rover.channel('link'),rover.link_prober.run)
+            self.net_core.start_channel(rover.channel('system'),rover.system_link.run)
+        if self.settings.METRICS_PORT:
+            rover_log.info('supervisor',"start metrics endpoint on port {}",self.settings.METRICS_PORT)
+            self.net_core.start_channel('metrics',rover_metrics.serve_metrics,self.metrics,
+                rover_metrics.METRICS_HOST,self.settings.METRICS_PORT)
+        if self.config_watcher:
+            rover_log.info('supervisor',"watch configuration file {}",self.config_watcher.config_file)
+            self.net_core.start_channel('config',self.config_watcher.run,self.config_changed)
+        return self
+
+    # stop() - cancels every channel: sockets closed, video players killed
+    def stop(self):
+        if self.net_core: self.net_core.stop()
+        if self.joystick: self.joystick.close()
+        for rover in self.rovers.values(): rover.standby.close()
+        # recordings: what is queued still goes to disk
+        for rover in self.rovers.values():
+            if rover.video_recorder: rover.video_recorder.close(wait=True)
+            for recorder in list(rover.closing_recorders): recorder.close(wait=True)
+        rover_log.LOG.stop()
+
+    # is_running(channel,rover)
+    def is_running(self,channel,rover=None):
+        return self.net_core is not None and self.net_core.is_running(self.rover(rover).channel(channel))
+
+    # link_state(rover) - cached link state, never blocks
+    def link_state(self,rover=None):
+        return self.rover(rover).link_prober.state()
+
+    # select_rover(name) / next_rover() - rover driven by the gamepad
+    def select_rover(self,name):
+        if name not in self.rovers: raise ValueError("unknown rover: {}".format(name))
+        previous,self.active = self.active,name
+        rover_log.info('control',"gamepad drives {}",name)
+        if previous != name: self.error(previous,'control',"Control: released")
+        self.success(name,'control',"Control: driven")
+        # the released rover sends its stop frame now, not on its next event
+        if self.joystick: self.joystick.wake()
+
+    def next_rover(self):
+        names = list(self.rovers)
+        self.select_rover(names[(names.index(self.active) + 1) % len(names)])
+
+    # gamepad(device_id) - shared joystick, raises ValueError without one
+    def gamepad(self,device_id=0):
+        if self.joystick is None:
+            # pygame is loaded here, by the first control channel
+            start = time.perf_counter()
+            self.joystick = rover_control.JoystickInput(device_id)
+            rover_log.info('control',"enabled joystick: {} in {:.0f} ms",
+                self.joystick.name,(time.perf_counter() - start) * 1000)
+        return self.joystick
+
+    # --------------------------------------------------------------------------
+    # Event log
+    # --------------------------------------------------------------------------
+
+    # configure_log() - levels, log file and ring size from the settings
+    def configure_log(self):
+        settings = self.settings
+        rover_log.LOG.configure(settings.LOG_LEVEL,rover_log.parse_levels(settings.LOG_LEVELS),
+            settings.LOG_FILE,settings.LOG_RING_SIZE)
+
+    # dump_log(seconds) - write the last seconds of events, every level, to
+    # a new file in LOG_DUMP_DIR; done by the writer thread, safe to call
+    # from any thread and from signal handlers
+    def dump_log(self,seconds=None):
+        rover_log.LOG.request_dump(seconds or self.settings.LOG_DUMP_SECONDS,self.settings.LOG_DUMP_DIR)
+
+    # --------------------------------------------------------------------------
+    # Configuration hot reload
+    # --------------------------------------------------------------------------
+
+    # config_changed(fleet,error) - called by the watcher on the network thread
+    def config_changed(self,fleet,error):
+        if error is not None:
+            rover_log.error('engine',"configuration not applied: {}",str(error))
+            for rover in self.rovers.values(): rover.error('system',"Config: error, not applied")
+            return
+
+        fleet = collections.OrderedDict((s.NAME,s) for s in fleet)
+        old = self.settings
+        for name,rover in self.rovers.items():
+            if name in fleet: rover.apply_settings(fleet[name])
+        if list(fleet) != list(self.rovers):
+            rover_log.warning('engine',"ROVERS changed, restart to apply: {}",','.join(fleet))
+            self.error(self.active,'system',"Config: restart for ROVERS")
+        self.settings = next(iter(self.rovers.values())).settings
+        self.telemetry.reroute()
+
+        # fleet wide settings
+        changes = old.changes(self.settings)
+        if self.net_core.is_running('telemetry') and set(changes) & {'CLIENT_TELEMETRY_PORT',
+                'TELEMETRY_RECORD','TELEMETRY_RECORD_DIR','TELEMETRY_RECORD_SIZE','TELEMETRY_RCVBUF','TELEMETRY_BATCH'}:
+            rover_log.info('telemetry',"restart telemetry channel")
+            self.net_core.restart_channel('telemetry',self.telemetry.run)
+        if 'METRICS_PORT' in changes:
+            if self.settings.METRICS_PORT:
+                rover_log.info('supervisor',"move metrics endpoint to port {}",self.settings.METRICS_PORT)
+                self.net_core.restart_channel('metrics',rover_metrics.serve_metrics,self.metrics,
+                    rover_metrics.METRICS_HOST,self.settings.METRICS_PORT)
+            else:
+                self.net_core.stop_channel('metrics')
+        if 'CONFIG_RELOAD_INTERVAL' in changes and self.settings.CONFIG_RELOAD_INTERVAL > 0:
+            self.config_watcher.interval = self.settings.CONFIG_RELOAD_INTERVAL
+        if any(name.startswith('LOG_') for name in changes):
+            self.configure_log()
+            rover_log.info('engine',"log level {}, channels {}",self.settings.LOG_LEVEL,self.settings.LOG_LEVELS or 'none')
+
+    # --------------------------------------------------------------------------
+    # Supervisor
+    # --------------------------------------------------------------------------
+
+    # supervisor_channel() - samples the metrics once a second
+    async def supervisor_channel(self):
+        metrics = self.metrics
+        rate_counters = ('rover_control_frames_total','rover_telemetry_packets_total',
+            'rover_telemetry_decode_errors_total','rover_video_bytes_total')
+
+        while True:
+            await asyncio.sleep(1)
+
+            # channel metrics owned by long-lived objects
+            if self.telemetry.reconnect: sample_reconnect(metrics,self.telemetry.reconnect,channel='telemetry')
+            for rover in self.rovers.values():
+                name = rover.name
+                metrics.counter('rover_telemetry_packets_total','telemetry datagrams received').set(rover.telemetry_store.packets,rover=name)
+                metrics.counter('rover_telemetry_decode_errors_total','telemetry datagrams not decoded').set(rover.telemetry_store.decode_errors,rover=name)
+                metrics.counter('rover_telemetry_rejected_total','unknown telemetry sentences over the tag or field limit').set(rover.telemetry_store.rejected,rover=name)
+                state = rover.link_prober.state()
+                metrics.gauge('rover_link_up','rover answers link probes').set(int(bool(state.up)),rover=name)
+                if state.rtt is not None:
+                    metrics.gauge('rover_link_rtt_seconds','last link probe round-trip time').set(state.rtt,rover=name)
+                    metrics.gauge('rover_link_jitter_seconds','link probe round-trip jitter').set(state.jitter,rover=name)
+                if state.loss is not None:
+                    metrics.gauge('rover_link_loss_ratio','link probe loss over the last probes').set(state.loss,rover=name)
+            metrics.counter('rover_telemetry_unknown_source_total','telemetry datagrams from no known rover').set(self.telemetry.unknown)
+            self.telemetry.sample(metrics)
+            for rover in self.rovers.values():
+                rover.sample_recording(metrics)
+                rover.sample_rtt(metrics)
+                rover.sample_reconnects(metrics)
+            log = rover_log.LOG
+            metrics.counter('rover_log_events_total','events recorded in the event log').set(log.events)
+            metrics.counter('rover_log_lines_total','event log lines written').set(log.lines)
+            metrics.counter('rover_log_dumps_total','event log dumps written').set(log.dumps)
+            if self.config_watcher:
+                metrics.counter('rover_config_reloads_total','configuration file changes applied').set(self.config_watcher.reloads)
+                metrics.counter('rover_config_errors_total','configuration file changes not applied').set(self.config_watcher.errors)
+            running = metrics.gauge('rover_channel_running','channel task is running')
+            running.values.clear()
+            for t in asyncio.all_tasks():
+                running.set(int(not t.done()),channel=t.get_name())
+            rover_metrics.sample_process(metrics)
+            metrics.update_rates(rate_counters)
+
+            # compact status line, whole fleet
+            status_msg = "Ctl {:.0f}/s Tel {:.0f}/s\nVid {:.0f} kB/s CPU {:.0f}% {:.0f} MB".format(
+                metrics.value('rover_control_frames_per_second'),
+                metrics.value('rover_telemetry_packets_per_second'),
+                metrics.value('rover_video_bytes_per_second') / 1024,
+                metrics.value('rover_process_cpu_percent'),
+                metrics.value('rover_process_rss_bytes') / 1048576)
+            rover_log.debug('supervisor',"{}",status_msg.replace("\n"," "))
+            self.success(None,'status',status_msg)
+
+    # --------------------------------------------------------------------------
+    # Channels
+    # --------------------------------------------------------------------------
+
+    # start_control(device_id,source,rover) - every rover shares the gamepad
+    # device_id unless an input source such as rover_control.ManualInput()
+    # is given
+    def start_control(self,device_id=0,source=None,rover=None):
+        for r in self._selected(rover): r.start_control(device_id,source)
+
+    def stop_control(self,rover=None):
+        for r in self._selected(rover): r.stop_control()
+
+    # set_axes(axis_1,axis_2,rover) - drive manual control inputs
+    def set_axes(self,axis_1,axis_2,rover=None):
+        for r in self._selected(rover):
+            if isinstance(r.control_input,rover_control.ManualInput):
+                r.control_input.set_axes(axis_1,axis_2)
+
+    # start_video(geometry,player_cmd,rover) - geometry "x:y" of the player
+    # window, an empty player_cmd discards the stream (headless relay)
+    def start_video(self,geometry=None,player_cmd=None,rover=None):
+        for r in self._selected(rover): r.start_video(geometry,player_cmd)
+
+    # prepare_video(geometry,rover) - start a standby player ahead of
+    # start_video(), does not block
+    def prepare_video(self,geometry=None,rover=None):
+        for r in self._selected(rover): r.prepare_video(geometry)
+
+    def stop_video(self,rover=None):
+        for r in self._selected(rover): r.stop_video()
+
+    # start_recording(rover) / stop_recording(rover) - record the video
+    # stream to disk, with or without a running video channel
+    def start_recording(self,rover=None):
+        for r in self._selected(rover): self.net_core.loop.call_soon_threadsafe(r.start_recording)
+
+    def stop_recording(self,rover=None):
+        for r in self._selected(rover): self.net_core.loop.call_soon_threadsafe(r.stop_recording)
+
+    def is_recording(self,rover=None):
+        return self.rover(rover).video_recorder is not None
+
+    def start_telemetry(self,rover=None):
+        for r in self._selected(rover): self.telemetry.attach(r)
+        rover_log.info('telemetry',"start telemetry channel")
+        self.net_core.start_channel('telemetry',self.telemetry.run)
+
+    def stop_telemetry(self,rover=None):
+        for r in self._selected(rover): self.telemetry.detach(r)
+        if not self.telemetry.rovers:
+            rover_log.info('telemetry',"stop telemetry channel")
+            self.net_core.stop_channel('telemetry')
+
+    # system_command(msg_string,rover) - does not block, returns a concurrent future
+    def system_command(self,msg_string,rover=None):
+        return self.net_core.submit(self.rover(rover).system_channel(msg_string))
+
+    # select_profile(name,rover) / next_profile(rover) - drive profile of the
+    # rover driven by the gamepad, or of the given one
+    def select_profile(self,name,rover=None):
+        r = self.rover(rover)
+        if name not in r.profiles: raise ValueError("unknown drive profile: {}".format(name))
+        self.net_core.loop.call_soon_threadsafe(r.select_profile,name)
+
+    def next_profile(self,rover=None):
+        self.net_core.loop.call_soon_threadsafe(self.rover(rover).next_profile)
+
+    # export_rtt(rover) - control round-trip histograms written to files,
+    # does not block, returns a concurrent future of the file names
+    def export_rtt(self,rover=None):
+        async def export(rovers):
+            return [await r.export_rtt() for r in rovers]
+        return self.net_core.submit(export(self._selected(rover)))
+
+    # ping(rover) - 'ping' over the system connection, the reply shows the
+    # rover server answers; None with the raw protocol, which has no replies
+    def ping(self,rover=None):
+        if self.rover(rover).settings.SYSTEM_PROTOCOL != rover_system.PROTOCOL_FRAMED: return None
+        return self.system_command('ping',rover)
+
+# ------------------------------------------------------------------------------
+# sample_reconnect(metrics,reconnect,**labels) - connection state, attempts
+# and recoveries of a channel
+# ------------------------------------------------------------------------------
+def sample_reconnect(metrics,reconnect,**labels):
+    metrics.gauge('rover_channel_connected','channel connection is up').set(
+        int(reconnect.state == rover_net.STATE_CONNECTED),**labels)
+    metrics.counter('rover_channel_connect_attempts_total','channel connection attempts').set(reconnect.attempts,**labels)
+    metrics.counter('rover_channel_reconnects_total','channel connections made again after a loss').set(reconnect.reconnects,**labels)
+    durations,recoveries = reconnect.drain()
+    attempt_metric = metrics.histogram('rover_channel_connect_seconds','channel connection attempt duration',rover_net.CONNECT_BUCKETS)
+    for seconds in durations: attempt_metric.observe(seconds,**labels)
+    recover_metric = metrics.histogram('rover_channel_recover_seconds','time from a lost channel connection to the next one',
+        rover_net.RECOVER_BUCKETS)
+    for seconds in recoveries: recover_metric.observe(seconds,**labels)
+
+# ------------------------------------------------------------------------------
+# Rover(engine,settings) - channels of one rover
+# ------------------------------------------------------------------------------
+class Rover:
+
+    def __init__(self,engine,settings):
+        self.engine = engine
+        self.settings = settings
+        self.name = settings.NAME
+        # decoded telemetry history, kept across telemetry channel restarts
+        self.telemetry_store = rover_telemetry.TelemetryStore(settings.TELEMETRY_HISTORY)
+        # continuous link prober
+        self.link_prober = rover_link.LinkProber(settings.ROVER_IP,settings.LINK_PROBE_INTERVAL,
+            settings.LINK_PROBE_TIMEOUT,udp_port=settings.LINK_PROBE_UDP_PORT)
+        # system command connection, kept open
+        self.system_link = rover_system.SystemLink(settings.ROVER_IP,settings.ROVER_SYSTEM_PORT,
+            settings.SYSTEM_PROTOCOL,settings.SYSTEM_TIMEOUT,settings.RECONNECT_MAX_DELAY)
+        # input source, link and transmit policy of the running control channel
+        self.control_input = None
+        self.control_link = None
+        self.control_policy = None
+        # drive profiles by name and the one in use, compiled by the control
+        # channel
+        self.profiles = self._profiles(settings)
+        self.profile = self.profiles[settings.CONTROL_PROFILE]
+        # control round trips: frame id -> send time of the frames not echoed
+        # yet by $MOT, and the latency histogram, kept across sessions
+        self.control_sent = collections.OrderedDict()
+        self.control_rtt = rover_metrics.HdrHistogram(settings.CONTROL_RTT_WINDOW)
+        # time of the last motor status update
+        self.motor_status_time = -TELEMETRY_STATUS_INTERVAL
+        # player command line given to start_video(), None for the player of
+        # the settings, the process id of the running player, the position of
+        # its window, and the player started ahead of the next video channel
+        self.player_cmd = None
+        self.player_pid = None
+        self.geometry = None
+        self.standby = rover_player.StandbyPlayer()
+        # relay of the running video channel, and the recorder tapping it
+        self.video_relay = None
+        # reconnect state of the running video channel
+        self.video_reconnect = None
+        self.video_recorder = None
+        # stopped recorders still writing their queue to disk
+        self.closing_recorders = set()
+        # bytes written and dropped by finished recordings
+        self._recorded = (0,0)
+
+    @staticmethod
+    def _profiles(settings):
+        return collections.OrderedDict((name,rover_control.DriveProfile.parse(name,spec))
+            for name,spec in settings.CONTROL_PROFILES)
+
+    # channel(kind) - network channel name, unique in the fleet
+    def channel(self,kind):
+        return "{}/{}".format(self.name,kind)
+
+    def success(self,channel,msg):
+        self.engine.success(self.name,channel,msg)
+
+    def error(self,channel,msg):
+        self.engine.error(self.name,channel,msg)
+
+    # apply_settings(settings) - new settings of the rover, applied to the
+    # running channels without stopping the ones a change does not concern.
+    # Runs on the network thread.
+    def apply_settings(self,settings):
+        # ROVERS is the engine's business
+        changes = [name for name in self.settings.changes(settings) if name != 'ROVERS']
+        self.settings = settings
+        if not changes: return changes
+        rover_log.info('engine',"{} settings changed: {}",self.name,', '.join(changes))
+        changed = set(changes)
+
+        # control: same socket and sequence numbers, new destination and rates
+        if self.control_link is not None:
+            if changed & {'ROVER_IP','ROVER_CONTROL_PORT','CONTROL_FRAME_FORMAT'}:
+                self.control_link.retarget(settings.ROVER_IP,settings.ROVER_CONTROL_PORT,settings.CONTROL_FRAME_FORMAT)
+            if changed & {'CONTROL_MAX_RATE','CONTROL_DELTA','CONTROL_HEARTBEAT'}:
+                self.control_policy.configure(settings.CONTROL_MAX_RATE,settings.CONTROL_DELTA,settings.CONTROL_HEARTBEAT)
+
+        # drive profiles: the one in use is kept unless CONTROL_PROFILE changed
+        # or it is gone
+        if changed & {'CONTROL_PROFILES','CONTROL_PROFILE'}:
+            self.profiles = self._profiles(settings)
+            name = self.profile.name
+            if 'CONTROL_PROFILE' in changed or name not in self.profiles: name = settings.CONTROL_PROFILE
+            if self.control_link is not None:
+                for profile in self.profiles.values(): profile.compile()
+            self.select_profile(name)
+
+        if 'CONTROL_RTT_WINDOW' in changed:
+            self.control_rtt = rover_metrics.HdrHistogram(settings.CONTROL_RTT_WINDOW)
+
+        # link prober: a new target starts a new probe history
+        if changed & {'ROVER_IP','LINK_PROBE_INTERVAL','LINK_PROBE_TIMEOUT','LINK_PROBE_UDP_PORT'}:
+            self.link_prober = rover_link.LinkProber(settings.ROVER_IP,settings.LINK_PROBE_INTERVAL,
+                settings.LINK_PROBE_TIMEOUT,udp_port=settings.LINK_PROBE_UDP_PORT)
+            self.engine.net_core.restart_channel(self.channel('link'),self.link_prober.run)
+
+        # system: commands in flight fail, the next ones use the new connection
+        if changed & {'ROVER_IP','ROVER_SYSTEM_PORT','SYSTEM_PROTOCOL','SYSTEM_TIMEOUT','RECONNECT_MAX_DELAY'}:
+            self.system_link = rover_system.SystemLink(settings.ROVER_IP,settings.ROVER_SYSTEM_PORT,
+                settings.SYSTEM_PROTOCOL,settings.SYSTEM_TIMEOUT,settings.RECONNECT_MAX_DELAY)
+            self.engine.net_core.restart_channel(self.channel('system'),self.system_link.run)
+
+        # video: stream and player are started again; recorder settings are
+        # used by the next recording
+        if self.engine.net_core.is_running(self.channel('video')) and (changed & {'ROVER_IP','ROVER_VIDEO_PORT'}
+                or any(name.startswith('VIDEO_') and not name.startswith('VIDEO_RECORD') for name in changes)):
+            rover_log.info('video',"restart video channel {}",self.name)
+            self.engine.net_core.restart_channel(self.channel('video'),self.video_channel,self.player_cmd)
+        elif self.standby.player is not None and any(name.startswith('VIDEO_PLAYER') for name in changes):
+            # the video channel replaces the standby when it starts
+            if settings.VIDEO_PLAYER_STANDBY:
+                self.prepare_standby(self.player_cmd)
+            else:
+                self.standby.close()
+        if 'VIDEO_RECORD' in changed:
+            if settings.VIDEO_RECORD: self.start_recording()
+            else: self.stop_recording()
+
+        restart = [name for name in changes if name in rover_config.RESTART_SETTINGS]
+        if restart:
+            self.error('system',"Config: restart for " + ', '.join(restart))
+        else:
+            self.success('system',"Config: " + ', '.join(changes))
+        return changes
+
+    # --------------------------------------------------------------------------
+    # Control
+    # --------------------------------------------------------------------------
+
+    def start_control(self,device_id=0,source=None):
+        rover_log.info('control',"start control channel {}",self.name)
+        self.success('control',"Control: started")
+        self.engine.net_core.start_channel(self.channel('control'),self.control_channel,device_id,source)
+
+    def stop_control(self):
+        rover_log.info('control',"stop control channel {}",self.name)
+        self.engine.net_core.stop_channel(self.channel('control'))
+
+    # select_profile(name) / next_profile() - drive profile in use, from the
+    # next frame on; network thread
+    def select_profile(self,name):
+        self.profile = self.profiles[name]
+        rover_log.info('control',"{} drive profile {}",self.name,name)
+        self.success('control',"Profile: {}".format(name))
+        # the control channel maps the current stick position again
+        if self.control_input is not None and hasattr(self.control_input,'wake'): self.control_input.wake()
+
+    def next_profile(self):
+        names = list(self.profiles)
+        self.select_profile(names[(names.index(self.profile.name) + 1) % len(names)])
+
+    # control_channel(device_id,source) - runs on every input event of the
+    # source, and when the transmit policy has a frame due
+    async def control_channel(self,device_id,source):
+        settings = self.settings
+        rover_log.info('control',"control_channel() {}",self.name)
+
+        # init joystick, on the network thread like every other channel
+        if source is None:
+            try:
+                source = GamepadInput(self.engine,self.name,self.engine.gamepad(device_id))
+            except ValueError as e:
+                rover_log.warning('control',"no joystick found: {}",str(e))
+                self.error('control',"Joystick error")
+                return
+        self.control_input = source
+
+        # one control socket for the whole session, retargeted by apply_settings()
+        link = self.control_link = rover_control.ControlLink(settings.ROVER_IP,settings.ROVER_CONTROL_PORT,settings.CONTROL_FRAME_FORMAT).open()
+        policy = self.control_policy = rover_control.TransmitPolicy(settings.CONTROL_MAX_RATE,settings.CONTROL_DELTA,settings.CONTROL_HEARTBEAT)
+        frames_metric = self.engine.metrics.counter('rover_control_frames_total','control frames sent')
+        send_errors_metric = self.engine.metrics.counter('rover_control_send_errors_total','control frames not sent, socket error')
+        latency_metric = self.engine.metrics.histogram('rover_control_input_latency_seconds',
+            'input event to control frame send',rover_control.INPUT_LATENCY_BUCKETS)
+
+        # lookup tables of every profile, before the first frame
+        for profile in self.profiles.values(): profile.compile()
+
+        # input events wake the channel from the input thread
+        loop = asyncio.get_running_loop()
+        wakeup = asyncio.Event()
+        def notify(): loop.call_soon_threadsafe(wakeup.set)
+        listening = hasattr(source,'listen')
+        if listening: source.listen(notify)
+
+        try:
+            # time of the oldest input event not on the wire yet
+            input_time = None
+            while True:
+                wakeup.clear()
+                if listening:
+                    event_time = source.input_time()
+                    if input_time is None: input_time = event_time
+
+                # send button and hat control values
+                control_msg = source.message()
+                if control_msg != "":
+                    rover_log.debug('control',"{}",control_msg)
+                    if link.send_message(control_msg) > 0:
+                        frames_metric.inc(kind='button',rover=self.name)
+                        if input_time is not None:
+                            latency_metric.observe(time.monotonic() - input_time,kind='button',rover=self.name)
+                        self.success('control',control_msg)
+                    else:
+                        send_errors_metric.set(link.send_errors,rover=self.name)
+                        self.error('control',"Control: send error")
+
+                # send joystick control message when the transmit policy allows it
+                frame = policy.update(self.profile.pwm(*source.axes()))
+                if frame is not None and link.send_axes(*frame) > 0:
+                    if link.frame_format == rover_control.FRAME_FORMAT_BINARY:
+                        # send time of the frame id, until $MOT echoes it
+                        self.control_sent[link.sequence] = time.monotonic()
+                        if len(self.control_sent) > rover_control.RTT_PENDING: self.control_sent.popitem(last=False)
+                    if input_time is not None and policy.last_kind != 'heartbeat':
+                        latency_metric.observe(time.monotonic() - input_time,kind='axes',rover=self.name)
+                    frames_metric.inc(kind='axes',rover=self.name)
+                    rover_log.debug('control',"7,{},{},{},{}",*frame)
+                    self.success('control',"Control: 7,{},{},{},{}".format(*frame))
+                elif frame is not None:
+                    # the next heartbeat or change tries again
+                    send_errors_metric.set(link.send_errors,rover=self.name)
+                    self.error('control',"Control: send error")
+                # a change held back by max rate keeps its input time
+                if not policy.pending: input_time = None
+
+                # wait for the next event, or the next frame due
+                timeout = policy.next_time() - time.monotonic()
+                if not listening: timeout = min(timeout,rover_control.POLL_INTERVAL)
+                if timeout > 0:
+                    timer = loop.call_later(timeout,wakeup.set)
+                    try:
+                        await wakeup.wait()
+                    finally:
+                        timer.cancel()
+                else:
+                    await asyncio.sleep(0)
+
+        finally:
+            if listening: source.unlisten(notify)
+            # leave the rover stopped rather than waiting for its failsafe;
+            # a send error is counted, the link still closes
+            link.send_axes(*rover_control.STOP_FRAME)
+            send_errors_metric.set(link.send_errors,rover=self.name)
+            link.close()
+            self.control_input = self.control_link = self.control_policy = None
+            self.error('control',"Control: stopped")
+            self.error('motor',"Motor: no data")
+
+    # sample_reconnects(metrics) - video and system connections
+    def sample_reconnects(self,metrics):
+        if self.video_reconnect: sample_reconnect(metrics,self.video_reconnect,channel='video',rover=self.name)
+        sample_reconnect(metrics,self.link_prober.reconnect,channel='link',rover=self.name)
+        if self.settings.SYSTEM_PROTOCOL == rover_system.PROTOCOL_FRAMED:
+            sample_reconnect(metrics,self.system_link.reconnect,channel='system',rover=self.name)
+
+    # --------------------------------------------------------------------------
+    # Video
+    # --------------------------------------------------------------------------
+
+    def start_video(self,geometry=None,player_cmd=None):
+        rover_log.info('video',"start video channel {}",self.name)
+        self.success('video',"Video: started")
+        if geometry: self.geometry = geometry
+        self.player_cmd = player_cmd
+        self.engine.net_core.start_channel(self.channel('video'),self.video_channel,player_cmd)
+
+    def prepare_video(self,geometry=None):
+        if geometry: self.geometry = geometry
+        if self.settings.VIDEO_PLAYER_STANDBY: self.prepare_standby(None)
+
+    # player(player_cmd) - video player, not started: player_cmd or the
+    # player of the settings
+    def player(self,player_cmd=None):
+        settings = self.settings
+        if player_cmd is not None: return rover_player.CommandPlayer(player_cmd)
+        if settings.VIDEO_PLAYER == rover_player.PLAYER_DECODER:
+            return rover_player.DecoderPlayer(lambda image: self.engine.frames(self.name,image),self.name)
+        return rover_player.CommandPlayer(rover_player.player_command(settings.VIDEO_PLAYER,
+            settings.VIDEO_PLAYER_CMD,self.geometry,settings.VIDEO_PLAYER_FPS))
+
+    # prepare_standby(player_cmd) - start the standby player on a worker
+    # thread of the network loop, from any thread
+    def prepare_standby(self,player_cmd):
+        loop = self.engine.net_core.loop
+        loop.call_soon_threadsafe(loop.run_in_executor,None,self._prepare_standby,player_cmd)
+
+    def _prepare_standby(self,player_cmd):
+        try:
+            self.standby.prepare(self.player(player_cmd))
+        except (OSError,ImportError) as e:
+            rover_log.error('video',"standby player {}: {}",self.name,str(e))
+
+    # stop_video() - cancelling the channel closes the socket and the player
+    def stop_video(self):
+        rover_log.info('video',"stop video channel {}",self.name)
+        self.engine.net_core.stop_channel(self.channel('video'))
+
+    # video_channel(player_cmd) - an empty player_cmd discards the stream
+    async def video_channel(self,player_cmd):
+        settings = self.settings
+
+        rover_log.info('video',"video_channel() {}",self.name)
+        loop = asyncio.get_running_loop()
+        opened = time.monotonic()
+        reconnect = self.video_reconnect = rover_net.Reconnect(settings.RECONNECT_MAX_DELAY)
+
+        # report relay throughput once per second
+        async def report(relay,monitor,controller):
+            metrics = self.engine.metrics
+            bytes_metric = metrics.counter('rover_video_bytes_total','video bytes relayed to the player')
+            stall_metric = metrics.counter('rover_video_pipe_stall_seconds_total','time the relay waited on a full player pipe')
+            drop_metric = metrics.counter('rover_video_frames_dropped_total','video frames dropped by the jitter buffer')
+            fill_metric = metrics.gauge('rover_video_pipe_fill_bytes','bytes queued in the player pipe')
+            fps_metric = metrics.gauge('rover_video_fps','video frames per second received')
+            gap_metric = metrics.gauge('rover_video_frame_gap_seconds','largest gap between two video frames')
+            stalls_metric = metrics.counter('rover_video_stalls_total','video stream stalls')
+            stalled_metric = metrics.counter('rover_video_stream_stall_seconds_total','time the video stream stalled')
+            first_metric = metrics.gauge('rover_video_first_data_seconds','time from video start to the first stream data')
+            picture_metric = metrics.gauge('rover_video_first_frame_seconds','time from the first stream data to the first decoded picture')
+            last_bytes,last_stall,last_drop,last_stalls,last_stalled = 0,0.0,0,0,0.0
+            first_data = first_frame = None
+            while True:
+                await asyncio.sleep(1)
+                if first_data is None and monitor.first_read is not None:
+                    first_data = monitor.first_read - opened
+                    first_metric.set(first_data,rover=self.name)
+                    rover_log.info('video',"{} first video data in {:.0f} ms",self.name,first_data * 1000)
+                if first_frame is None and getattr(player,'first_frame',None) is not None:
+                    first_frame = player.first_frame
+                    picture_metric.set(first_frame,rover=self.name)
+                bytes_metric.inc(relay.bytes_total - last_bytes,rover=self.name)
+                stall_metric.inc(relay.pipe_stall_time - last_stall,rover=self.name)
+                drop_metric.inc(relay.frames_dropped - last_drop,rover=self.name)
+                stalls_metric.inc(monitor.stalls - last_stalls,rover=self.name)
+                stalled_metric.inc(monitor.stall_time_total - last_stalled,rover=self.name)
+                last_bytes,last_stall,last_drop = relay.bytes_total,relay.pipe_stall_time,relay.frames_dropped
+                last_stalls,last_stalled = monitor.stalls,monitor.stall_time_total
+                fill_metric.set(relay.pipe_fill() or 0,rover=self.name)
+                stats = monitor.stats()
+                byte_rate,syscall_rate = relay.rates()
+                video_msg = "Video: {} kB/s {} sc/s".format(int(byte_rate/1024),int(syscall_rate))
+                if stats['fps'] is not None:
+                    fps_metric.set(stats['fps'],rover=self.name)
+                    gap_metric.set(stats['frame_gap'],rover=self.name)
+                    video_msg += " {:.0f} fps".format(stats['fps'])
+                if controller: video_msg += " L{}".format(controller.level)
+                if settings.VIDEO_LOW_LATENCY: video_msg += " drop {}".format(relay.frames_dropped)
+                recorder = self.video_recorder
+                if recorder:
+                    video_msg += " rec {} MB".format(recorder.bytes_written // 1048576)
+                    if recorder.bytes_dropped: video_msg += " lost {} kB".format(recorder.bytes_dropped // 1024)
+                rover_log.debug('video',"{} {} total: {}",self.name,video_msg,relay.bytes_total)
+                # the reconnect messages stay up during an outage
+                if reconnect.state == rover_net.STATE_CONNECTED: self.success('video',video_msg)
+
+        # ask the rover for the encoder level the stream can sustain, over
+        # the system channel; the current level first, after a reconnection
+        # or from an earlier session the rover may run another one
+        async def adapt(monitor,controller):
+            metrics = self.engine.metrics
+            level_metric = metrics.gauge('rover_video_level','encoder level asked of the rover, 0 is the best')
+            bitrate_metric = metrics.gauge('rover_video_bitrate_bps','encoder bitrate asked of the rover')
+            changes_metric = metrics.counter('rover_video_level_changes_total','encoder level changes by direction')
+
+            async def request(level):
+                bitrate,size = controller.levels[level]
+                command = settings.VIDEO_ADAPT_COMMAND.format(bitrate=bitrate,size=size).strip()
+                rover_log.info('video',"{} video level {}: {}",self.name,level,command)
+                reply = await self.system_channel(command)
+                if reply is None or reply.status != 0:
+                    controller.failed()
+                    return
+                if level != controller.level:
+                    changes_metric.inc(direction='down' if level > controller.level else 'up',rover=self.name)
+                controller.changed(level)
+                level_metric.set(level,rover=self.name)
+                bitrate_metric.set(bitrate,rover=self.name)
+                # the statistics of the old level must not decide the next step
+                monitor.reset()
+
+            await request(controller.level)
+            while True:
+                await asyncio.sleep(rover_video.MONITOR_BUCKET)
+                level = controller.update(monitor.stats())
+                if level is not None: await request(level)
+
+        # recv data from video server and send player
+        player = None
+        sink_fd = None
+        client_socket = None
+        reporter = None
+        adapter = None
+        hits = self.standby.hits
+        try:
+            if player_cmd != []:
+                # video player: the standby when it matches, spawned off the
+                # loop otherwise
+                try:
+                    player = await loop.run_in_executor(None,self.standby.take,self.player(player_cmd))
+                except (OSError,ImportError) as e:
+                    rover_log.error('video',"player: {}",str(e))
+                    self.error('video',"Error: player")
+                    return
+                self.player_pid = player.pid
+                out_fd = player.fd
+                standby = 'hit' if self.standby.hits > hits else 'miss'
+                self.engine.metrics.counter('rover_video_player_starts_total','video players started, by standby hit or miss').inc(
+                    standby=standby,rover=self.name)
+                if standby == 'miss':
+                    self.engine.metrics.gauge('rover_video_player_start_seconds','time taken to start a video player').set(
+                        player.start_time,rover=self.name)
+                rover_log.info('video',"player pid: {} standby {}",self.player_pid,standby)
+                # the next video channel starts with a ready player
+                if settings.VIDEO_PLAYER_STANDBY: self.prepare_standby(player_cmd)
+            else:
+                # no player: relay into /dev/null
+                sink_fd = out_fd = os.open(os.devnull,os.O_WRONLY)
+
+            relay = None
+            monitor = rover_video.StreamMonitor()
+            controller = None
+            if settings.VIDEO_ADAPTIVE:
+                controller = rover_video.BitrateController(rover_video.parse_levels(settings.VIDEO_ADAPT_LEVELS),
+                    settings.VIDEO_ADAPT_DOWN_TIME,settings.VIDEO_ADAPT_UP_TIME)
+            if settings.VIDEO_RECORD and self.video_recorder is None: self.start_recording()
+
+            # relay data from video server to stream player; a lost
+            # connection is made again, the player keeps running
+            while True:
+                client_socket = await self._video_connect(reconnect)
+                if relay is None:
+                    if settings.VIDEO_LOW_LATENCY:
+                        relay = rover_video.LowLatencyRelay(client_socket,out_fd,settings.VIDEO_READ_SIZE,
+                            settings.VIDEO_MAX_FRAMES,settings.VIDEO_LATENCY_BUDGET)
+                    else:
+                        relay = rover_video.VideoRelay(client_socket,out_fd,settings.VIDEO_READ_SIZE,settings.VIDEO_RELAY_MODE)
+                    rover_log.info('video',"video relay mode: {} read size: {}",relay.mode,relay.read_size)
+                    self.video_relay = relay
+                    relay.tap = self.video_recorder
+                    relay.monitor = monitor
+                    reporter = asyncio.ensure_future(report(relay,monitor,controller))
+                else:
+                    # the player picks up at the next key frame
+                    relay.attach(client_socket)
+                if controller: adapter = asyncio.ensure_future(adapt(monitor,controller))
+
+                try:
+                    await relay.run()
+                    rover_log.error('video',"connection closed")
+                except BrokenPipeError:
+                    # the player is gone, there is nothing to reconnect for
+                    raise
+                except OSError as e:
+                    rover_log.error('video',"{}",str(e))
+                finally:
+                    client_socket.close()
+                    client_socket = None
+                    if adapter: adapter.cancel()
+                    adapter = None
+                reconnect.lost()
+                self.error('video',"Video: lost, reconnecting")
+
+        except BrokenPipeError:
+            rover_log.error('video',"player closed")
+            self.error('video',"Error: player closed")
+        finally:
+            if reporter: reporter.cancel()
+            if adapter: adapter.cancel()
+            if player: player.close()
+            if sink_fd is not None: os.close(sink_fd)
+            self.player_pid = None
+            self.video_relay = None
+            self.video_reconnect = None
+            if client_socket: client_socket.close()
+            self.error('video',"Video: channel closed")
+            rover_log.info('video',"video channel closed {}",self.name)
+
+    # _video_connect(reconnect) - socket connected to the video server; tries
+    # until it is, with the reconnect backoff between attempts
+    async def _video_connect(self,reconnect):
+        loop = asyncio.get_running_loop()
+        settings = self.settings
+        robot_ip,robot_port = settings.ROVER_IP,settings.ROVER_VIDEO_PORT
+        if reconnect.lost_time is not None: await reconnect.wait()
+        while True:
+            reconnect.connecting()
+            client_socket = socket.socket()
+            client_socket.setblocking(False)
+            try:
+                await asyncio.wait_for(loop.sock_connect(client_socket,(robot_ip,robot_port)),rover_net.CONNECT_TIMEOUT)
+            except (OSError,asyncio.TimeoutError) as e:
+                client_socket.close()
+                reconnect.failed()
+                delay = reconnect.delay()
+                rover_log.warning('video',"not connected to {}:{}: {}, retry in {:.1f} s",
+                    robot_ip,robot_port,str(e) or 'timeout',delay)
+                self.error('video',"Video: retry {} in {:.1f} s".format(reconnect.failures,delay))
+                await asyncio.sleep(delay)
+                continue
+            except asyncio.CancelledError:
+                client_socket.close()
+                raise
+            recovery = reconnect.connected()
+            rover_log.info('video',"connected to {}:{}",robot_ip,robot_port)
+            if recovery is not None:
+                rover_log.info('video',"{} video recovered in {:.2f} s",self.name,recovery)
+                self.success('video',"Video: reconnected in {:.1f} s".format(recovery))
+            return client_socket
+
+    # --------------------------------------------------------------------------
+    # Video recording, on the network thread
+    # --------------------------------------------------------------------------
+
+    def start_recording(self):
+        if self.video_recorder is not None: return
+        settings = self.settings
+        try:
+            self.video_recorder = rover_video.VideoRecorder(os.path.join(settings.VIDEO_RECORD_DIR,self.name),
+                settings.VIDEO_RECORD_SEGMENT_SIZE,settings.VIDEO_RECORD_SEGMENT_TIME,settings.VIDEO_RECORD_QUEUE)
+        except OSError as e:
+            rover_log.error('video',"{}",str(e))
+            self.error('video',"Record: error")
+            return
+        rover_log.info('video',"start recording {} in {}",self.name,self.video_recorder.directory)
+        # the relay of a running channel is tapped in place, the video
+        # socket stays connected
+        if self.video_relay is not None: self.video_relay.tap = self.video_recorder
+        self.success('video',"Record: started")
+
+    def stop_recording(self):
+        recorder = self.video_recorder
+        if recorder is None: return
+        if self.video_relay is not None: self.video_relay.tap = None
+        self.video_recorder = None
+        # the writer thread finishes the queue off the loop, the counters
+        # are final once it has
+        self.closing_recorders.add(recorder)
+        future = self.engine.net_core.loop.run_in_executor(None,recorder.close,True)
+        future.add_done_callback(lambda future: self._recording_closed(recorder))
+        self.error('video',"Record: stopped")
+
+    def _recording_closed(self,recorder):
+        self.closing_recorders.discard(recorder)
+        written,dropped = self._recorded
+        self._recorded = (written + recorder.bytes_written,dropped + recorder.bytes_dropped)
+        rover_log.info('video',"stop recording {}: {} bytes written, {} dropped",
+            self.name,recorder.bytes_written,recorder.bytes_dropped)
+
+    # sample_recording(metrics) - recorder counters, called by the supervisor
+    def sample_recording(self,metrics):
+        recorder = self.video_recorder
+        if recorder is not None and recorder.error is not None:
+            # the writer thread failed: the tap goes, the error stays shown
+            self.stop_recording()
+            self.error('video',"Record: error")
+            recorder = None
+        written,dropped = self._recorded
+        queued = 0
+        for r in ([recorder] if recorder else []) + list(self.closing_recorders):
+            written,dropped,queued = written + r.bytes_written,dropped + r.bytes_dropped,queued + r.queued_bytes
+        metrics.counter('rover_video_record_bytes_total','video bytes written to disk').set(written,rover=self.name)
+        metrics.counter('rover_video_record_dropped_bytes_total','video bytes dropped by a full recorder queue').set(dropped,rover=self.name)
+        metrics.gauge('rover_video_record_queue_bytes','video bytes waiting for the disk').set(queued,rover=self.name)
+
+    # --------------------------------------------------------------------------
+    # Telemetry
+    # --------------------------------------------------------------------------
+
+    # telemetry_received(telemetry_data,now) - called by the fleet listener
+    def telemetry_received(self,telemetry_data,now):
+        try:
+            tag,record = self.telemetry_store.ingest(telemetry_data,now)
+        except ValueError as e:
+            rover_log.debug('telemetry',"decode error: {}",str(e))
+            return
+        if tag == b'$MOT':
+            # at hundreds of sentences a second, the front-end gets a few
+            if now - self.motor_status_time >= TELEMETRY_STATUS_INTERVAL:
+                self.motor_status_time = now
+                self.success('motor',"Motor: {:g}".format(record.motor))
+            # first echo of a frame id, later ones repeat the same frame;
+            # a NaN or infinite id (field missing or garbled) matches none
+            if math.isfinite(record.frame_id):
+                sent = self.control_sent.pop(int(record.frame_id),None)
+                if sent is not None: self.control_rtt.record(now - sent,now)
+
+    # sample_rtt(metrics) - control round-trip percentiles, called by the
+    # supervisor
+    def sample_rtt(self,metrics):
+        summary = self.control_rtt.summary()
+        if not summary['count']:
+            if self.control_rtt.total:
+                self.error('rtt',"RTT p50/p99/max\nno round trip")
+            elif self.control_link is not None and self.settings.CONTROL_FRAME_FORMAT != rover_control.FRAME_FORMAT_BINARY:
+                # csv frames have no id for the rover to echo
+                self.error('rtt',"RTT p50/p99/max\nneeds binary frames")
+            return
+        rtt = metrics.summary('rover_control_rtt_seconds','control frame to $MOT echo round-trip time')
+        for quantile,key in (('0.5','p50'),('0.9','p90'),('0.99','p99'),('1','max')):
+            rtt.set(summary[key],quantile=quantile,rover=self.name)
+        self.success('rtt',"RTT p50/p99/max\n{:.1f}/{:.1f}/{:.1f} ms".format(
+            summary['p50'] * 1000,summary['p99'] * 1000,summary['max'] * 1000))
+
+    # export_rtt() - write the round-trip histogram to CONTROL_RTT_DIR as a
+    # .hgrm percentile distribution, returns the file name
+    async def export_rtt(self):
+        directory = self.settings.CONTROL_RTT_DIR
+        os.makedirs(directory,exist_ok=True)
+        path = os.path.join(directory,"rtt-{}-{}.hgrm".format(self.name,time.strftime('%Y%m%d-%H%M%S')))
+        with open(path,'w') as f:
+            self.control_rtt.export(f)
+        rover_log.info('control',"control round trips of {} written to {}",self.name,path)
+        self.success('control',"RTT: saved {}".format(os.path.basename(path)))
+        return path
+
+    # --------------------------------------------------------------------------
+    # System
+    # --------------------------------------------------------------------------
+
+    # system_channel(msg_string) - Reply of the rover, None when the command
+    # could not be sent or got no reply in time
+    async def system_channel(self,msg_string):
+        metrics = self.engine.metrics
+        commands_metric = metrics.counter('rover_system_commands_total','system commands by result')
+        rover_log.info('system',"system command {}: {}",self.name,msg_string)
+        try:
+            reply = await self.system_link.request(msg_string)
+        except asyncio.TimeoutError:
+            rover_log.error('system',"no reply from {}",self.name)
+            self.error('system',"System: no reply")
+            commands_metric.inc(result='timeout',rover=self.name)
+            return None
+        except rover_system.NotConnectedError as e:
+            rover_log.error('system',"{}",str(e))
+            self.error('system',"System: not connected")
+            commands_metric.inc(result='not_connected',rover=self.name)
+            return None
+        except OSError as e:
+            rover_log.error('system',"{}",str(e))
+            self.error('system',"System: link error")
+            commands_metric.inc(result='error',rover=self.name)
+            return None
+
+        metrics.gauge('rover_system_rtt_seconds','last system command round-trip time').set(reply.rtt,rover=self.name)
+        rover_log.info('system',"system reply {} status {}: {}",self.name,reply.status,reply.output)
+        # first line only, the log box has one
+        output = (reply.output.splitlines() or [''])[0]
+        if reply.status is rover_system.STATUS_UNCONFIRMED:
+            self.success('system',"System: sent")
+            commands_metric.inc(result='sent',rover=self.name)
+        elif reply.status == 0:
+            self.success('system',"System: {} {:.0f} ms".format(output or 'done',reply.rtt * 1000))
+            commands_metric.inc(result='ok',rover=self.name)
+        else:
+            self.error('system',"System: failed {} {}".format(reply.status,output))
+            commands_metric.inc(result='failed',rover=self.name)
+        return reply
+
+# ------------------------------------------------------------------------------
+# GamepadInput(engine,rover,joystick) - the shared gamepad as seen by the
+# control channel of one rover: centred sticks unless the rover is driven
+# ------------------------------------------------------------------------------
+class GamepadInput:
+
+    def __init__(self,engine,rover,joystick):
+        self.engine = engine
+        self.rover = rover
+        self.joystick = joystick
+        self.name = joystick.name
+
+    def message(self):
+        # only the driven rover reads the gamepad events
+        if self.engine.active != self.rover: return ""
+        msg = self.joystick.message()
+        if not msg: return msg
+        rover = self.engine.rover(self.rover)
+        switch_button = self.engine.settings.CONTROL_SWITCH_BUTTON
+        profile_button = rover.settings.CONTROL_PROFILE_BUTTON
+        pressed = self.joystick.pressed
+        if profile_button in pressed: rover.next_profile()
+        if switch_button in pressed: self.engine.next_rover()
+        # neither edge of the switch and profile buttons is forwarded to the
+        # rover, the other buttons of the same batch are
+        return rover_control.filter_buttons(msg,(switch_button,profile_button),pressed + self.joystick.released)
+
+    def axes(self):
+        if self.engine.active != self.rover: return (0,0)
+        return self.joystick.axes()
+
+    def listen(self,notify):
+        self.joystick.listen(notify)
+
+    def wake(self):
+        self.joystick.wake()
+
+    def unlisten(self,notify):
+        self.joystick.unlisten(notify)
+
+    def input_time(self):
+        # events belong to the driven rover
+        if self.engine.active != self.rover: return None
+        return self.joystick.input_time()
+
+# ------------------------------------------------------------------------------
+# TelemetryListener(engine) - one telemetry socket for the fleet
+#
+# A datagram goes to the rover whose (ROVER_IP,ROVER_TELEMETRY_PORT) or
+# ROVER_IP matches its source address. With a single rover listening every
+# datagram is its own, replayed recordings included.
+# ------------------------------------------------------------------------------
+class TelemetryListener:
+
+    def __init__(self,engine):
+        self.engine = engine
+        self.rovers = {}
+        self.routes = {}
+        self.recorder = None
+        self.unknown = 0
+        # bind state, batched socket reader and the future set when the
+        # socket fails
+        self.reconnect = None
+        self.receiver = None
+        self.closed = None
+        # receiver counters at the last sample, for the cost per datagram
+        self._sampled = (0,0.0)
+
+    def attach(self,rover):
+        self.rovers[rover.name] = rover
+        self.reroute()
+
+    def detach(self,rover):
+        if self.rovers.pop(rover.name,None) is not None:
+            rover.error('motor',"Telemetry stopped")
+        self.reroute()
+
+    # reroute() - after a change of rover addresses
+    def reroute(self):
+        routes = {}
+        for rover in self.rovers.values():
+            routes.setdefault(rover.settings.ROVER_IP,rover)
+            routes[(rover.settings.ROVER_IP,rover.settings.ROVER_TELEMETRY_PORT)] = rover
+        # replaced as a whole, attach() and detach() run on any thread
+        self.routes = routes
+
+    # datagram_received(telemetry_data,addr,now) - called by the receiver
+    # for every datagram of a batch, now is its receive time
+    def datagram_received(self,telemetry_data,addr,now):
+        recorder = self.recorder
+        if recorder: recorder.record(now,telemetry_data)
+        if DEBUG_TELEMETRY_DATA: rover_log.debug('telemetry',"{!r}",telemetry_data)
+        rover = self.routes.get(addr[:2]) or self.routes.get(addr[0])
+        if rover is None:
+            if len(self.rovers) != 1:
+                self.unknown += 1
+                return
+            rover = next(iter(self.rovers.values()))
+        rover.telemetry_received(telemetry_data,now)
+
+    def connection_lost(self,e):
+        if self.closed is not None and not self.closed.done(): self.closed.set_result(e)
+
+    # sample(metrics) - receive buffer, batches, kernel drops and processing
+    # cost, called by the supervisor
+    def sample(self,metrics):
+        receiver = self.receiver
+        if receiver is None: return
+        metrics.gauge('rover_telemetry_rcvbuf_bytes','telemetry socket buffer granted by the kernel').set(receiver.rcvbuf or 0)
+        metrics.counter('rover_telemetry_wakeups_total','telemetry socket wakeups with datagrams').set(receiver.wakeups)
+        metrics.counter('rover_telemetry_datagrams_total','telemetry datagrams read from the socket').set(receiver.datagrams)
+        metrics.counter('rover_telemetry_truncated_total','telemetry datagrams too long, dropped').set(receiver.truncated)
+        metrics.counter('rover_telemetry_handler_errors_total','telemetry datagrams whose processing failed').set(receiver.handler_errors)
+        metrics.counter('rover_telemetry_process_seconds_total','time spent processing telemetry datagrams').set(receiver.process_time)
+        metrics.gauge('rover_telemetry_batch_max','largest telemetry batch over the last second').set(receiver.reset_batch())
+        datagrams,process_time = self._sampled
+        if receiver.datagrams > datagrams:
+            metrics.gauge('rover_telemetry_packet_seconds','processing time per telemetry datagram over the last second').set(
+                (receiver.process_time - process_time) / (receiver.datagrams - datagrams))
+        self._sampled = (receiver.datagrams,receiver.process_time)
+        if receiver.overflow:
+            metrics.counter('rover_telemetry_kernel_drops_total','telemetry datagrams dropped by the kernel, socket buffer full').set(receiver.kernel_drops)
+        recorder = self.recorder
+        if recorder is None: return
+        metrics.counter('rover_telemetry_recorded_total','telemetry datagrams recorded').set(recorder.records)
+        metrics.counter('rover_telemetry_record_dropped_total','telemetry datagrams not recorded, no log file ready').set(recorder.dropped)
+        if recorder.error is not None:
+            # the disk failed: the recording ends, the error stays shown
+            self.recorder = None
+            recorder.close()
+            for rover in self.rovers.values(): rover.error('motor',"Telemetry: record error")
+
+    # run() - telemetry channel, listens until cancelled; the port is bound
+    # again, with backoff, when it cannot be bound or the socket fails
+    async def run(self):
+        settings = self.engine.settings
+        rover_log.info('telemetry',"telemetry_channel()")
+        loop = asyncio.get_running_loop()
+        reconnect = self.reconnect = rover_net.Reconnect(settings.RECONNECT_MAX_DELAY)
+
+        # record raw datagrams to disk
+        if settings.TELEMETRY_RECORD:
+            self.recorder = rover_recorder.TelemetryRecorder(settings.TELEMETRY_RECORD_DIR,settings.TELEMETRY_RECORD_SIZE)
+
+        self._sampled = (0,0.0)
+        receiver = self.receiver = rover_net.DatagramReceiver(self.datagram_received,self.connection_lost,
+            settings.TELEMETRY_RCVBUF,settings.TELEMETRY_BATCH,channel='telemetry')
+        try:
+            while True:
+                reconnect.connecting()
+                self.closed = loop.create_future()
+                try:
+                    receiver.open(('0.0.0.0',settings.CLIENT_TELEMETRY_PORT))
+                except OSError as e:
+                    reconnect.failed()
+                    rover_log.error('telemetry',"cannot bind port {}: {}",settings.CLIENT_TELEMETRY_PORT,str(e))
+                    for rover in self.rovers.values(): rover.error('motor',"Telemetry: cannot bind port {}".format(settings.CLIENT_TELEMETRY_PORT))
+                    await reconnect.wait()
+                    continue
+                reconnect.connected()
+                rover_log.info('telemetry',"socket buffer {} bytes{}",receiver.rcvbuf,
+                    '' if receiver.overflow else ', no kernel drop count')
+                if receiver.rcvbuf < settings.TELEMETRY_RCVBUF:
+                    rover_log.warning('telemetry',"TELEMETRY_RCVBUF capped by the kernel, raise net.core.rmem_max")
+                # datagrams are handled by the receiver until the channel is
+                # stopped or the socket fails
+                e = await self.closed
+                rover_log.warning('telemetry',"socket closed: {}",str(e))
+                receiver.close()
+                reconnect.lost()
+                await reconnect.wait()
+        finally:
+            receiver.close()
+            self.reconnect = None
+            self.receiver = None
+            if self.recorder: self.recorder.close()
+            self.recorder = None
+            rover_log.info('telemetry',"channel closed")
+            for rover in self.rovers.values(): rover.error('motor',"Telemetry stopped")
+
+# ##############################################################################
+#
+# Main - headless front-end
+#
+# ##############################################################################
+
+# ------------------------------------------------------------------------------
+# func_print_status(rover,channel,msg,ok)
+# ------------------------------------------------------------------------------
+_last_status = {}
+
+def func_print_status(rover,channel,msg,ok):
+    msg = str(msg).replace("\n"," ")
+    # print changes only, like the GUI log boxes
+    if _last_status.get((rover,channel)) == (msg,ok): return
+    _last_status[(rover,channel)] = (msg,ok)
+    prefix = "{}/{}".format(rover,channel) if rover else channel
+    print("[{}]> {}{}".format(prefix.upper(),'' if ok else 'error: ',msg),flush=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rover client without user interface")
+    parser.add_argument('--config',default=rover_config.ROVER_CONFIG_FILE,help="configuration file")
+    parser.add_argument('--rover',default=None,help="rover name, default every rover in ROVERS")
+    parser.add_argument('--control',action='store_true',help="run the control channel (joystick)")
+    parser.add_argument('--video',action='store_true',help="run the video channel")
+    parser.add_argument('--telemetry',action='store_true',help="run the telemetry channel")
+    parser.add_argument('--record',action='store_true',help="record the video stream")
+    parser.add_argument('--player',default=None,help="stream player command line instead of VIDEO_PLAYER, '' discards the video")
+    parser.add_argument('--system',default=None,help="send a system command to the rover and exit")
+    parser.add_argument('--rtt-export',action='store_true',help="write the control round-trip histograms on exit")
+    parser.add_argument('--duration',type=float,default=0,help="seconds to run, 0 = until interrupted")
+    parser.add_argument('--quiet',action='store_true',help="no event log on the console")
+    args = parser.parse_args()
+
+    if args.quiet: rover_log.LOG.console = False
+
+    try:
+        fleet = rover_config.load_fleet(args.config)
+        if args.rover: fleet = [s for s in fleet if s.NAME == args.rover]
+        if not fleet: raise ValueError("unknown rover: {}".format(args.rover))
+    except Exception as e:
+        print("[MSG]> error: configuration file {}".format(args.config))
+        print(str(e))
+        sys.exit(-1)
+
+    engine = RoverEngine(fleet,func_print_status,args.config).start()
+
+    if args.system is not None:
+        replies = [engine.system_command(args.system,name).result() for name in engine.rovers]
+        for reply in replies:
+            if reply and reply.output: print(reply.output)
+        # a raw command is sent, not confirmed: that is all it can be
+        ok = all([reply is not None and reply.status in (0,rover_system.STATUS_UNCONFIRMED) for reply in replies])
+        engine.stop()
+        sys.exit(0 if ok else 1)
+
+    if args.control: engine.start_control()
+    if args.video:
+        engine.start_video(player_cmd=None if args.player is None else shlex.split(args.player))
+    if args.telemetry: engine.start_telemetry()
+    if args.record: engine.start_recording()
+
+    # run until interrupted or for the given duration; SIGUSR1 dumps the
+    # event log
+    signal.signal(signal.SIGTERM,lambda signum,frame: sys.exit(0))
+    signal.signal(signal.SIGUSR1,lambda signum,frame: engine.dump_log())
+    try:
+        if args.duration > 0:
+            time.sleep(args.duration)
+        else:
+            while True: time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if args.rtt_export:
+            for path in engine.export_rtt().result(): print(path)
+        engine.stop()
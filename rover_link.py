@@ -0,0 +1,201 @@
+# ##############################################################################
+#
+# Rover link prober
+#
+# Probes the rover continuously from the event loop and keeps RTT, jitter
+# and loss statistics over the last probes. Callers read the cached link
+# state instead of running ping.
+#
+# Probes are ICMP echo requests sent on an unprivileged ICMP datagram socket
+# (Linux, needs the user's group in net.ipv4.ping_group_range). Where that
+# is not allowed the prober falls back to UDP datagrams sent to an echo
+# service on the rover (udp_port), which must send them back unchanged.
+#
+# A socket that cannot be opened (no route to the rover, address not
+# configured yet) counts as a lost probe; the prober tries again with the
+# backoff of the other channels.
+#
+# ##############################################################################
+
+import asyncio                  # Event loop
+import collections              # Probe history
+import socket                   # Network communication
+import struct                   # Probe packets
+import time                     # Time acquisition and formatting
+import rover_net                # Reconnect backoff
+import rover_log                # Event log
+
+# Prober defaults
+PROBE_INTERVAL = 0.5
+PROBE_TIMEOUT = 2.0
+PROBE_WINDOW = 20
+PROBE_UDP_PORT = 7
+
+# Probe packets
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
+ICMP_STRUCT = struct.Struct('!BBHHH')
+PROBE_STRUCT = struct.Struct('!4sId')
+PROBE_MAGIC = b'RVLP'
+
+# Cached link state; rtt values in seconds, None when unknown
+LinkState = collections.namedtuple('LinkState',('up','method','rtt','rtt_min','rtt_max','jitter','loss','probes'))
+LINK_UNKNOWN = LinkState(None,None,None,None,None,None,None,0)
+
+# ------------------------------------------------------------------------------
+# icmp_checksum(data)
+# ------------------------------------------------------------------------------
+def icmp_checksum(data):
+    if len(data) % 2: data += b'\x00'
+    total = sum(struct.unpack('!{}H'.format(len(data) // 2),data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
+
+# ------------------------------------------------------------------------------
+# LinkProber(robot_ip,interval,timeout,window,udp_port)
+# ------------------------------------------------------------------------------
+class LinkProber:
+
+    def __init__(self,robot_ip,interval=PROBE_INTERVAL,timeout=PROBE_TIMEOUT,window=PROBE_WINDOW,udp_port=PROBE_UDP_PORT):
+        self.robot_ip = robot_ip
+        self.interval = interval
+        self.timeout = timeout
+        self.udp_port = udp_port
+        self.method = None
+        self.sequence = 0
+        self.pending = {}
+        self.results = collections.deque(maxlen=window)
+        self.jitter = 0.0
+        self.last_rtt = None
+        self.first_result = None
+        # replaced as a whole, safe to read from any thread
+        self.link_state = LINK_UNKNOWN
+        self.reconnect = rover_net.Reconnect()
+        self._socket = None
+
+    # state() - latest link state, never blocks
+    def state(self):
+        return self.link_state
+
+    # wait_state() - link state, waiting for the first probe result if needed
+    async def wait_state(self):
+        if self.first_result is None:
+            self.first_result = asyncio.get_running_loop().create_future()
+        if self.link_state.up is None:
+            try:
+                await asyncio.wait_for(asyncio.shield(self.first_result),self.timeout + self.interval)
+            except asyncio.TimeoutError:
+                pass
+        return self.link_state
+
+    # _open() - connected probe socket, ICMP when the user may open one, UDP
+    # otherwise; raises OSError
+    def _open(self):
+        try:
+            sock = socket.socket(socket.AF_INET,socket.SOCK_DGRAM,socket.IPPROTO_ICMP)
+            method,port = 'icmp',0
+        except OSError:
+            sock = socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
+            method,port = 'udp',self.udp_port
+        try:
+            sock.connect((self.robot_ip,port))
+            sock.setblocking(False)
+        except OSError:
+            sock.close()
+            raise
+        self.method = method
+        return sock
+
+    # run() - probe until cancelled
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        if self.first_result is None or self.first_result.done():
+            self.first_result = loop.create_future()
+        try:
+            while True:
+                self.reconnect.connecting()
+                try:
+                    self._socket = self._open()
+                    break
+                except OSError as e:
+                    self.reconnect.failed()
+                    # once, not at every retry
+                    if self.reconnect.failures == 1:
+                        rover_log.error('system',"link probe to {}: {}",self.robot_ip,str(e))
+                    self._result(None)
+                    await self.reconnect.wait()
+            self.reconnect.connected()
+            loop.add_reader(self._socket.fileno(),self._on_readable)
+            while True:
+                self._expire(time.monotonic())
+                self._send()
+                await asyncio.sleep(self.interval)
+        finally:
+            if self._socket is not None:
+                loop.remove_reader(self._socket.fileno())
+                self._socket.close()
+                self._socket = None
+            self.pending.clear()
+            self.link_state = LINK_UNKNOWN
+
+    def _send(self):
+        self.sequence = (self.sequence + 1) & 0xFFFF
+        now = time.monotonic()
+        payload = PROBE_STRUCT.pack(PROBE_MAGIC,self.sequence,now)
+        if self.method == 'icmp':
+            # the kernel sets the identifier of ICMP datagram sockets
+            header = ICMP_STRUCT.pack(ICMP_ECHO_REQUEST,0,0,0,self.sequence)
+            checksum = icmp_checksum(header + payload)
+            packet = ICMP_STRUCT.pack(ICMP_ECHO_REQUEST,0,checksum,0,self.sequence) + payload
+        else:
+            packet = payload
+        try:
+            self._socket.send(packet)
+        except OSError:
+            # unreachable network or refused port: the probe simply times out
+            pass
+        self.pending[self.sequence] = now
+
+    def _on_readable(self):
+        while True:
+            try:
+                packet = self._socket.recv(512)
+            except (BlockingIOError,InterruptedError):
+                return
+            except OSError:
+                # ICMP error queued on the socket, e.g. port unreachable
+                continue
+            now = time.monotonic()
+            if self.method == 'icmp':
+                if len(packet) < ICMP_STRUCT.size or packet[0] != ICMP_ECHO_REPLY: continue
+                packet = packet[ICMP_STRUCT.size:]
+            if len(packet) < PROBE_STRUCT.size: continue
+            magic,sequence,sent = PROBE_STRUCT.unpack_from(packet)
+            if magic != PROBE_MAGIC or self.pending.pop(sequence,None) is None: continue
+            self._result(now - sent)
+
+    def _expire(self,now):
+        for sequence,sent in list(self.pending.items()):
+            if now - sent > self.timeout:
+                del self.pending[sequence]
+                self._result(None)
+
+    # _result(rtt) - record one probe outcome, None for a lost probe
+    def _result(self,rtt):
+        if rtt is not None:
+            # RFC 3550 interarrival jitter estimate
+            if self.last_rtt is not None:
+                self.jitter += (abs(rtt - self.last_rtt) - self.jitter) / 16
+            self.last_rtt = rtt
+        self.results.append(rtt)
+
+        replies = [r for r in self.results if r is not None]
+        loss = 1.0 - len(replies) / len(self.results)
+        if replies:
+            # up while any of the last three probes was answered
+            up = any(r is not None for r in list(self.results)[-3:])
+            self.link_state = LinkState(up,self.method,self.last_rtt,min(replies),max(replies),self.jitter,loss,len(self.results))
+        else:
+            self.link_state = LinkState(False,self.method,None,None,None,None,loss,len(self.results))
+        if not self.first_result.done(): self.first_result.set_result(None)
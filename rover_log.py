@@ -0,0 +1,275 @@
+# ##############################################################################
+#
+# Rover event log
+#
+# Diagnostics stay on without costing the hot paths: a channel records an
+# event - time, channel, level, format string and arguments - as one tuple
+# appended to an in-memory ring buffer. Nothing is formatted or written
+# there, and deque appends are atomic, so recording takes no lock:
+#
+#   rover_log.debug('control',"axes {} {}",left,right)
+#
+# A writer thread wakes every LOG_INTERVAL, formats the new events whose
+# level reaches the level of their channel and writes them to the console
+# and to LOG_FILE. Channel levels come from the configuration (LOG_LEVEL,
+# LOG_LEVELS) and can change while the client runs.
+#
+# The ring keeps the last LOG_RING_SIZE events of every level, debug ones
+# included: dump(seconds) writes the last seconds of them to a file when
+# something went wrong, with the details nobody had asked to see.
+#
+# Arguments are formatted later, on the writer thread: pass values -
+# numbers, strings, tuples - not objects that change afterwards.
+#
+# ##############################################################################
+
+import os                       # Dump directory
+import sys                      # Console output
+import time                     # Event times
+import atexit                   # Last events written at exit
+import threading                # Writer thread
+import collections              # Ring buffer
+
+# Levels
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+OFF = 100
+LEVELS = collections.OrderedDict((('debug',DEBUG),('info',INFO),('warning',WARNING),('error',ERROR),('off',OFF)))
+LEVEL_TAGS = {DEBUG: 'D',INFO: 'I',WARNING: 'W',ERROR: 'E'}
+
+# Log defaults: level of the channels not in the per-channel levels,
+# events kept in memory, seconds between two writes, seconds of events in
+# a dump and its directory
+LOG_LEVEL = 'info'
+LOG_RING_SIZE = 65536
+LOG_INTERVAL = 0.2
+LOG_DUMP_SECONDS = 60
+LOG_DUMP_DIR = 'logs'
+
+# ------------------------------------------------------------------------------
+# parse_levels(spec) - 'channel=level,...' -> {channel: level}, raises
+# ValueError
+# ------------------------------------------------------------------------------
+def parse_levels(spec):
+    levels = {}
+    for item in spec.split(','):
+        item = item.strip()
+        if not item: continue
+        channel,sep,name = item.partition('=')
+        channel,name = channel.strip(),name.strip().lower()
+        if not sep or not channel or name not in LEVELS:
+            raise ValueError("not channel=level: {}".format(item))
+        levels[channel] = LEVELS[name]
+    return levels
+
+# ------------------------------------------------------------------------------
+# format_event(event) - one log line
+# ------------------------------------------------------------------------------
+def format_event(event):
+    t,channel,level,fmt,args = event
+    try:
+        msg = fmt.format(*args) if args else fmt
+    except (IndexError,KeyError,ValueError) as e:
+        msg = "{} {!r}: {}".format(fmt,args,str(e))
+    return "{}.{:03d} {} [{}]> {}".format(time.strftime('%H:%M:%S',time.localtime(t)),int(t % 1 * 1000),
+        LEVEL_TAGS.get(level,'?'),channel.upper(),msg)
+
+# ------------------------------------------------------------------------------
+# EventLog(size) - ring buffer of events and its writer
+#
+# log() and the level functions may be called from any thread; the writer
+# is the only reader of the pending events.
+# ------------------------------------------------------------------------------
+class EventLog:
+
+    def __init__(self,size=LOG_RING_SIZE):
+        # every recorded event, and the ones the writer has not seen yet
+        self.ring = collections.deque(maxlen=size)
+        self.pending = collections.deque(maxlen=size)
+        # events below record_level are not even recorded
+        self.record_level = DEBUG
+        self.level = LEVELS[LOG_LEVEL]
+        self.levels = {}
+        self.console = True
+        self.file_name = ''
+        self.interval = LOG_INTERVAL
+        # counters
+        self.events = 0
+        self.lines = 0
+        self.dumps = 0
+        self._file = None
+        self._requests = collections.deque()
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopping = False
+
+    # --------------------------------------------------------------------------
+    # Recording, any thread
+    # --------------------------------------------------------------------------
+
+    def log(self,channel,level,fmt,*args):
+        if level < self.record_level: return
+        event = (time.time(),channel,level,fmt,args)
+        self.ring.append(event)
+        self.pending.append(event)
+        self.events += 1
+
+    def debug(self,channel,fmt,*args):
+        self.log(channel,DEBUG,fmt,*args)
+
+    def info(self,channel,fmt,*args):
+        self.log(channel,INFO,fmt,*args)
+
+    def warning(self,channel,fmt,*args):
+        self.log(channel,WARNING,fmt,*args)
+
+    def error(self,channel,fmt,*args):
+        self.log(channel,ERROR,fmt,*args)
+
+    # enabled(channel,level) - the event would be written, for callers that
+    # build costly arguments
+    def enabled(self,channel,level):
+        return level >= self.levels.get(channel,self.level)
+
+    # configure(level,levels,file_name,size) - new levels, log file and ring
+    # size; a level name for level, {channel: level} for levels
+    def configure(self,level=LOG_LEVEL,levels=None,file_name='',size=LOG_RING_SIZE):
+        # replaced as a whole, the writer reads them without lock
+        self.level = LEVELS[level]
+        self.levels = dict(levels or {})
+        self.file_name = file_name
+        if size != self.ring.maxlen:
+            self.ring = collections.deque(self.ring,maxlen=size)
+            self.pending = collections.deque(self.pending,maxlen=size)
+
+    # --------------------------------------------------------------------------
+    # Writer
+    # --------------------------------------------------------------------------
+
+    def start(self):
+        if self._thread is not None: return self
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run,name='log-writer',daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stopping:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.flush()
+
+    # stop() - write the last events and stop the writer
+    def stop(self):
+        thread,self._thread = self._thread,None
+        if thread is not None:
+            self._stopping = True
+            self._wake.set()
+            thread.join()
+        self.flush()
+        with self._lock:
+            if self._file is not None:
+                try:
+                    self._file.close()
+                except OSError:
+                    pass
+            self._file = None
+
+    # flush() - write the pending events at their channel level, then run
+    # the dumps asked for
+    def flush(self):
+        with self._lock:
+            lines = []
+            pending = self.pending
+            while True:
+                try:
+                    event = pending.popleft()
+                except IndexError:
+                    break
+                if event[2] >= self.levels.get(event[1],self.level):
+                    lines.append(format_event(event))
+            if lines:
+                self.lines += len(lines)
+                self._write('\n'.join(lines) + '\n')
+            while self._requests:
+                seconds,directory = self._requests.popleft()
+                try:
+                    self.dump(seconds,directory)
+                except OSError as e:
+                    # a bad directory or a full disk does not stop the writer
+                    self.error('log',"cannot dump to {}: {}",directory,str(e))
+
+    def _write(self,text):
+        if self.console:
+            try:
+                sys.stdout.write(text)
+                sys.stdout.flush()
+            except (OSError,ValueError):
+                # closed or broken console, the file and the ring remain
+                self.console = False
+        if self._file is not None and self._file.name != self.file_name:
+            self._file.close()
+            self._file = None
+        if self._file is None and self.file_name:
+            try:
+                self._file = open(self.file_name,'a')
+            except OSError as e:
+                self.error('log',"cannot open {}: {}",self.file_name,str(e))
+                self.file_name = ''
+        if self._file is not None:
+            try:
+                self._file.write(text)
+                self._file.flush()
+            except OSError as e:
+                # full disk or lost file system: the console and the ring
+                # remain, a new LOG_FILE is tried when configured
+                self.error('log',"cannot write {}: {}",self.file_name,str(e))
+                try:
+                    self._file.close()
+                except OSError:
+                    pass
+                self._file = None
+                self.file_name = ''
+
+    # --------------------------------------------------------------------------
+    # Dumps
+    # --------------------------------------------------------------------------
+
+    # request_dump(seconds,directory) - dump on the writer thread, any thread
+    # (and signal handlers) may ask; without a writer the request waits for
+    # the next flush(), a signal handler must not take the writer lock
+    def request_dump(self,seconds=LOG_DUMP_SECONDS,directory=LOG_DUMP_DIR):
+        self._requests.append((seconds,directory))
+        if self._thread is not None: self._wake.set()
+
+    # dump(seconds,directory) - the events of the last seconds, every level,
+    # written to a new file in directory; returns its name
+    def dump(self,seconds=LOG_DUMP_SECONDS,directory=LOG_DUMP_DIR):
+        now = time.time()
+        start = now - seconds
+        # copied in one call, appends from other threads wait for it
+        events = [event for event in self.ring.copy() if event[0] >= start]
+        os.makedirs(directory,exist_ok=True)
+        path = os.path.join(directory,"rover-{}-{:03d}.log".format(
+            time.strftime('%Y%m%d-%H%M%S',time.localtime(now)),int(now % 1 * 1000)))
+        with open(path,'w') as f:
+            f.write("# last {:g} s, {} events\n".format(seconds,len(events)))
+            for event in events: f.write(format_event(event) + '\n')
+        self.dumps += 1
+        self.info('log',"{} events written to {}",len(events),path)
+        return path
+
+# Event log of the process, and its recording functions
+LOG = EventLog()
+log = LOG.log
+debug = LOG.debug
+info = LOG.info
+warning = LOG.warning
+error = LOG.error
+
+# events recorded after the writer stopped, or without a writer, are
+# written at exit
+atexit.register(LOG.stop)
@@ -0,0 +1,346 @@
+# ##############################################################################
+#
+# Rover client metrics
+#
+# Counters, gauges and histograms updated by the channels, sampled once a second by the
+# supervisor and exposed in the Prometheus text format on a local HTTP
+# endpoint:
+#
+#   $ curl http://127.0.0.1:9105/metrics
+#
+# All updates happen on the network event loop, no locking is needed.
+#
+# ##############################################################################
+
+import asyncio                  # HTTP endpoint
+import bisect                   # Histogram buckets
+import collections              # Histogram time slices
+import math                     # Percentile ranks
+import threading                # Thread names for CPU metrics
+import time                     # Time acquisition and formatting
+
+# psutil is imported by the first process sample, on the network thread
+psutil = None
+psutil_loaded = False
+
+# Default HTTP endpoint
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = 9105
+
+# ------------------------------------------------------------------------------
+# Metric(name,kind,help)
+# ------------------------------------------------------------------------------
+class Metric:
+
+    def __init__(self,name,kind,help):
+        self.name = name
+        self.kind = kind
+        self.help = help
+        # label tuple -> value
+        self.values = {}
+
+    def inc(self,amount=1,**labels):
+        key = tuple(sorted(labels.items()))
+        self.values[key] = self.values.get(key,0) + amount
+
+    def set(self,value,**labels):
+        self.values[tuple(sorted(labels.items()))] = value
+
+    def get(self,**labels):
+        return self.values.get(tuple(sorted(labels.items())),0)
+
+# ------------------------------------------------------------------------------
+# Histogram(name,help,buckets) - cumulative bucket counts per label set, the
+# upper bounds of the buckets in ascending order; values holds the number of
+# observations
+# ------------------------------------------------------------------------------
+class Histogram(Metric):
+
+    def __init__(self,name,help,buckets):
+        super().__init__(name,'histogram',help)
+        self.buckets = tuple(sorted(buckets))
+        # label tuple -> observations per bucket, the last one is +Inf
+        self.counts = {}
+        self.sums = {}
+
+    def observe(self,value,**labels):
+        key = tuple(sorted(labels.items()))
+        counts = self.counts.get(key)
+        if counts is None:
+            counts = self.counts[key] = [0] * (len(self.buckets) + 1)
+        counts[bisect.bisect_left(self.buckets,value)] += 1
+        self.sums[key] = self.sums.get(key,0) + value
+        self.values[key] = self.values.get(key,0) + 1
+
+    # quantile(q,**labels) - upper bound of the bucket holding the q quantile,
+    # inf beyond the last bucket, None without observations
+    def quantile(self,q,**labels):
+        counts = self.counts.get(tuple(sorted(labels.items())))
+        if not counts: return None
+        rank = max(1,math.ceil(q * sum(counts)))
+        total = 0
+        for bound,count in zip(self.buckets + (math.inf,),counts):
+            total += count
+            if total >= rank: return bound
+
+    # lines() - exposition lines of every label set
+    def lines(self):
+        lines = []
+        for key,counts in list(self.counts.items()):
+            total = 0
+            for bound,count in zip(self.buckets + (math.inf,),counts):
+                total += count
+                labels = key + (('le','+Inf' if bound == math.inf else repr(bound)),)
+                lines.append('{}_bucket{{{}}} {}'.format(self.name,','.join('{}="{}"'.format(k,v) for k,v in labels),total))
+            labels = '{' + ','.join('{}="{}"'.format(k,v) for k,v in key) + '}' if key else ''
+            lines.append('{}_sum{} {}'.format(self.name,labels,self.sums[key]))
+            lines.append('{}_count{} {}'.format(self.name,labels,total))
+        return lines
+
+# ------------------------------------------------------------------------------
+# MetricsRegistry()
+# ------------------------------------------------------------------------------
+class MetricsRegistry:
+
+    def __init__(self):
+        self.metrics = {}
+        self._rate_last = {}
+        self._rate_time = None
+
+    def _metric(self,name,kind,help):
+        metric = self.metrics.get(name)
+        if metric is None:
+            metric = self.metrics[name] = Metric(name,kind,help)
+        return metric
+
+    def counter(self,name,help=''):
+        return self._metric(name,'counter',help)
+
+    def gauge(self,name,help=''):
+        return self._metric(name,'gauge',help)
+
+    def summary(self,name,help=''):
+        return self._metric(name,'summary',help)
+
+    def histogram(self,name,help='',buckets=()):
+        metric = self.metrics.get(name)
+        if metric is None:
+            metric = self.metrics[name] = Histogram(name,help,buckets)
+        return metric
+
+    # value(name) - sum over all labels, 0 for an unknown metric
+    def value(self,name):
+        metric = self.metrics.get(name)
+        return sum(metric.values.values()) if metric else 0
+
+    # update_rates(names) - '<counter>_per_second' gauges since the last call
+    def update_rates(self,names):
+        now = time.monotonic()
+        elapsed = (now - self._rate_time) if self._rate_time else None
+        self._rate_time = now
+        for name in names:
+            counter = self.metrics.get(name)
+            if counter is None: continue
+            gauge = self.gauge(name.replace('_total','') + '_per_second','rate of ' + name)
+            for key,value in list(counter.values.items()):
+                last = self._rate_last.get((name,key))
+                self._rate_last[(name,key)] = value
+                if elapsed and last is not None:
+                    gauge.values[key] = max(0,value - last) / elapsed
+
+    # render() - Prometheus text exposition format
+    def render(self):
+        lines = []
+        for metric in self.metrics.values():
+            lines.append('# HELP {} {}'.format(metric.name,metric.help))
+            lines.append('# TYPE {} {}'.format(metric.name,metric.kind))
+            if metric.kind == 'histogram':
+                lines.extend(metric.lines())
+                continue
+            for key,value in list(metric.values.items()):
+                if key:
+                    labels = ','.join('{}="{}"'.format(k,v) for k,v in key)
+                    lines.append('{}{{{}}} {}'.format(metric.name,labels,value))
+                else:
+                    lines.append('{} {}'.format(metric.name,value))
+        return '\n'.join(lines) + '\n'
+
+# ------------------------------------------------------------------------------
+# summarize(values) - count, mean, stdev, min, p50, p90, p99 and max of a
+# sample, nearest-rank percentiles
+# ------------------------------------------------------------------------------
+def summarize(values):
+    values = sorted(values)
+    n = len(values)
+    if not n: return {'count':0}
+    mean = sum(values) / n
+    stdev = math.sqrt(sum((v - mean) ** 2 for v in values) / n)
+    def rank(p): return values[max(0,math.ceil(p * n) - 1)]
+    return {'count':n,'mean':mean,'stdev':stdev,'min':values[0],
+        'p50':rank(0.50),'p90':rank(0.90),'p99':rank(0.99),'max':values[-1]}
+
+# ------------------------------------------------------------------------------
+# HdrHistogram(window,slices,sub_bits,highest) - rolling latency histogram
+#
+# Values are counted in microseconds in log-linear buckets, HdrHistogram
+# style: exact below 2 * 2^sub_bits, above that every power of two is split
+# in 2^sub_bits buckets, so a percentile is off by less than 1 / 2^sub_bits
+# (0.8% with sub_bits 7) whatever its size. Counts are kept in `slices`
+# slices of window / slices seconds; the oldest slice is dropped as a new
+# one starts, so percentiles cover the last `window` seconds.
+# ------------------------------------------------------------------------------
+class HdrHistogram:
+
+    def __init__(self,window=60.0,slices=6,sub_bits=7,highest=60.0):
+        self.window = window
+        self.slice_time = window / slices
+        self.sub_bits = sub_bits
+        self.sub_count = 1 << sub_bits
+        self.highest = int(highest * 1e6)
+        # newest last: (start time, {bucket: count}, max value, count, sum)
+        self.slices = collections.deque(maxlen=slices)
+        self.total = 0
+
+    # index(us) / lowest(index) / highest_equivalent(index) - bucket mapping
+    def index(self,us):
+        if us < 2 * self.sub_count: return us
+        shift = us.bit_length() - self.sub_bits - 1
+        return 2 * self.sub_count + (shift - 1) * self.sub_count + (us >> shift) - self.sub_count
+
+    def lowest(self,index):
+        if index < 2 * self.sub_count: return index
+        shift,sub = divmod(index - 2 * self.sub_count,self.sub_count)
+        return (sub + self.sub_count) << (shift + 1)
+
+    def highest_equivalent(self,index):
+        return self.lowest(index + 1) - 1
+
+    # record(seconds,now)
+    def record(self,seconds,now=None):
+        if now is None: now = time.monotonic()
+        if not self.slices or now - self.slices[-1][0] >= self.slice_time:
+            self.slices.append([now,{},0,0,0.0])
+        current = self.slices[-1]
+        us = min(self.highest,max(0,int(seconds * 1e6)))
+        i = self.index(us)
+        current[1][i] = current[1].get(i,0) + 1
+        current[2] = max(current[2],us)
+        current[3] += 1
+        current[4] += seconds
+        self.total += 1
+
+    # merged(now) - ({bucket: count},max us,count,sum) over the window
+    def merged(self,now=None):
+        if now is None: now = time.monotonic()
+        counts = {}
+        highest = count = 0
+        total = 0.0
+        for start,buckets,slice_max,slice_count,slice_sum in self.slices:
+            if now - start >= self.window: continue
+            for i,n in buckets.items(): counts[i] = counts.get(i,0) + n
+            highest = max(highest,slice_max)
+            count += slice_count
+            total += slice_sum
+        return counts,highest,count,total
+
+    # percentiles(percentiles,now) - seconds for each percentile (0-100),
+    # None for an empty window
+    def percentiles(self,percentiles=(50,99),now=None):
+        counts,highest,count,total = self.merged(now)
+        if not count: return None
+        result = []
+        for p in percentiles:
+            rank = max(1,math.ceil(p / 100 * count))
+            seen = 0
+            for i in sorted(counts):
+                seen += counts[i]
+                if seen >= rank: break
+            result.append(min(self.highest_equivalent(i),highest) / 1e6)
+        return result
+
+    # summary(now) - count, mean, p50, p90, p99, p99.9 and max in seconds,
+    # over the window
+    def summary(self,now=None):
+        counts,highest,count,total = self.merged(now)
+        if not count: return {'count':0}
+        p50,p90,p99,p999 = self.percentiles((50,90,99,99.9),now)
+        return {'count':count,'mean':total / count,'p50':p50,'p90':p90,'p99':p99,'p99.9':p999,'max':highest / 1e6}
+
+    # export(f,now) - percentile distribution in the HdrHistogram text
+    # format (.hgrm), values in milliseconds
+    def export(self,f,now=None):
+        counts,highest,count,total = self.merged(now)
+        f.write("{:>12} {:>14} {:>10} {:>14}\n\n".format('Value','Percentile','TotalCount','1/(1-Percentile)'))
+        seen = 0
+        for i in sorted(counts):
+            seen += counts[i]
+            fraction = seen / count
+            inverse = 1 / (1 - fraction) if fraction < 1 else math.inf
+            f.write("{:12.3f} {:14.12f} {:10d} {:14.2f}\n".format(
+                min(self.highest_equivalent(i),highest) / 1e3,fraction,seen,inverse))
+        mean = total / count if count else 0.0
+        f.write("#[Mean    = {:12.3f}, Count      = {:12d}]\n".format(mean * 1e3,count))
+        f.write("#[Max     = {:12.3f}, Window (s) = {:12.1f}]\n".format(highest / 1e3,self.window))
+
+# Registry shared by every channel
+REGISTRY = MetricsRegistry()
+
+# ------------------------------------------------------------------------------
+# sample_process(registry) - process and per-thread CPU and memory via psutil
+# ------------------------------------------------------------------------------
+_process = None
+
+def load_psutil():
+    global psutil,psutil_loaded
+    if not psutil_loaded:
+        psutil_loaded = True
+        try:
+            import psutil
+        except ImportError:
+            psutil = None
+    return psutil
+
+def sample_process(registry=REGISTRY):
+    global _process
+    if load_psutil() is None: return
+    if _process is None:
+        _process = psutil.Process()
+        # first call only primes the CPU percentage
+        _process.cpu_percent(None)
+    registry.gauge('rover_process_cpu_percent','client process CPU usage').set(_process.cpu_percent(None))
+    registry.gauge('rover_process_rss_bytes','client process resident memory').set(_process.memory_info().rss)
+    names = {t.native_id: t.name for t in threading.enumerate()}
+    cpu = registry.counter('rover_thread_cpu_seconds_total','CPU time per thread')
+    for t in _process.threads():
+        cpu.set(t.user_time + t.system_time,thread=names.get(t.id,str(t.id)))
+
+# ------------------------------------------------------------------------------
+# serve_metrics(registry,host,port) - HTTP endpoint, runs until cancelled
+# ------------------------------------------------------------------------------
+async def serve_metrics(registry=REGISTRY,host=METRICS_HOST,port=METRICS_PORT):
+
+    async def handle(reader,writer):
+        try:
+            request = await asyncio.wait_for(reader.readline(),5)
+            # skip request headers
+            while (await asyncio.wait_for(reader.readline(),5)).strip(): pass
+            path = request.split()[1] if len(request.split()) > 1 else b'/'
+            if path in (b'/metrics',b'/'):
+                body = registry.render().encode()
+                status = b'200 OK'
+            else:
+                body = b'not found\n'
+                status = b'404 Not Found'
+            writer.write(b'HTTP/1.0 ' + status + b'\r\nContent-Type: text/plain; version=0.0.4\r\nContent-Length: '
+                + str(len(body)).encode() + b'\r\n\r\n' + body)
+            await writer.drain()
+        except (OSError,asyncio.TimeoutError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle,host,port)
+    try:
+        await asyncio.Future()
+    finally:
+        server.close()
@@ -0,0 +1,355 @@
+# ##############################################################################
+#
+# Rover networking core
+#
+# One asyncio event loop, running in a single 'network' thread, drives every
+# channel: control UDP, telemetry UDP, video TCP and system TCP commands.
+# Tk keeps the main thread; the GUI starts and stops channels through the
+# thread-safe methods below and gets its updates back through the GUI queue.
+#
+# A channel is a coroutine function. Stopping a channel cancels its task:
+# the CancelledError is raised at whatever it is awaiting, so a channel
+# blocked on the network stops at once and runs its finally: clean-up.
+#
+# A channel that loses its connection does not end: its Reconnect state
+# machine retries at once, then with exponential backoff and jitter, so a
+# Wi-Fi dropout costs a fraction of a second after the link is back and a
+# fleet does not reconnect in lockstep:
+#
+#   connecting --> connected --> backoff --> connecting ...
+#        |                          ^
+#        +------- attempt failed ---+
+#
+# High-rate UDP input goes through a DatagramReceiver instead of an asyncio
+# datagram endpoint, which reads one datagram per loop iteration: at each
+# wakeup the receiver drains every pending datagram into preallocated
+# buffers, then hands the batch to its handler. The socket buffer is
+# enlarged to ride out bursts, and on Linux the kernel reports the datagrams
+# it dropped when that buffer was full anyway (SO_RXQ_OVFL).
+#
+# ##############################################################################
+
+import asyncio                  # Event loop
+import threading                # Network thread
+import random                   # Backoff jitter
+import socket                   # Datagram receiver
+import struct                   # Kernel drop counter
+import sys                      # Platform
+import time                     # Reconnect timing, processing cost
+import rover_log                # Event log
+
+# Reconnect states
+STATE_CONNECTING = 'connecting'
+STATE_CONNECTED = 'connected'
+STATE_BACKOFF = 'backoff'
+
+# Reconnect delays, seconds: first retry after a loss, first backoff step
+# (doubled at each failed attempt), largest delay; jitter is the fraction of
+# the delay taken off at random
+RECONNECT_FIRST_DELAY = 0.1
+RECONNECT_BASE_DELAY = 0.5
+RECONNECT_MAX_DELAY = 10.0
+RECONNECT_JITTER = 0.5
+
+# Time given to one connection attempt
+CONNECT_TIMEOUT = 2.0
+
+# Histogram buckets of connection attempt durations and recovery times
+CONNECT_BUCKETS = (0.001,0.005,0.01,0.05,0.1,0.5,1.0,2.0)
+RECOVER_BUCKETS = (0.1,0.25,0.5,1.0,2.0,5.0,10.0,30.0,60.0)
+
+# Datagram receiver: socket buffer asked for, datagrams drained per wakeup
+# at most (the rest waits for the next loop iteration, so other channels
+# are not starved) and size of a receive buffer; longer datagrams are
+# truncated and dropped
+RECEIVE_BUFFER = 4194304
+RECEIVE_BATCH = 256
+DATAGRAM_SIZE = 4096
+
+# Kernel drop counter option, Linux only; Python does not always export it
+SO_RXQ_OVFL = getattr(socket,'SO_RXQ_OVFL',40 if sys.platform.startswith('linux') else None)
+
+# ------------------------------------------------------------------------------
+# NetworkCore()
+# ------------------------------------------------------------------------------
+class NetworkCore:
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.channels = {}
+        self.thread = threading.Thread(name='network',target=self._run)
+        self.thread.daemon = True
+
+    # start() - start the event loop thread
+    def start(self):
+        self.thread.start()
+        return self
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    # start_channel(name,coro_func,*args) - no-op when already running
+    def start_channel(self,name,coro_func,*args):
+        self.loop.call_soon_threadsafe(self._start_channel,name,coro_func,args)
+
+    def _start_channel(self,name,coro_func,args):
+        task = self.channels.get(name)
+        if task is not None and not task.done(): return
+        task = self.loop.create_task(coro_func(*args),name=name)
+        self.channels[name] = task
+
+    # stop_channel(name)
+    def stop_channel(self,name):
+        self.loop.call_soon_threadsafe(self._stop_channel,name)
+
+    def _stop_channel(self,name):
+        task = self.channels.pop(name,None)
+        if task is not None: task.cancel()
+
+    # restart_channel(name,coro_func,*args) - the new task starts once the
+    # old one has run its clean-up, so sockets and ports are free again
+    def restart_channel(self,name,coro_func,*args):
+        self.loop.call_soon_threadsafe(self._restart_channel,name,coro_func,args)
+
+    def _restart_channel(self,name,coro_func,args):
+        old_task = self.channels.pop(name,None)
+        async def restart():
+            if old_task is not None:
+                old_task.cancel()
+                await asyncio.gather(old_task,return_exceptions=True)
+            await coro_func(*args)
+        self.channels[name] = self.loop.create_task(restart(),name=name)
+
+    # is_running(name)
+    def is_running(self,name):
+        task = self.channels.get(name)
+        return task is not None and not task.done()
+
+    # submit(coro) - run a one-shot coroutine, returns a concurrent future
+    def submit(self,coro):
+        return asyncio.run_coroutine_threadsafe(coro,self.loop)
+
+    # stop(timeout) - cancel every channel and stop the loop
+    def stop(self,timeout=2):
+        if not self.thread.is_alive(): return
+        async def shutdown():
+            tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+            for t in tasks: t.cancel()
+            await asyncio.gather(*tasks,return_exceptions=True)
+        try:
+            self.submit(shutdown()).result(timeout)
+        except Exception:
+            pass
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout)
+
+# ------------------------------------------------------------------------------
+# Reconnect(max_delay) - reconnect state machine of one channel
+#
+# The channel calls connecting() before each attempt, then connected() or
+# failed(), lost() when an established connection ends, and awaits wait()
+# before the next attempt. Attempt durations and times to recover - from
+# the loss of a connection to the next one established - are queued for the
+# metrics: drain() returns and clears them.
+# ------------------------------------------------------------------------------
+class Reconnect:
+
+    def __init__(self,max_delay=RECONNECT_MAX_DELAY):
+        self.max_delay = max_delay
+        self.state = STATE_CONNECTING
+        # consecutive failed attempts
+        self.failures = 0
+        # counters
+        self.attempts = 0
+        self.connects = 0
+        self.reconnects = 0
+        # when the connection was lost, None while connected or before the
+        # first connection
+        self.lost_time = None
+        self.last_recovery = None
+        self._attempt_start = None
+        self._durations = []
+        self._recoveries = []
+
+    def connecting(self):
+        self.state = STATE_CONNECTING
+        self.attempts += 1
+        self._attempt_start = time.monotonic()
+
+    # connected() - seconds it took to recover from the loss, None for the
+    # first connection
+    def connected(self):
+        now = time.monotonic()
+        self._attempt_done(now)
+        self.state = STATE_CONNECTED
+        self.failures = 0
+        self.connects += 1
+        recovery = None
+        if self.lost_time is not None:
+            recovery = self.last_recovery = now - self.lost_time
+            self._recoveries.append(recovery)
+            self.reconnects += 1
+            self.lost_time = None
+        return recovery
+
+    def failed(self):
+        self._attempt_done(time.monotonic())
+        self.state = STATE_BACKOFF
+        self.failures += 1
+
+    def lost(self):
+        if self.state == STATE_CONNECTED: self.lost_time = time.monotonic()
+        self.state = STATE_BACKOFF
+
+    def _attempt_done(self,now):
+        if self._attempt_start is not None:
+            self._durations.append(now - self._attempt_start)
+            self._attempt_start = None
+
+    # delay() - seconds before the next attempt: short right after a loss,
+    # doubling with each failure, less a random part
+    def delay(self):
+        if not self.failures: return RECONNECT_FIRST_DELAY
+        delay = min(self.max_delay,RECONNECT_BASE_DELAY * 2 ** (self.failures - 1))
+        return delay * (1 - RECONNECT_JITTER * random.random())
+
+    async def wait(self):
+        await asyncio.sleep(self.delay())
+
+    # outage() - seconds since the connection was lost, None when connected
+    def outage(self):
+        return None if self.lost_time is None else time.monotonic() - self.lost_time
+
+    # drain() - (attempt durations, recovery times) since the last call
+    def drain(self):
+        durations,self._durations = self._durations,[]
+        recoveries,self._recoveries = self._recoveries,[]
+        return durations,recoveries
+
+# ------------------------------------------------------------------------------
+# DatagramReceiver(handler,lost,rcvbuf,batch,size,channel) - batched UDP receive
+#
+# open(addr) binds a non-blocking socket and reads it from the running
+# loop: handler(data,addr,now) is called for every datagram, lost(e) when
+# the socket fails; close() stops it. A handler exception is counted and
+# logged on channel, the rest of the batch is still handled. Counters add
+# up across open() calls.
+# ------------------------------------------------------------------------------
+class DatagramReceiver:
+
+    def __init__(self,handler,lost,rcvbuf=RECEIVE_BUFFER,batch=RECEIVE_BATCH,size=DATAGRAM_SIZE,channel='net'):
+        self.handler = handler
+        self.channel = channel
+        self.lost = lost
+        self.rcvbuf_request = rcvbuf
+        self.batch = batch
+        self.sock = None
+        self.loop = None
+        # buffer size granted by the kernel, capped by net.core.rmem_max
+        self.rcvbuf = None
+        # kernel drop counter is available
+        self.overflow = False
+        # counters
+        self.datagrams = 0
+        self.wakeups = 0
+        self.truncated = 0
+        self.errors = 0
+        self.handler_errors = 0
+        self.kernel_drops = 0
+        # largest batch since the last reset_batch()
+        self.max_batch = 0
+        # seconds spent in the handler
+        self.process_time = 0.0
+        self._drops_base = 0
+        self._buffers = [bytearray(size) for i in range(batch)]
+        self._views = [memoryview(b) for b in self._buffers]
+        self._received = [None] * batch
+        self._ancsize = socket.CMSG_SPACE(4) if hasattr(socket,'CMSG_SPACE') else 0
+
+    def open(self,addr):
+        sock = socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
+        try:
+            sock.setblocking(False)
+            sock.setsockopt(socket.SOL_SOCKET,socket.SO_RCVBUF,self.rcvbuf_request)
+            self.rcvbuf = sock.getsockopt(socket.SOL_SOCKET,socket.SO_RCVBUF)
+            self.overflow = False
+            if SO_RXQ_OVFL is not None:
+                try:
+                    sock.setsockopt(socket.SOL_SOCKET,SO_RXQ_OVFL,1)
+                    self.overflow = True
+                except OSError:
+                    pass
+            sock.bind(addr)
+        except OSError:
+            sock.close()
+            raise
+        # the counter of a new socket starts at 0
+        self._drops_base = self.kernel_drops
+        self.sock = sock
+        self.loop = asyncio.get_running_loop()
+        self.loop.add_reader(sock.fileno(),self._ready)
+        return self
+
+    def close(self):
+        if self.sock is None: return
+        self.loop.remove_reader(self.sock.fileno())
+        self.sock.close()
+        self.sock = None
+
+    # _ready() - socket readable: receive the whole batch first, so the
+    # kernel buffer empties as fast as possible, then process it
+    def _ready(self):
+        sock,views,received = self.sock,self._views,self._received
+        count = 0
+        error = None
+        while count < self.batch:
+            try:
+                if self._ancsize:
+                    n,ancdata,flags,addr = sock.recvmsg_into((views[count],),self._ancsize)
+                    for level,kind,data in ancdata:
+                        if level == socket.SOL_SOCKET and kind == SO_RXQ_OVFL and len(data) >= 4:
+                            self.kernel_drops = self._drops_base + struct.unpack('=I',data[:4])[0]
+                    if flags & socket.MSG_TRUNC:
+                        self.truncated += 1
+                        continue
+                else:
+                    n,addr = sock.recvfrom_into(views[count])
+            except (BlockingIOError,InterruptedError):
+                break
+            except ConnectionRefusedError:
+                # ICMP error of an earlier send, the socket still works
+                self.errors += 1
+                continue
+            except OSError as e:
+                error = e
+                break
+            received[count] = (n,addr,time.monotonic())
+            count += 1
+
+        if count:
+            self.wakeups += 1
+            self.datagrams += count
+            if count > self.max_batch: self.max_batch = count
+            start = time.perf_counter()
+            failed = None
+            for i in range(count):
+                n,addr,now = received[i]
+                try:
+                    self.handler(bytes(views[i][:n]),addr,now)
+                except Exception as e:
+                    self.handler_errors += 1
+                    failed = e
+            self.process_time += time.perf_counter() - start
+            # once per batch, a failing handler fails for every datagram
+            if failed is not None:
+                rover_log.error(self.channel,"datagram handler failed: {}: {}",type(failed).__name__,str(failed))
+        if error is not None:
+            self.errors += 1
+            self.close()
+            self.lost(error)
+
+    # reset_batch() - largest batch since the last call
+    def reset_batch(self):
+        max_batch,self.max_batch = self.max_batch,0
+        return max_batch
@@ -0,0 +1,262 @@
+# ##############################################################################
+#
+# Rover video players
+#
+# The video relay writes the H.264 Annex-B stream into a file descriptor
+# given by a player backend:
+#
+#   mplayer   external player reading stdin, the original player
+#   ffplay    external player, no input buffering, low-delay decoding
+#   mpv       external player, low-latency profile, untimed display
+#   decoder   in-process decoder (PyAV), frames handed to the front-end to
+#             show in its own window; optional, needs 'pip3 install av'
+#
+# The external players are told the stream format and frame rate up front,
+# so they do not buffer the start of the stream to probe it. Their command
+# lines are templates: {fps} is replaced by the frame rate and a {geometry}
+# argument by the window position options of the player, or removed when the
+# position is not set.
+#
+# A StandbyPlayer holds one started player that waits for its stream. A
+# video channel takes the standby when it matches the player it needs,
+# instead of spawning one, and a new standby is started for the next time.
+# Starting a player costs process start-up, library loading and decoder
+# initialization: paid ahead of time, not while the user waits for video.
+#
+# ##############################################################################
+
+import os                       # Pipes
+import shlex                    # Command line templates
+import subprocess               # External players
+import threading                # Decoder thread, standby lock
+import time                     # First frame time
+import rover_log                # Event log
+
+# Player backends
+PLAYER_MPLAYER = 'mplayer'
+PLAYER_FFPLAY = 'ffplay'
+PLAYER_MPV = 'mpv'
+PLAYER_DECODER = 'decoder'
+PLAYERS = (PLAYER_MPLAYER,PLAYER_FFPLAY,PLAYER_MPV,PLAYER_DECODER)
+
+# Frame rate given to the players, the raw stream carries no timing
+PLAYER_FPS = 48
+
+# Default command line templates of the external players
+PLAYER_COMMANDS = {
+    PLAYER_MPLAYER: 'mplayer -fps {fps} -xy 800 -msglevel all=-1 -nocache -demuxer h264es {geometry} -',
+    PLAYER_FFPLAY: 'ffplay -loglevel quiet -fflags nobuffer -flags low_delay -framedrop -probesize 32 '
+        '-analyzeduration 0 -sync ext -f h264 -framerate {fps} -x 800 {geometry} -i -',
+    PLAYER_MPV: 'mpv --really-quiet --profile=low-latency --untimed --no-cache --demuxer-lavf-format=h264 '
+        '--demuxer-lavf-probesize=32 --container-fps-override={fps} --autofit=800 {geometry} -',
+}
+
+# Window position options, geometry "x:y"
+GEOMETRY_ARGS = {
+    PLAYER_MPLAYER: '-geometry {x}:{y}',
+    PLAYER_FFPLAY: '-left {x} -top {y}',
+    PLAYER_MPV: '--geometry=+{x}+{y}',
+}
+
+# PyAV, imported by the first decoder
+av = None
+av_loaded = False
+
+# ------------------------------------------------------------------------------
+# player_command(player,template,geometry,fps) - argument list of an
+# external player; template '' is the default of the player
+# ------------------------------------------------------------------------------
+def player_command(player,template='',geometry=None,fps=PLAYER_FPS):
+    args = []
+    for arg in shlex.split(template or PLAYER_COMMANDS[player]):
+        if arg == '{geometry}':
+            if geometry and player in GEOMETRY_ARGS:
+                x,sep,y = geometry.partition(':')
+                args += GEOMETRY_ARGS[player].format(x=x,y=y).split()
+        else:
+            args.append(arg.replace('{fps}','{:g}'.format(fps)))
+    return args
+
+# ------------------------------------------------------------------------------
+# load_av() - import PyAV once, None when it is not installed
+# ------------------------------------------------------------------------------
+def load_av():
+    global av,av_loaded
+    if not av_loaded:
+        av_loaded = True
+        try:
+            import av
+        except ImportError:
+            av = None
+    return av
+
+# ------------------------------------------------------------------------------
+# CommandPlayer(args) - external player reading the stream on stdin
+#
+# start() spawns it, fd is the stream input; close() kills it.
+# detach() and attach() are for the standby, the window is the player's own.
+# ------------------------------------------------------------------------------
+class CommandPlayer:
+
+    def __init__(self,args):
+        self.args = list(args)
+        self.key = tuple(self.args)
+        self.process = None
+        self.fd = None
+        self.pid = None
+        self.start_time = None
+
+    def start(self):
+        start = time.perf_counter()
+        self.process = subprocess.Popen(self.args,stdin=subprocess.PIPE)
+        self.fd = self.process.stdin.fileno()
+        self.pid = self.process.pid
+        self.start_time = time.perf_counter() - start
+        rover_log.info('player',"{} pid {}",self.args[0],self.pid)
+        return self
+
+    # alive() - started and not exited
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def detach(self):
+        pass
+
+    def attach(self,player):
+        pass
+
+    def close(self):
+        if self.process is None: return
+        self.process.kill()
+        self.process.stdin.close()
+        self.process.wait()
+        self.process = None
+
+# ------------------------------------------------------------------------------
+# ignore_frames(image) - frames callback of a detached decoder
+# ------------------------------------------------------------------------------
+def ignore_frames(image):
+    pass
+
+# ------------------------------------------------------------------------------
+# DecoderPlayer(frames,name) - in-process H.264 decoder
+#
+# The stream goes through a pipe to a decoder thread, which calls
+# frames(image) with every decoded picture as a PIL image, and frames(None)
+# when the stream ends. Raises ImportError at start() without PyAV.
+#
+# A detached player (the standby) sends its pictures and its end of stream
+# nowhere, the window shown is another player's; attach(player) hands it
+# the frames callback of player.
+# ------------------------------------------------------------------------------
+class DecoderPlayer:
+
+    def __init__(self,frames,name=PLAYER_DECODER):
+        self.frames = frames
+        self.name = name
+        self.key = (PLAYER_DECODER,name)
+        self.fd = None
+        self.pid = None
+        self.start_time = None
+        # seconds from the first stream byte to the first picture
+        self.first_frame = None
+        self.frames_decoded = 0
+        self.decode_errors = 0
+        self._thread = None
+
+    def start(self):
+        start = time.perf_counter()
+        if load_av() is None: raise ImportError("in-process video decoder needs PyAV: pip3 install av")
+        # PyAV and the codec are loaded here, ahead of the stream
+        codec = av.CodecContext.create('h264','r')
+        codec.options = {'flags': 'low_delay'}
+        read_fd,self.fd = os.pipe()
+        self._thread = threading.Thread(target=self._run,args=(read_fd,codec),
+            name="video-decoder-{}".format(self.name),daemon=True)
+        self._thread.start()
+        self.start_time = time.perf_counter() - start
+        return self
+
+    def _run(self,read_fd,codec):
+        first_data = None
+        try:
+            with os.fdopen(read_fd,'rb',buffering=0) as stream:
+                while True:
+                    data = stream.read(65536)
+                    if not data: break
+                    if first_data is None: first_data = time.monotonic()
+                    try:
+                        packets = codec.parse(data)
+                        for packet in packets:
+                            for frame in codec.decode(packet):
+                                if self.first_frame is None:
+                                    self.first_frame = time.monotonic() - first_data
+                                    rover_log.info('player',"{} first frame in {:.0f} ms",self.name,self.first_frame * 1000)
+                                self.frames_decoded += 1
+                                self.frames(frame.to_image())
+                    except av.error.FFmpegError:
+                        # corrupt data: wait for the next decodable picture
+                        self.decode_errors += 1
+        finally:
+            self.frames(None)
+
+    def alive(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def detach(self):
+        self.frames = ignore_frames
+
+    def attach(self,player):
+        self.frames = player.frames
+
+    # close() - end of stream, the decoder thread finishes on its own
+    def close(self):
+        if self.fd is None: return
+        os.close(self.fd)
+        self.fd = None
+
+# ------------------------------------------------------------------------------
+# StandbyPlayer() - one started player waiting for a stream
+#
+# prepare() and take() may be called from any thread. The standby is
+# detached until take() hands it out: closing or replacing it must not end
+# the stream of the player in use.
+# ------------------------------------------------------------------------------
+class StandbyPlayer:
+
+    def __init__(self):
+        self.player = None
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    # prepare(player) - start player as the standby, unless an equal one is
+    # already waiting
+    def prepare(self,player):
+        with self._lock:
+            current = self.player
+        if current is not None and current.key == player.key and current.alive(): return current
+        player.detach()
+        player.start()
+        with self._lock:
+            old,self.player = self.player,player
+        if old is not None: old.close()
+        return player
+
+    # take(player) - the standby when it is equal to player, else player
+    # started now
+    def take(self,player):
+        with self._lock:
+            standby,self.player = self.player,None
+        if standby is not None and standby.key == player.key and standby.alive():
+            self.hits += 1
+            standby.attach(player)
+            return standby
+        if standby is not None: standby.close()
+        self.misses += 1
+        return player.start()
+
+    def close(self):
+        with self._lock:
+            standby,self.player = self.player,None
+        if standby is not None: standby.close()
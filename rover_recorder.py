@@ -0,0 +1,348 @@
+#!/usr/bin/python3
+
+# ##############################################################################
+#
+# Rover telemetry recorder and replay tool
+#
+# Every received telemetry datagram is appended, with its monotonic receive
+# time, to a preallocated memory-mapped log file. Appending is a couple of
+# memory copies into the mapping: no syscall, no formatting.
+#
+# File layout (little endian):
+#
+#   header   64 bytes      magic, version, file size, data end offset,
+#                          index entry count, wall clock and monotonic
+#                          clock at creation
+#   index    INDEX_SLOTS   sparse time index: (timestamp, offset) written
+#            x 16 bytes    every INDEX_INTERVAL seconds of recording
+#   data     ...           records: timestamp (double), length (uint16),
+#                          datagram bytes
+#
+# A file is rotated when its data area or its index is full. The next file
+# is created, preallocated and mapped ahead by an allocator thread, and the
+# full file is flushed (an msync of up to the whole file), shrunk and closed
+# by a closer thread: none of it runs on the event loop the recorder is
+# called from. Datagrams arriving while no file is ready are dropped and
+# counted. A file that cannot be preallocated (full disk) ends the
+# recording: a store into a page without disk space behind it would kill
+# the process with SIGBUS. Readers
+# map the file and binary search the index, so opening and seeking are
+# instant even for multi-hour sessions.
+#
+# Usage:
+#   rover_recorder.py info <files>
+#   rover_recorder.py export <files> [--start S] [--end S]
+#   rover_recorder.py replay <files> [--start S] [--end S] [--speed X]
+#                            [--target IP:PORT]
+#
+# ##############################################################################
+
+import os                       # Operating system interface
+import sys                      # System call
+import time                     # Time acquisition and formatting
+import mmap                     # Memory-mapped log files
+import struct                   # Binary record packing
+import bisect                   # Time index lookup
+import socket                   # Network communication
+import argparse                 # Command line parsing
+import threading                # File allocator and closer threads
+import concurrent.futures       # Next file prepared ahead
+import rover_log                # Event log
+
+# File format
+LOG_MAGIC = b'RVTLM001'
+LOG_VERSION = 1
+HEADER_STRUCT = struct.Struct('<8sIQQIdd')
+HEADER_SIZE = 64
+INDEX_STRUCT = struct.Struct('<dQ')
+INDEX_SLOTS = 8192
+RECORD_STRUCT = struct.Struct('<dH')
+DATA_START = HEADER_SIZE + INDEX_SLOTS * INDEX_STRUCT.size
+
+# Recorder defaults
+RECORD_FILE_SIZE = 64 * 1024 * 1024
+INDEX_INTERVAL = 1.0
+LOG_SUFFIX = '.rtl'
+
+# ------------------------------------------------------------------------------
+# create_file(path,file_size) - (file,mapping) of a new preallocated log
+# file, raises OSError; runs on an allocator thread
+# ------------------------------------------------------------------------------
+def create_file(path,file_size):
+    f = open(path,'w+b')
+    try:
+        try:
+            os.posix_fallocate(f.fileno(),0,file_size)
+        except AttributeError:
+            # no posix_fallocate on this platform: a sparse file
+            f.truncate(file_size)
+        return (f,mmap.mmap(f.fileno(),file_size))
+    except OSError:
+        f.close()
+        os.unlink(path)
+        raise
+
+# ------------------------------------------------------------------------------
+# discard_file(future) - close and remove a prepared file never used
+# ------------------------------------------------------------------------------
+def discard_file(future):
+    try:
+        path,(f,m) = future.result()
+    except OSError:
+        return
+    m.close()
+    f.close()
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+# ------------------------------------------------------------------------------
+# finish_file(m,f,offset) - flush the mapping, shrink the file to offset
+# bytes and close it; runs on a closer thread
+# ------------------------------------------------------------------------------
+def finish_file(m,f,offset):
+    try:
+        m.flush()
+        m.close()
+        f.truncate(offset)
+    except OSError as e:
+        rover_log.error('telemetry',"cannot close {}: {}",f.name,str(e))
+    finally:
+        f.close()
+
+# ------------------------------------------------------------------------------
+# TelemetryRecorder(directory,file_size,index_interval)
+# ------------------------------------------------------------------------------
+class TelemetryRecorder:
+
+    def __init__(self,directory,file_size=RECORD_FILE_SIZE,index_interval=INDEX_INTERVAL):
+        if file_size <= DATA_START + RECORD_STRUCT.size + 65535:
+            raise ValueError("telemetry record file size too small: {}".format(file_size))
+        self.directory = directory
+        self.file_size = file_size
+        self.index_interval = index_interval
+        self.files = 0
+        self.records = 0
+        # datagrams not recorded, no file ready
+        self.dropped = 0
+        # message of the error that ended the recording
+        self.error = None
+        self.path = None
+        self._file = None
+        self._map = None
+        self._next = None
+        self._closers = []
+        os.makedirs(directory,exist_ok=True)
+        self._prepare()
+
+    # _prepare() - create the next log file on an allocator thread
+    def _prepare(self):
+        name = "telemetry-{}-{:03d}{}".format(time.strftime("%Y%m%d-%H%M%S"),self.files + 1,LOG_SUFFIX)
+        path = os.path.join(self.directory,name)
+        future = self._next = concurrent.futures.Future()
+        def allocate():
+            try:
+                future.set_result((path,create_file(path,self.file_size)))
+            except OSError as e:
+                future.set_exception(e)
+        threading.Thread(name='telemetry-allocator',target=allocate,daemon=True).start()
+
+    # ready(timeout) - wait for the file being prepared; for tools and
+    # tests, never on the event loop
+    def ready(self,timeout=None):
+        if self._next is not None: concurrent.futures.wait((self._next,),timeout)
+
+    # _open() - switch to the prepared log file and prepare the one after;
+    # False when it is not ready yet or could not be created
+    def _open(self):
+        future = self._next
+        if future is None or not future.done(): return False
+        self._next = None
+        try:
+            self.path,(self._file,self._map) = future.result()
+        except OSError as e:
+            self.error = str(e)
+            rover_log.error('telemetry',"telemetry recording in {} stopped: {}",self.directory,str(e))
+            return False
+        self.files += 1
+        self.offset = DATA_START
+        self.index_count = 0
+        self.next_index = 0.0
+        self._write_header()
+        self._prepare()
+        return True
+
+    def _write_header(self):
+        HEADER_STRUCT.pack_into(self._map,0,LOG_MAGIC,LOG_VERSION,self.file_size,self.offset,self.index_count,time.time(),time.monotonic())
+
+    # close(wait) - shrink the current file to its used size, on a closer
+    # thread, and remove the prepared one; wait for every file handed off
+    # when wait is set. The closer
+    # threads are not daemons, the process waits for them at exit.
+    def close(self,wait=False):
+        if self._map is not None: self._hand_off()
+        future,self._next = self._next,None
+        if future is not None:
+            if wait:
+                concurrent.futures.wait((future,))
+                discard_file(future)
+            else:
+                # the prepared file is removed once it exists
+                future.add_done_callback(discard_file)
+        if wait:
+            for thread in self._closers: thread.join()
+        self._closers = [thread for thread in self._closers if thread.is_alive()]
+
+    def _hand_off(self):
+        thread = threading.Thread(name='telemetry-closer',target=finish_file,args=(self._map,self._file,self.offset))
+        thread.start()
+        self._closers.append(thread)
+        self._map = None
+        self._file = None
+
+    # record(timestamp,data) - append one datagram; False when it was
+    # dropped, no file ready or the recording ended
+    def record(self,timestamp,data):
+        if self.error is not None: return False
+        size = RECORD_STRUCT.size + len(data)
+        if self._map is not None and (self.offset + size > self.file_size or
+                (timestamp >= self.next_index and self.index_count == INDEX_SLOTS)):
+            self._hand_off()
+        if self._map is None and not self._open():
+            self.dropped += 1
+            return False
+
+        m = self._map
+        offset = self.offset
+        if timestamp >= self.next_index:
+            INDEX_STRUCT.pack_into(m,HEADER_SIZE + self.index_count * INDEX_STRUCT.size,timestamp,offset)
+            self.index_count += 1
+            self.next_index = timestamp + self.index_interval
+            struct.pack_into('<I',m,28,self.index_count)
+
+        RECORD_STRUCT.pack_into(m,offset,timestamp,len(data))
+        m[offset + RECORD_STRUCT.size:offset + size] = data
+        self.offset = offset + size
+        # data end offset is published last, readers never see a partial record
+        struct.pack_into('<Q',m,20,self.offset)
+        self.records += 1
+        return True
+
+# ------------------------------------------------------------------------------
+# TelemetryLog(path) - read-only view of one log file
+# ------------------------------------------------------------------------------
+class TelemetryLog:
+
+    def __init__(self,path):
+        self.path = path
+        with open(path,'rb') as f:
+            self._map = mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
+        magic,version,size,self.end,count,self.wall_time,self.mono_time = HEADER_STRUCT.unpack_from(self._map,0)
+        if magic != LOG_MAGIC or version != LOG_VERSION:
+            raise ValueError("not a telemetry log file: {}".format(path))
+        self.end = min(self.end,len(self._map))
+        self.index = [INDEX_STRUCT.unpack_from(self._map,HEADER_SIZE + i * INDEX_STRUCT.size) for i in range(count)]
+        self.index_times = [t for t,_ in self.index]
+
+    def close(self):
+        self._map.close()
+
+    # first_time() / last_time() - monotonic time span of the file
+    def first_time(self):
+        return self.index_times[0] if self.index else None
+
+    def last_time(self):
+        last = None
+        for last,_ in self.records(self.index_times[-1] if self.index else None): pass
+        return last
+
+    # records(start,end) - yields (timestamp,data) with start <= timestamp < end
+    def records(self,start=None,end=None):
+        m = self._map
+        offset = DATA_START
+        if start is not None and self.index:
+            i = bisect.bisect_right(self.index_times,start) - 1
+            if i >= 0: offset = self.index[i][1]
+        while offset + RECORD_STRUCT.size <= self.end:
+            timestamp,length = RECORD_STRUCT.unpack_from(m,offset)
+            offset += RECORD_STRUCT.size
+            if end is not None and timestamp >= end: return
+            if start is None or timestamp >= start:
+                yield (timestamp,m[offset:offset + length])
+            offset += length
+
+# ------------------------------------------------------------------------------
+# open_session(paths) - log files sorted by creation time
+# ------------------------------------------------------------------------------
+def open_session(paths):
+    logs = [TelemetryLog(p) for p in paths]
+    logs.sort(key=lambda log: log.mono_time)
+    return logs
+
+# ------------------------------------------------------------------------------
+# session_records(logs,start,end) - records across files, times relative
+# to the first record of the session
+# ------------------------------------------------------------------------------
+def session_records(logs,start=None,end=None):
+    origin = next((log.first_time() for log in logs if log.index),None)
+    if origin is None: return
+    abs_start = None if start is None else origin + start
+    abs_end = None if end is None else origin + end
+    for log in logs:
+        if not log.index: continue
+        if abs_end is not None and log.first_time() >= abs_end: return
+        for timestamp,data in log.records(abs_start,abs_end):
+            yield (timestamp - origin,data)
+
+# ------------------------------------------------------------------------------
+# func_info(logs) / func_export(logs,...) / func_replay(logs,...)
+# ------------------------------------------------------------------------------
+def func_info(logs):
+    for log in logs:
+        first,last = log.first_time(),log.last_time()
+        span = (last - first) if first is not None else 0.0
+        print("{}: {} bytes, {} index entries, {:.1f} s, started {}".format(
+            log.path,log.end,len(log.index),span,time.strftime("%Y-%m-%d %H:%M:%S",time.localtime(log.wall_time))))
+
+def func_export(logs,start,end):
+    out = sys.stdout
+    for t,data in session_records(logs,start,end):
+        out.write("{:.6f},{}\n".format(t,bytes(data).decode(errors='replace').rstrip('\r\n')))
+
+def func_replay(logs,start,end,speed,target):
+    sock = socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
+    wall_start = None
+    for t,data in session_records(logs,start,end):
+        if wall_start is None:
+            wall_start,t0 = time.monotonic(),t
+        if speed > 0:
+            delay = (t - t0) / speed - (time.monotonic() - wall_start)
+            if delay > 0: time.sleep(delay)
+        sock.sendto(data,target)
+    sock.close()
+
+# ##############################################################################
+#
+# Main
+#
+# ##############################################################################
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rover telemetry log tool")
+    parser.add_argument('command',choices=('info','export','replay'))
+    parser.add_argument('files',nargs='+')
+    parser.add_argument('--start',type=float,default=None,help="seconds from session start")
+    parser.add_argument('--end',type=float,default=None,help="seconds from session start")
+    parser.add_argument('--speed',type=float,default=1.0,help="replay speed factor, 0 = as fast as possible")
+    parser.add_argument('--target',default='127.0.0.1:10003',help="replay destination IP:PORT")
+    args = parser.parse_args()
+
+    logs = open_session(args.files)
+    if args.command == 'info':
+        func_info(logs)
+    elif args.command == 'export':
+        func_export(logs,args.start,args.end)
+    else:
+        ip,port = args.target.rsplit(':',1)
+        func_replay(logs,args.start,args.end,args.speed,(ip,int(port)))
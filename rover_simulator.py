@@ -0,0 +1,412 @@
+#!/usr/bin/python3
+
+# ##############################################################################
+#
+# Local rover simulator
+#
+# A stand-in for the Raspberry Pi rover, listening on the ports of rover.conf:
+#
+#   ROVER_SYSTEM_PORT     TCP, system commands are logged, never executed;
+#                         framed requests get a reply, 'ping' answers 'pong',
+#                         'video_bitrate BPS [WxH]' changes the video rate
+#   ROVER_CONTROL_PORT    UDP, binary and CSV control frames are decoded,
+#                         every motor frame is answered with a $MOT sentence
+#   ROVER_VIDEO_PORT      TCP, synthetic H.264 Annex-B stream or the content
+#                         of a recorded stream file, looped
+#   --probe-port          UDP echo service for the link prober, 17007 by
+#                         default: the usual echo port 7 needs root; point
+#                         LINK_PROBE_UDP_PORT of the client at it
+#
+# $MOT sentences (left motor value, LR - LF, and the sequence number of the
+# last binary frame applied) are sent from ROVER_TELEMETRY_PORT to
+# CLIENT_TELEMETRY_PORT of the last control sender, on every motor frame and
+# telemetry_rate times a second, each time followed by one '$SNn,value'
+# sentence per simulated sensor, back to back like a burst. Loss and
+# latency injection apply to every UDP datagram received or sent: control,
+# telemetry and probes.
+#
+# Usage:
+#   rover_simulator.py [--config FILE] [--rover NAME] [--bind IP] [--video-file FILE]
+#                      [--video-rate BPS] [--video-link BPS] [--fps N] [--gop N]
+#                      [--loss P] [--latency S] [--jitter S]
+#                      [--telemetry-rate N] [--sensors N] [--probe-port PORT] [--stats]
+#
+# --video-link caps the video throughput below the stream rate, a link too
+# slow for the encoder: the stream backs up and frames come late.
+#
+# --rover picks the ports of one rover of the fleet; simulate a fleet on one
+# host with one simulator per rover, each bound to its own 127.0.0.x address.
+#
+# With --stats, counters and control frame timing are printed as one JSON
+# line on exit.
+#
+# ##############################################################################
+
+import os                       # Operating system interface
+import sys                      # System call
+import time                     # Time acquisition and formatting
+import json                     # Statistics output
+import random                   # Loss and latency injection
+import signal                   # Termination
+import asyncio                  # Event loop
+import argparse                 # Command line parsing
+import collections              # Control frame history
+import rover_control            # Control frame layout
+import rover_config             # Configuration file
+import rover_system             # System command frames
+import rover_metrics            # Statistics summaries
+
+# Debug output flag
+DEBUG_SIMULATOR = True
+
+# Simulator defaults
+SIM_VIDEO_RATE = 2000000
+SIM_FPS = 30
+SIM_GOP = 30
+SIM_TELEMETRY_RATE = 10
+SIM_HISTORY = 100000
+SIM_PROBE_PORT = 17007
+
+# Synthetic stream NAL units: AUD, SPS, PPS (content is not decodable, only
+# the NAL structure matters to the relay)
+SIM_AUD = b'\x00\x00\x00\x01\x09\xf0'
+SIM_SPS = b'\x00\x00\x00\x01\x67\x42\xc0\x1f\xda\x01\x40\x16\xe8'
+SIM_PPS = b'\x00\x00\x00\x01\x68\xce\x3c\x80'
+
+# ------------------------------------------------------------------------------
+# decode_control(data) - ('axes',(LF,LR,RL,RR),sequence) or ('message',text,None)
+# ------------------------------------------------------------------------------
+def decode_control(data):
+    if len(data) == rover_control.FRAME_STRUCT.size and data[0] == rover_control.FRAME_MAGIC:
+        magic,kind,sequence,timestamp,LF,LR,RL,RR = rover_control.FRAME_STRUCT.unpack(data)
+        return ('axes',(LF,LR,RL,RR),sequence)
+    text = data.decode(errors='replace')
+    fields = text.split(',')
+    if fields[0] == str(rover_control.FRAME_TYPE_MOTOR) and len(fields) == 5:
+        return ('axes',tuple(int(v) for v in fields[1:]),None)
+    return ('message',text,None)
+
+# ------------------------------------------------------------------------------
+# synthetic_stream(frame_size,gop) - yields one Annex-B access unit per frame
+# ------------------------------------------------------------------------------
+def synthetic_stream(frame_size,gop=SIM_GOP):
+    # slice payload without zero bytes, so it never contains a start code;
+    # the first byte sets first_mb_in_slice to 0
+    payload = bytes(b or 1 for b in os.urandom(max(frame_size,16)))
+    idr = b'\x00\x00\x00\x01\x65\x88' + payload[:frame_size]
+    ref = b'\x00\x00\x00\x01\x41\x9a' + payload[:frame_size // 2]
+    nonref = b'\x00\x00\x00\x01\x01\x9e' + payload[:frame_size // 4]
+    frame = 0
+    while True:
+        if frame % gop == 0:
+            yield SIM_AUD + SIM_SPS + SIM_PPS + idr
+        elif frame % 2:
+            yield SIM_AUD + nonref
+        else:
+            yield SIM_AUD + ref
+        frame += 1
+
+# ------------------------------------------------------------------------------
+# synthetic_frame_size(rate,fps,gop) - IDR frame size giving rate bits per
+# second with the frame sizes of synthetic_stream()
+# ------------------------------------------------------------------------------
+def synthetic_frame_size(rate,fps=SIM_FPS,gop=SIM_GOP):
+    # one IDR, ref frames half, non-ref frames a quarter of its size
+    sizes = 1 + ((gop - 1) // 2) / 2 + (gop // 2) / 4
+    return int(rate / 8 / (fps or SIM_FPS) * gop / sizes)
+
+# ------------------------------------------------------------------------------
+# RoverSimulator(settings,...)
+# ------------------------------------------------------------------------------
+class RoverSimulator:
+
+    def __init__(self,settings,bind_ip='127.0.0.1',video_file=None,video_rate=SIM_VIDEO_RATE,
+            fps=SIM_FPS,gop=SIM_GOP,loss=0.0,latency=0.0,jitter=0.0,telemetry_rate=SIM_TELEMETRY_RATE,
+            video_link=0,sensors=0,probe_port=SIM_PROBE_PORT):
+        self.settings = settings
+        self.bind_ip = bind_ip
+        self.video_file = video_file
+        self.video_rate = video_rate
+        self.video_link = video_link
+        self.video_size = None
+        self.fps = fps
+        self.gop = gop
+        self.loss = loss
+        self.latency = latency
+        self.jitter = jitter
+        self.telemetry_rate = telemetry_rate
+        self.sensors = sensors
+        self.probe_port = probe_port
+        # current rover state
+        self.motor = (0,0,0,0)
+        self.client_ip = bind_ip
+        self.last_sequence = None
+        # counters
+        self.control_frames = 0
+        self.control_stale = 0
+        self.control_messages = 0
+        self.control_times = collections.deque(maxlen=SIM_HISTORY)
+        self.telemetry_sent = 0
+        self.probes = 0
+        self.dropped = 0
+        self.video_clients = 0
+        self.video_bytes = 0
+        self.system_commands = []
+        self.video_rates = []
+        self._control = None
+        self._telemetry = None
+        self._echo = None
+
+    # _inject(func,*args) - deliver after the injected loss and latency
+    def _inject(self,func,*args):
+        if self.loss and random.random() < self.loss:
+            self.dropped += 1
+            return
+        delay = self.latency + (random.uniform(-self.jitter,self.jitter) if self.jitter else 0)
+        if delay > 0:
+            asyncio.get_running_loop().call_later(delay,func,*args)
+        else:
+            func(*args)
+
+    # --------------------------------------------------------------------------
+    # Control and telemetry
+    # --------------------------------------------------------------------------
+
+    def _control_received(self,data,addr):
+        now = time.monotonic()
+        kind,value,sequence = decode_control(data)
+        if kind == 'message':
+            self.control_messages += 1
+            if DEBUG_SIMULATOR: print("[SIM]> message: {}".format(value),file=sys.stderr)
+            return
+        # the rover drops frames older than the last one applied
+        if sequence is not None and self.last_sequence is not None and ((sequence - self.last_sequence) & 0xFFFFFFFF) >= 0x80000000:
+            self.control_stale += 1
+            return
+        self.last_sequence = sequence
+        self.control_frames += 1
+        self.control_times.append(now)
+        self.client_ip = addr[0]
+        self.motor = value
+        self._send_telemetry()
+
+    def _send_telemetry(self):
+        LF,LR,RL,RR = self.motor
+        if self.last_sequence is None:
+            sentence = '$MOT,{}\r\n'.format(LR - LF).encode()
+        else:
+            # echo of the frame id, for the client round-trip timing
+            sentence = '$MOT,{},{}\r\n'.format(LR - LF,self.last_sequence).encode()
+        self._inject(self._telemetry_send,sentence)
+
+    def _telemetry_send(self,sentence):
+        self._telemetry.sendto(sentence,(self.client_ip,self.settings.CLIENT_TELEMETRY_PORT))
+        self.telemetry_sent += 1
+
+    async def _telemetry_loop(self):
+        if not self.telemetry_rate: return
+        while True:
+            await asyncio.sleep(1 / self.telemetry_rate)
+            self._send_telemetry()
+            now = time.monotonic()
+            for i in range(self.sensors):
+                self._inject(self._telemetry_send,'$SN{},{:.3f}\r\n'.format(i + 1,now).encode())
+
+    def _echo_received(self,data,addr):
+        self.probes += 1
+        self._inject(self._echo.sendto,data,addr)
+
+    # --------------------------------------------------------------------------
+    # Video
+    # --------------------------------------------------------------------------
+
+    def _chunks(self):
+        if self.video_file:
+            with open(self.video_file,'rb') as f:
+                data = f.read()
+            if not data: raise ValueError("empty video file: {}".format(self.video_file))
+            while True:
+                for i in range(0,len(data),65536):
+                    yield data[i:i + 65536]
+        else:
+            # a new rate starts with the next GOP, as an encoder would
+            while True:
+                rate = self.video_rate
+                for frame,au in enumerate(synthetic_stream(synthetic_frame_size(rate,self.fps,self.gop),self.gop)):
+                    if frame % self.gop == 0 and frame and self.video_rate != rate: break
+                    yield au
+
+    async def _video_client(self,reader,writer):
+        self.video_clients += 1
+        if DEBUG_SIMULATOR: print("[SIM]> video client {}".format(writer.get_extra_info('peername')),file=sys.stderr)
+        # paced by frames per second (synthetic) or bits per second (file),
+        # and no faster than the link
+        frame_interval = 1 / self.fps if (not self.video_file and self.fps) else 0
+        next_time = time.monotonic()
+        try:
+            for chunk in self._chunks():
+                writer.write(chunk)
+                await writer.drain()
+                self.video_bytes += len(chunk)
+                seconds_per_byte = 8 / self.video_rate if (self.video_file and self.video_rate) else 0
+                interval = len(chunk) * seconds_per_byte + frame_interval
+                if self.video_link: interval = max(interval,len(chunk) * 8 / self.video_link)
+                next_time += interval
+                delay = next_time - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                else:
+                    next_time = time.monotonic()
+                    await asyncio.sleep(0)
+        except OSError:
+            pass
+        finally:
+            writer.close()
+
+    # --------------------------------------------------------------------------
+    # System commands
+    # --------------------------------------------------------------------------
+
+    async def _system_client(self,reader,writer):
+        try:
+            first = await reader.read(1)
+            if first and first[0] == rover_system.FRAME_MAGIC:
+                # framed connection: one reply per request, until closed
+                await self._system_framed(first,reader,writer)
+                return
+            command = (first + await reader.read(65536)).decode(errors='replace')
+        except (OSError,ValueError,asyncio.IncompleteReadError):
+            return
+        finally:
+            writer.close()
+        self._system_command(command)
+
+    async def _system_framed(self,first,reader,writer):
+        header = first + await reader.readexactly(rover_system.FRAME_STRUCT.size - 1)
+        while True:
+            magic,frame_type,command_id,status,length = rover_system.FRAME_STRUCT.unpack(header)
+            if magic != rover_system.FRAME_MAGIC: raise ValueError("bad system frame")
+            command = (await reader.readexactly(length)).decode(errors='replace')
+            if frame_type == rover_system.FRAME_TYPE_REQUEST:
+                output = 'pong' if command == 'ping' else self._system_command(command)
+                writer.write(rover_system.encode_frame(rover_system.FRAME_TYPE_REPLY,command_id,0,output.encode()))
+                await writer.drain()
+            header = await reader.readexactly(rover_system.FRAME_STRUCT.size)
+
+    # _system_command(command) - logged, never executed; video_bitrate is
+    # applied to the simulated stream
+    def _system_command(self,command):
+        self.system_commands.append(command)
+        if DEBUG_SIMULATOR: print("[SIM]> system command: {}".format(command),file=sys.stderr)
+        fields = command.split()
+        if fields and fields[0] == 'video_bitrate' and len(fields) in (2,3) and fields[1].isdigit():
+            self.video_rate = int(fields[1])
+            self.video_size = fields[2] if len(fields) == 3 else None
+            self.video_rates.append(self.video_rate)
+            return "video {} bps {}".format(self.video_rate,self.video_size or '').strip()
+        return "simulated: " + command
+
+    # --------------------------------------------------------------------------
+
+    # run(ready) - serve until cancelled, ready() is called once listening
+    async def run(self,ready=None):
+        loop = asyncio.get_running_loop()
+        settings = self.settings
+        simulator = self
+
+        class Handler(asyncio.DatagramProtocol):
+            def __init__(self,handler):
+                self.handler = handler
+            def datagram_received(self,data,addr):
+                simulator._inject(self.handler,data,addr)
+
+        servers = []
+        transports = []
+        try:
+            self._control,_ = await loop.create_datagram_endpoint(lambda: Handler(self._control_received),
+                local_addr=(self.bind_ip,settings.ROVER_CONTROL_PORT))
+            transports.append(self._control)
+            self._telemetry,_ = await loop.create_datagram_endpoint(asyncio.DatagramProtocol,
+                local_addr=(self.bind_ip,settings.ROVER_TELEMETRY_PORT))
+            transports.append(self._telemetry)
+            self._echo,_ = await loop.create_datagram_endpoint(lambda: Handler(self._echo_received),
+                local_addr=(self.bind_ip,self.probe_port))
+            transports.append(self._echo)
+            servers.append(await asyncio.start_server(self._video_client,self.bind_ip,settings.ROVER_VIDEO_PORT))
+            servers.append(await asyncio.start_server(self._system_client,self.bind_ip,settings.ROVER_SYSTEM_PORT))
+            if ready: ready()
+            await self._telemetry_loop()
+            await asyncio.Future()
+        finally:
+            for server in servers: server.close()
+            for transport in transports: transport.close()
+
+    # stats() - counters and control frame timing, intervals in ms
+    def stats(self):
+        times = list(self.control_times)
+        intervals = [(b - a) * 1000 for a,b in zip(times,times[1:])]
+        span = (times[-1] - times[0]) if len(times) > 1 else 0
+        return {
+            'control_frames': self.control_frames,
+            'control_stale': self.control_stale,
+            'control_messages': self.control_messages,
+            'control_rate': (len(times) - 1) / span if span else 0.0,
+            'control_interval_ms': rover_metrics.summarize(intervals),
+            'telemetry_sent': self.telemetry_sent,
+            'probes': self.probes,
+            'dropped': self.dropped,
+            'video_clients': self.video_clients,
+            'video_bytes': self.video_bytes,
+            'video_rates': self.video_rates,
+            'system_commands': self.system_commands,
+        }
+
+# ##############################################################################
+#
+# Main
+#
+# ##############################################################################
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local rover simulator")
+    parser.add_argument('--config',default=rover_config.ROVER_CONFIG_FILE,help="configuration file, for the ports")
+    parser.add_argument('--rover',default=None,help="rover name in ROVERS")
+    parser.add_argument('--bind',default='127.0.0.1',help="address to listen on")
+    parser.add_argument('--video-file',default=None,help="H.264 Annex-B file streamed in a loop instead of the synthetic stream")
+    parser.add_argument('--video-rate',type=int,default=SIM_VIDEO_RATE,help="video bits per second, 0 = unpaced file")
+    parser.add_argument('--video-link',type=int,default=0,help="video link capacity in bits per second, 0 = unlimited")
+    parser.add_argument('--fps',type=float,default=SIM_FPS,help="synthetic frames per second, 0 = unpaced")
+    parser.add_argument('--gop',type=int,default=SIM_GOP,help="synthetic frames per IDR frame")
+    parser.add_argument('--loss',type=float,default=0.0,help="UDP datagram loss probability")
+    parser.add_argument('--latency',type=float,default=0.0,help="UDP one-way latency in seconds")
+    parser.add_argument('--jitter',type=float,default=0.0,help="UDP latency jitter in seconds")
+    parser.add_argument('--telemetry-rate',type=float,default=SIM_TELEMETRY_RATE,help="$MOT sentences per second")
+    parser.add_argument('--sensors',type=int,default=0,help="sensor sentences sent after each timed $MOT")
+    parser.add_argument('--probe-port',type=int,default=SIM_PROBE_PORT,help="link probe echo port, LINK_PROBE_UDP_PORT of the client")
+    parser.add_argument('--stats',action='store_true',help="print JSON statistics on exit")
+    parser.add_argument('--quiet',action='store_true',help="no debug output")
+    args = parser.parse_args()
+
+    if args.quiet:
+        DEBUG_SIMULATOR = False
+
+    settings = rover_config.load_settings(args.config,args.rover)
+    simulator = RoverSimulator(settings,args.bind,args.video_file,args.video_rate,args.fps,args.gop,
+        args.loss,args.latency,args.jitter,args.telemetry_rate,args.video_link,args.sensors,args.probe_port)
+
+    def ready():
+        # readiness line for scripts starting the simulator
+        print("ready",flush=True)
+
+    async def main():
+        task = asyncio.ensure_future(simulator.run(ready))
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT,signal.SIGTERM):
+            loop.add_signal_handler(signum,task.cancel)
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    asyncio.run(main())
+    if args.stats: print(json.dumps(simulator.stats()),flush=True)
@@ -0,0 +1,218 @@
+# ##############################################################################
+#
+# Rover system command link
+#
+# One TCP connection per rover, kept open, carries system commands (reboot,
+# shutdown, ping, status queries) as length-prefixed frames:
+#
+#   offset  size  field
+#   0       1     magic (0xA5) - never an ASCII character, so the rover can
+#                 tell framed connections apart from legacy raw commands
+#   1       1     frame type (1 = request, 2 = reply)
+#   2       4     command id (uint32, wraps), a reply carries the id of its
+#                 request
+#   6       1     status, replies only: 0 = done, anything else = failed
+#                 (exit status of the command, 255 = not run)
+#   7       4     payload length in bytes (uint32)
+#   11      n     payload, UTF-8: the command line, or the command output
+#
+# All fields are network byte order. Requests are pipelined: several
+# commands may be in flight, replies come back in any order and are matched
+# by id. A command without reply within its timeout fails on the client
+# side only, a late reply is ignored.
+#
+# The legacy 'raw' protocol opens a connection per command, sends the bare
+# command line and never gets a reply.
+#
+# ##############################################################################
+
+import asyncio                  # Event loop
+import collections              # Reply records
+import struct                   # Frame packing
+import time                     # Round-trip time
+import rover_net                # Reconnect state machine
+
+# Protocols
+PROTOCOL_FRAMED = 'framed'
+PROTOCOL_RAW = 'raw'
+
+# Frame layout
+FRAME_MAGIC = 0xA5
+FRAME_TYPE_REQUEST = 1
+FRAME_TYPE_REPLY = 2
+FRAME_STRUCT = struct.Struct('!BBIBI')
+FRAME_MAX_PAYLOAD = 1048576
+
+# Reply status of a command that was not run
+STATUS_NOT_RUN = 255
+
+# Reply status of a raw command: sent, the rover does not confirm it
+STATUS_UNCONFIRMED = None
+
+# Default reply timeout, seconds
+COMMAND_TIMEOUT = 5.0
+
+# Command reply: status 0 is success, STATUS_UNCONFIRMED for raw commands,
+# output is the text sent back by the rover ('' for raw commands), rtt the
+# round-trip time in seconds (of the send for raw commands)
+Reply = collections.namedtuple('Reply','id status output rtt')
+
+# ------------------------------------------------------------------------------
+# NotConnectedError - framed command without a live connection to the rover
+# ------------------------------------------------------------------------------
+class NotConnectedError(ConnectionError):
+    pass
+
+# ------------------------------------------------------------------------------
+# encode_frame(frame_type,command_id,status,payload)
+# ------------------------------------------------------------------------------
+def encode_frame(frame_type,command_id,status,payload):
+    return FRAME_STRUCT.pack(FRAME_MAGIC,frame_type,command_id,status,len(payload)) + payload
+
+# ------------------------------------------------------------------------------
+# read_frame(reader) - (frame_type,command_id,status,payload), raises
+# asyncio.IncompleteReadError at end of stream and ValueError on a bad frame
+# ------------------------------------------------------------------------------
+async def read_frame(reader):
+    header = await reader.readexactly(FRAME_STRUCT.size)
+    magic,frame_type,command_id,status,length = FRAME_STRUCT.unpack(header)
+    if magic != FRAME_MAGIC:
+        raise ValueError("bad system frame magic: 0x{:02x}".format(magic))
+    if length > FRAME_MAX_PAYLOAD:
+        raise ValueError("system frame too long: {}".format(length))
+    return frame_type,command_id,status,await reader.readexactly(length)
+
+# ------------------------------------------------------------------------------
+# SystemLink(robot_ip,robot_port,protocol,timeout)
+#
+# run() keeps the connection open and must run as a channel for the framed
+# protocol; request() sends one command and waits for its reply.
+# ------------------------------------------------------------------------------
+class SystemLink:
+
+    def __init__(self,robot_ip,robot_port,protocol=PROTOCOL_FRAMED,timeout=COMMAND_TIMEOUT,
+            max_delay=rover_net.RECONNECT_MAX_DELAY):
+        if protocol not in (PROTOCOL_FRAMED,PROTOCOL_RAW):
+            raise ValueError("unknown system protocol: {}".format(protocol))
+        self.robot_ip = robot_ip
+        self.robot_port = robot_port
+        self.protocol = protocol
+        self.timeout = timeout
+        self.command_id = 0
+        # command id -> (future,send time)
+        self.pending = {}
+        # set while connected, and when the last connection attempt ended
+        self.connected = None
+        self.settled = None
+        self.reconnect = rover_net.Reconnect(max_delay)
+        self._writer = None
+
+    @property
+    def connects(self):
+        return self.reconnect.connects
+
+    # run() - connect, dispatch replies, reconnect after a loss; until cancelled
+    async def run(self):
+        if self.protocol == PROTOCOL_RAW: return
+        self._events()
+        try:
+            while True:
+                self.reconnect.connecting()
+                self.settled.clear()
+                try:
+                    reader,writer = await asyncio.wait_for(asyncio.open_connection(self.robot_ip,self.robot_port),
+                        rover_net.CONNECT_TIMEOUT)
+                except (OSError,asyncio.TimeoutError):
+                    self.reconnect.failed()
+                    self.settled.set()
+                    await self.reconnect.wait()
+                    continue
+                self._writer = writer
+                self.reconnect.connected()
+                self.connected.set()
+                self.settled.set()
+                try:
+                    while True:
+                        frame_type,command_id,status,payload = await read_frame(reader)
+                        if frame_type == FRAME_TYPE_REPLY: self._reply(command_id,status,payload)
+                except (OSError,ValueError,asyncio.IncompleteReadError):
+                    pass
+                finally:
+                    self.connected.clear()
+                    self._writer = None
+                    writer.close()
+                    self._fail(ConnectionError("system connection to {}:{} lost".format(self.robot_ip,self.robot_port)))
+                    self.reconnect.lost()
+                await self.reconnect.wait()
+        finally:
+            self._fail(ConnectionError("system link closed"))
+
+    def _reply(self,command_id,status,payload):
+        future,sent = self.pending.pop(command_id,(None,None))
+        # late reply of a command already timed out
+        if future is None or future.done(): return
+        future.set_result(Reply(command_id,status,payload.decode(errors='replace'),time.monotonic() - sent))
+
+    def _fail(self,error):
+        for future,sent in self.pending.values():
+            if not future.done(): future.set_exception(error)
+        self.pending.clear()
+
+    # request(command,timeout) - Reply of the rover; raises
+    # NotConnectedError without a framed connection, OSError when the rover
+    # cannot be reached and asyncio.TimeoutError without reply in time
+    async def request(self,command,timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        if self.protocol == PROTOCOL_RAW:
+            return await asyncio.wait_for(self._request_raw(command),timeout)
+
+        deadline = time.monotonic() + timeout
+        self._events()
+        if not self.connected.is_set() and self.reconnect.state == rover_net.STATE_CONNECTING:
+            # a command waits for the end of a connection attempt under way
+            # (start-up), not for run() to come out of its backoff: the
+            # rover may be down for longer than anyone wants to wait for its
+            # reboot
+            try:
+                await asyncio.wait_for(self.settled.wait(),timeout)
+            except asyncio.TimeoutError:
+                pass
+        writer = self._writer
+        if not self.connected.is_set() or writer is None: raise self._not_connected()
+
+        self.command_id = (self.command_id + 1) & 0xFFFFFFFF
+        command_id = self.command_id
+        future = asyncio.get_running_loop().create_future()
+        self.pending[command_id] = (future,time.monotonic())
+        try:
+            # a stalled socket blocks drain(): it counts in the same timeout
+            # as the reply
+            return await asyncio.wait_for(self._exchange(writer,command_id,command,future),max(0,deadline - time.monotonic()))
+        finally:
+            self.pending.pop(command_id,None)
+
+    # _events() - created on the network loop, by whichever of run() and
+    # request() comes first
+    def _events(self):
+        if self.connected is None:
+            self.connected = asyncio.Event()
+            self.settled = asyncio.Event()
+
+    def _not_connected(self):
+        return NotConnectedError("system link to {}:{} not connected".format(self.robot_ip,self.robot_port))
+
+    async def _exchange(self,writer,command_id,command,future):
+        writer.write(encode_frame(FRAME_TYPE_REQUEST,command_id,0,command.encode()))
+        await writer.drain()
+        return await future
+
+    async def _request_raw(self,command):
+        sent = time.monotonic()
+        reader,writer = await asyncio.open_connection(self.robot_ip,self.robot_port)
+        try:
+            writer.write(command.encode())
+            await writer.drain()
+        finally:
+            writer.close()
+        self.command_id = (self.command_id + 1) & 0xFFFFFFFF
+        return Reply(self.command_id,STATUS_UNCONFIRMED,'',time.monotonic() - sent)
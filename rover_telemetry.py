@@ -0,0 +1,223 @@
+# ##############################################################################
+#
+# Rover telemetry decoding
+#
+# Telemetry datagrams are NMEA-like sentences: '$TAG,value,value,...'.
+# Every sentence tag registers the names of its fields; a datagram is decoded
+# straight from bytes into a typed record (a namedtuple) and appended to a
+# fixed-size ring buffer for its channel. Ring buffers are NumPy arrays when
+# NumPy is installed, array.array columns otherwise.
+#
+# Sentence tags without a registered decoder are still kept, with their
+# numeric fields named f1, f2, ... Each one costs a ring buffer of
+# TELEMETRY_HISTORY samples per field: at most AUTO_TAGS_MAX tags of at
+# most AUTO_FIELDS_MAX fields are registered this way, sentences beyond
+# are dropped and counted, so a malformed or hostile datagram cannot make
+# the client allocate without limit.
+#
+# ##############################################################################
+
+import array                    # Fallback ring buffer storage
+import bisect                   # Time window lookup
+import collections              # Typed telemetry records
+import math                     # NaN for missing fields
+import time                     # Time acquisition and formatting
+
+# NumPy is imported with the first ring buffer, not at start-up
+numpy = None
+numpy_loaded = False
+
+# Samples kept per telemetry channel
+TELEMETRY_HISTORY = 4096
+
+# Registered sentence decoders: tag -> (record type, parser)
+DECODERS = {}
+
+# Limits of the decoders registered for unknown tags, and those tags
+AUTO_TAGS_MAX = 64
+AUTO_FIELDS_MAX = 64
+AUTO_TAGS = set()
+
+# ------------------------------------------------------------------------------
+# TelemetryLimitError - unknown sentence over the auto-registration limits
+# ------------------------------------------------------------------------------
+class TelemetryLimitError(ValueError):
+    pass
+
+# ------------------------------------------------------------------------------
+# parse_numeric(fields,count) - default parser, every field is a float
+# ------------------------------------------------------------------------------
+def parse_numeric(fields,count):
+    # float() parses bytes directly, no str round trip
+    values = [float(v) if v else math.nan for v in fields[:count]]
+    values += [math.nan] * (count - len(values))
+    return values
+
+# ------------------------------------------------------------------------------
+# register_decoder(tag,fields,parser)
+#
+# parser(fields,count) receives the raw bytes fields after the tag and
+# returns count numeric values, in the order of the field names.
+# ------------------------------------------------------------------------------
+def register_decoder(tag,fields,parser=parse_numeric):
+    if isinstance(tag,str): tag = tag.encode()
+    record_type = collections.namedtuple(tag.decode().lstrip('$'),fields)
+    DECODERS[tag] = (record_type,parser)
+    return record_type
+
+# Known rover sentences. $MOT echoes the sequence number of the last
+# binary control frame applied, for round-trip timing; rovers that do not
+# send it leave frame_id NaN
+register_decoder('$MOT',('motor','frame_id'))
+
+# ------------------------------------------------------------------------------
+# decode_sentence(datagram) - returns (tag,record), raises ValueError, or
+# TelemetryLimitError for an unknown tag over the limits
+# ------------------------------------------------------------------------------
+def decode_sentence(datagram):
+    parts = datagram.rstrip(b'\r\n').split(b',')
+    tag = parts[0]
+    if not tag.startswith(b'$') or len(parts) < 2:
+        raise ValueError("not a telemetry sentence: {!r}".format(datagram[:32]))
+
+    decoder = DECODERS.get(tag)
+    if decoder is None:
+        if len(AUTO_TAGS) >= AUTO_TAGS_MAX:
+            raise TelemetryLimitError("too many unknown sentence tags: {!r}".format(tag[:32]))
+        if len(parts) - 1 > AUTO_FIELDS_MAX:
+            raise TelemetryLimitError("too many fields: {} in {!r}".format(len(parts) - 1,tag[:32]))
+        # a tag takes one of the AUTO_TAGS_MAX slots once its sentence parses,
+        # not for garbage
+        values = parse_numeric(parts[1:],len(parts) - 1)
+        record_type = register_decoder(tag,['f{}'.format(i) for i in range(1,len(parts))])
+        AUTO_TAGS.add(tag)
+        return (tag,record_type(*values))
+    record_type,parser = decoder
+    return (tag,record_type(*parser(parts[1:],len(record_type._fields))))
+
+# ------------------------------------------------------------------------------
+# load_numpy() - import NumPy once, None when it is not installed
+# ------------------------------------------------------------------------------
+def load_numpy():
+    global numpy,numpy_loaded
+    if not numpy_loaded:
+        numpy_loaded = True
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+    return numpy
+
+# ------------------------------------------------------------------------------
+# RingBuffer(fields,capacity) - fixed-size per channel sample history
+# ------------------------------------------------------------------------------
+class RingBuffer:
+
+    def __init__(self,fields,capacity=TELEMETRY_HISTORY):
+        load_numpy()
+        self.fields = tuple(fields)
+        self.capacity = capacity
+        self.index = 0
+        self.count = 0
+        width = len(self.fields) + 1
+        # column 0 holds the receive timestamp
+        if numpy is not None:
+            self.data = numpy.zeros((capacity,width))
+        else:
+            self.data = [array.array('d',bytes(8 * capacity)) for _ in range(width)]
+
+    def __len__(self):
+        return self.count
+
+    # append(timestamp,values) - O(1), overwrites the oldest sample when full
+    def append(self,timestamp,values):
+        i = self.index
+        if numpy is not None:
+            row = self.data[i]
+            row[0] = timestamp
+            row[1:] = values
+        else:
+            columns = self.data
+            columns[0][i] = timestamp
+            for k,value in enumerate(values,1):
+                columns[k][i] = value
+        self.index = (i + 1) % self.capacity
+        if self.count < self.capacity: self.count += 1
+
+    # latest() - (timestamp,values) of the newest sample, or None
+    def latest(self):
+        if not self.count: return None
+        i = (self.index - 1) % self.capacity
+        if numpy is not None:
+            row = self.data[i]
+            return (float(row[0]),tuple(float(v) for v in row[1:]))
+        return (self.data[0][i],tuple(column[i] for column in self.data[1:]))
+
+    # _ordered(k) - column k in time order, oldest first
+    def _ordered(self,k):
+        if numpy is not None:
+            column = self.data[:,k]
+        else:
+            column = self.data[k]
+        if self.count < self.capacity:
+            return column[:self.count]
+        if numpy is not None:
+            return numpy.concatenate((column[self.index:],column[:self.index]))
+        return column[self.index:] + column[:self.index]
+
+    # window(field,seconds,now) - samples of field over the last seconds
+    def window(self,field,seconds=None,now=None):
+        values = self._ordered(self.fields.index(field) + 1)
+        if seconds is None: return values
+        if now is None: now = time.monotonic()
+        times = self._ordered(0)
+        if numpy is not None:
+            start = int(numpy.searchsorted(times,now - seconds))
+        else:
+            start = bisect.bisect_left(times,now - seconds)
+        return values[start:]
+
+    # stats(field,seconds,now) - (mean,min,max,count) over the last seconds
+    def stats(self,field,seconds=None,now=None):
+        values = self.window(field,seconds,now)
+        if numpy is not None:
+            values = values[~numpy.isnan(values)]
+            if not len(values): return (math.nan,math.nan,math.nan,0)
+            return (float(values.mean()),float(values.min()),float(values.max()),len(values))
+        values = [v for v in values if not math.isnan(v)]
+        if not values: return (math.nan,math.nan,math.nan,0)
+        return (sum(values) / len(values),min(values),max(values),len(values))
+
+# ------------------------------------------------------------------------------
+# TelemetryStore(capacity) - decoded telemetry history, one ring per tag
+# ------------------------------------------------------------------------------
+class TelemetryStore:
+
+    def __init__(self,capacity=TELEMETRY_HISTORY):
+        self.capacity = capacity
+        self.channels = {}
+        self.packets = 0
+        self.decode_errors = 0
+        # sentences over the auto-registration limits, also decode errors
+        self.rejected = 0
+
+    # ingest(datagram,now) - decode and store one datagram, returns (tag,record)
+    def ingest(self,datagram,now=None):
+        if now is None: now = time.monotonic()
+        self.packets += 1
+        try:
+            tag,record = decode_sentence(datagram)
+        except ValueError as e:
+            self.decode_errors += 1
+            if isinstance(e,TelemetryLimitError): self.rejected += 1
+            raise
+        ring = self.channels.get(tag)
+        if ring is None:
+            ring = self.channels[tag] = RingBuffer(record._fields,self.capacity)
+        ring.append(now,record)
+        return (tag,record)
+
+    # channel(tag) - ring buffer for a sentence tag, or None
+    def channel(self,tag):
+        if isinstance(tag,str): tag = tag.encode()
+        return self.channels.get(tag)
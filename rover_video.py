@@ -0,0 +1,865 @@
+# ##############################################################################
+#
+# Rover video relay
+#
+# Moves the camera stream from the video socket to the player pipe.
+#
+#   copy    recv_into() a preallocated buffer, os.write() a memoryview of it:
+#           no per-read allocation
+#   splice  os.splice() socket -> pipe: the payload stays in the kernel and
+#           never enters Python (Linux only, python >= 3.10)
+#   auto    splice when available, copy otherwise
+#
+# The optional low-latency relay parses the H.264 Annex-B stream into
+# access units and queues them in a bounded jitter buffer in front of the
+# player. When the queue exceeds its frame count or latency budget it first
+# drops non-reference frames, then skips ahead to the next IDR frame.
+#
+# A VideoRecorder attached as the relay tap gets a copy of every buffer read
+# from the socket and writes it to disk on its own thread. The relay never
+# waits for the disk: a full recorder queue drops data, not playback. While
+# a tap is attached a splice relay moves the data through the copy path, the
+# stream has to enter Python to be recorded.
+#
+# After a reconnection, attach() hands the relay the new socket. The relay
+# then discards the stream up to the next SPS, where the player's decoder
+# can pick up again, and the player keeps running across the outage.
+#
+# A StreamMonitor attached to the relay keeps rolling throughput, stall,
+# frame rate and inter-frame gap statistics. Throughput and stalls are
+# counted in every mode, frames only where the stream enters Python (copy
+# and low-latency). A BitrateController turns these statistics into encoder
+# level changes for the rover, with hysteresis.
+#
+# ##############################################################################
+
+import os                       # Operating system interface
+import time                     # Time acquisition and formatting
+import asyncio                  # Event loop integration
+import fcntl                    # Pipe fill level
+import termios                  # FIONREAD
+import struct                   # ioctl result
+import collections              # Jitter buffer queue
+import threading                # Recorder writer thread
+import rover_log                # Event log
+
+# Relay modes
+RELAY_MODE_AUTO = 'auto'
+RELAY_MODE_COPY = 'copy'
+RELAY_MODE_SPLICE = 'splice'
+
+# Default read size per syscall
+RELAY_READ_SIZE = 65536
+
+# Low-latency relay defaults
+JITTER_MAX_FRAMES = 8
+JITTER_LATENCY_BUDGET = 0.2
+
+# Video recorder defaults
+RECORD_SEGMENT_SIZE = 256 * 1024 * 1024
+RECORD_SEGMENT_TIME = 300
+RECORD_QUEUE_SIZE = 16 * 1024 * 1024
+RECORD_SUFFIX = '.h264'
+
+# Stream monitor: seconds of statistics kept, in buckets, and the gap
+# between two reads counted as a stall
+MONITOR_WINDOW = 5.0
+MONITOR_BUCKET = 0.25
+STALL_TIME = 0.5
+
+# Bitrate adaptation: step down below DOWN_RATIO of the level bitrate for
+# down_time seconds or on a stall, step up after up_time seconds at
+# UP_RATIO or more; a step up that fails within up_time doubles the wait
+# before the next one, up to UP_MAX_TIME. No change within HOLD_TIME of the
+# previous one, the encoder needs a moment to settle.
+ADAPT_DOWN_RATIO = 0.7
+ADAPT_UP_RATIO = 0.9
+ADAPT_DOWN_TIME = 3.0
+ADAPT_UP_TIME = 15.0
+ADAPT_UP_MAX_TIME = 240.0
+ADAPT_HOLD_TIME = 2.0
+ADAPT_LEVELS = '2000000,1000000:640x480,500000:640x480'
+ADAPT_COMMAND = 'video_bitrate {bitrate} {size}'
+
+# H.264 Annex-B start code and NAL unit types
+START_CODE = b'\x00\x00\x01'
+NAL_SLICE = 1
+NAL_IDR = 5
+NAL_SEI = 6
+NAL_SPS = 7
+NAL_PPS = 8
+NAL_AUD = 9
+
+# ------------------------------------------------------------------------------
+# wait_readable(fd) / wait_writable(fd) - suspend until fd is ready
+# ------------------------------------------------------------------------------
+async def wait_readable(fd):
+    loop = asyncio.get_running_loop()
+    await _wait_fd(loop.add_reader,loop.remove_reader,fd)
+
+async def wait_writable(fd):
+    loop = asyncio.get_running_loop()
+    await _wait_fd(loop.add_writer,loop.remove_writer,fd)
+
+async def _wait_fd(add,remove,fd):
+    future = asyncio.get_running_loop().create_future()
+    def ready():
+        if not future.done(): future.set_result(None)
+    add(fd,ready)
+    try:
+        await future
+    finally:
+        remove(fd)
+
+# ------------------------------------------------------------------------------
+# VideoRelay(sock,out_fd,read_size,mode)
+#
+# run() relays until the stream ends, attach(sock) prepares the next run()
+# on a new connection. Socket and pipe are non-blocking and
+# the relay runs on the asyncio event loop: a full player pipe suspends the
+# relay without blocking other channels, and cancelling the task stops it
+# immediately.
+# ------------------------------------------------------------------------------
+class VideoRelay:
+
+    def __init__(self,sock,out_fd,read_size=RELAY_READ_SIZE,mode=RELAY_MODE_AUTO):
+        if mode not in (RELAY_MODE_AUTO,RELAY_MODE_COPY,RELAY_MODE_SPLICE):
+            raise ValueError("unknown video relay mode: {}".format(mode))
+        if mode == RELAY_MODE_SPLICE and not hasattr(os,'splice'):
+            raise ValueError("video relay mode splice is not supported on this system")
+        if mode == RELAY_MODE_AUTO:
+            mode = RELAY_MODE_SPLICE if hasattr(os,'splice') else RELAY_MODE_COPY
+
+        self.sock = sock
+        self.out_fd = out_fd
+        self.read_size = read_size
+        self.mode = mode
+        self.buffer = bytearray(read_size)
+        self.view = memoryview(self.buffer)
+        # recorder getting a copy of the stream, set and cleared while running
+        self.tap = None
+        # stream statistics, optional
+        self.monitor = None
+        # discard the stream up to the next SPS
+        self.resync = False
+
+        # counters
+        self.bytes_total = 0
+        self.resync_bytes = 0
+        self.read_syscalls = 0
+        self.write_syscalls = 0
+        # player backpressure: waits for a full pipe and time spent waiting
+        self.pipe_stalls = 0
+        self.pipe_stall_time = 0.0
+        self._last_time = time.monotonic()
+        self._last_bytes = 0
+        self._last_syscalls = 0
+
+    # run() - relay until the video server closes the stream
+    async def run(self):
+        self.sock.setblocking(False)
+        os.set_blocking(self.out_fd,False)
+        # each loop returns True at end of stream, False to hand over to the
+        # other one when a tap is attached or removed
+        while True:
+            if self.mode == RELAY_MODE_SPLICE and self.tap is None and not self.resync:
+                try:
+                    if await self._run_splice(): return
+                    continue
+                except OSError as e:
+                    # socket/pipe pair the kernel refuses to splice
+                    if self.read_syscalls or isinstance(e,BrokenPipeError): raise
+                    self.mode = RELAY_MODE_COPY
+            if await self._run_copy(): return
+
+    async def _run_splice(self):
+        sock_fd = self.sock.fileno()
+        waited_read = False
+        while self.tap is None:
+            try:
+                n = os.splice(sock_fd,self.out_fd,self.read_size)
+            except BlockingIOError:
+                # nothing to read, or - right after the socket became
+                # readable - the player pipe is full
+                if waited_read:
+                    await self._wait_pipe()
+                    waited_read = False
+                else:
+                    await wait_readable(sock_fd)
+                    waited_read = True
+                continue
+            waited_read = False
+            self.read_syscalls += 1
+            if not n: return True
+            self.bytes_total += n
+            if self.monitor is not None: self.monitor.received(n)
+            await asyncio.sleep(0)
+        return False
+
+    async def _run_copy(self):
+        loop = asyncio.get_running_loop()
+        while self.tap is not None or self.mode != RELAY_MODE_SPLICE or self.resync:
+            n = await loop.sock_recv_into(self.sock,self.buffer)
+            self.read_syscalls += 1
+            if not n: return True
+            if self.monitor is not None:
+                self.monitor.received(n)
+                self.count_frames(n)
+            start = 0
+            if self.resync:
+                start = find_sps(self.buffer[:n])
+                if start < 0:
+                    self.resync_bytes += n
+                    continue
+                self.resync_bytes += start
+                self.resync = False
+            if self.tap is not None: self.tap.write(self.view[start:n])
+            await self.consume(self.view[start:n])
+            # a fast stream must not starve the other channels on the loop
+            await asyncio.sleep(0)
+        return False
+
+    # attach(sock) - continue on a new connection, from the next SPS; the
+    # recorder starts a new segment there
+    def attach(self,sock):
+        self.sock = sock
+        self.resync = True
+        if self.tap is not None: self.tap.gap()
+        if self.monitor is not None: self.monitor.reconnected()
+
+    # count_frames(n) - pictures starting in the first n bytes of the buffer
+    def count_frames(self,n):
+        self.monitor.parse(self.buffer,n)
+
+    # consume(data) - handle one read worth of stream data
+    async def consume(self,data):
+        await self.write(data)
+
+    # write(data) - write a buffer to the output, handling short writes
+    async def write(self,data):
+        written = 0
+        while written < len(data):
+            try:
+                written += os.write(self.out_fd,data[written:])
+            except BlockingIOError:
+                await self._wait_pipe()
+                continue
+            self.write_syscalls += 1
+        self.bytes_total += written
+
+    async def _wait_pipe(self):
+        start = time.monotonic()
+        self.pipe_stalls += 1
+        await wait_writable(self.out_fd)
+        self.pipe_stall_time += time.monotonic() - start
+
+    # pipe_fill() - bytes queued in the player pipe, None when unknown
+    def pipe_fill(self):
+        try:
+            return struct.unpack('i',fcntl.ioctl(self.out_fd,termios.FIONREAD,b'\0\0\0\0'))[0]
+        except OSError:
+            return None
+
+    @property
+    def syscalls_total(self):
+        return self.read_syscalls + self.write_syscalls
+
+    # a plain byte relay never drops anything
+    @property
+    def frames_dropped(self):
+        return 0
+
+    # close() - release resources held by the relay
+    def close(self):
+        pass
+
+    # rates() - (bytes/s, syscalls/s) since the previous call
+    def rates(self):
+        now = time.monotonic()
+        elapsed = max(now - self._last_time,1e-6)
+        byte_rate = (self.bytes_total - self._last_bytes) / elapsed
+        syscall_rate = (self.syscalls_total - self._last_syscalls) / elapsed
+        self._last_time = now
+        self._last_bytes = self.bytes_total
+        self._last_syscalls = self.syscalls_total
+        return (byte_rate,syscall_rate)
+
+# ------------------------------------------------------------------------------
+# NalSplitter() - split an Annex-B byte stream into NAL units
+# ------------------------------------------------------------------------------
+class NalSplitter:
+
+    def __init__(self):
+        self.buf = bytearray()
+        self.synced = False
+        self.scan = 3
+
+    # feed(data) - returns the NAL units completed by data, start code included
+    def feed(self,data):
+        buf = self.buf
+        buf += data
+
+        # discard anything before the first start code
+        if not self.synced:
+            i = buf.find(START_CODE)
+            if i < 0:
+                del buf[:-2]
+                return []
+            del buf[:i]
+            self.synced = True
+            self.scan = 3
+
+        nals = []
+        pos = 0
+        while True:
+            j = buf.find(START_CODE,self.scan)
+            if j < 0: break
+            nals.append(bytes(buf[pos:j]))
+            pos = j
+            self.scan = j + 3
+        if pos:
+            del buf[:pos]
+        # restart the next search just before the unscanned tail
+        self.scan = max(3,len(buf) - 2)
+        return nals
+
+    # flush() - the last, unterminated NAL unit at end of stream
+    def flush(self):
+        nals = [bytes(self.buf)] if self.synced and len(self.buf) > 3 else []
+        self.buf.clear()
+        self.synced = False
+        return nals
+
+# ------------------------------------------------------------------------------
+# AccessUnit() - one coded picture and the NAL units that precede it
+# ------------------------------------------------------------------------------
+class AccessUnit:
+
+    __slots__ = ('nals','time','idr','ref','slices')
+
+    def __init__(self):
+        self.nals = []
+        self.time = time.monotonic()
+        self.idr = False
+        self.ref = False
+        self.slices = 0
+
+    def __len__(self):
+        return sum(len(nal) for nal in self.nals)
+
+# ------------------------------------------------------------------------------
+# AccessUnitAssembler() - group NAL units into access units
+# ------------------------------------------------------------------------------
+class AccessUnitAssembler:
+
+    def __init__(self):
+        self.current = AccessUnit()
+
+    # feed(nal) - returns the access unit completed by nal, or None
+    def feed(self,nal):
+        header = nal[3] if len(nal) > 3 else 0
+        nal_type = header & 0x1F
+        nal_ref_idc = (header >> 5) & 0x03
+        current = self.current
+        done = None
+
+        if current.slices:
+            # access unit delimiter or parameter sets after a picture, or
+            # the first slice (first_mb_in_slice == 0) of a new picture
+            if nal_type in (NAL_AUD,NAL_SEI,NAL_SPS,NAL_PPS):
+                done = current
+            elif nal_type in (NAL_SLICE,NAL_IDR) and len(nal) > 4 and nal[4] & 0x80:
+                done = current
+        if done is not None:
+            current = self.current = AccessUnit()
+
+        current.nals.append(nal)
+        if nal_type in (NAL_SLICE,NAL_IDR):
+            current.slices += 1
+            if nal_type == NAL_IDR: current.idr = True
+            if nal_ref_idc: current.ref = True
+        return done
+
+    # flush() - the last access unit at end of stream, or None
+    def flush(self):
+        current = self.current
+        self.current = AccessUnit()
+        return current if current.slices else None
+
+# ------------------------------------------------------------------------------
+# JitterBuffer(max_frames,latency_budget) - bounded access unit queue
+# ------------------------------------------------------------------------------
+class JitterBuffer:
+
+    def __init__(self,max_frames=JITTER_MAX_FRAMES,latency_budget=JITTER_LATENCY_BUDGET):
+        self.max_frames = max_frames
+        self.latency_budget = latency_budget
+        self.frames = collections.deque()
+        # the decoder cannot start before an IDR frame anyway
+        self.skip_to_idr = True
+        self.frames_in = 0
+        self.frames_out = 0
+        self.dropped_nonref = 0
+        self.dropped_skip = 0
+
+    @property
+    def frames_dropped(self):
+        return self.dropped_nonref + self.dropped_skip
+
+    # put(au) - queue an access unit, enforcing the frame and latency limits
+    def put(self,au):
+        self.frames_in += 1
+        if self.skip_to_idr:
+            if not au.idr:
+                self.dropped_skip += 1
+                return
+            self.skip_to_idr = False
+        self.frames.append(au)
+        self._enforce(au.time)
+
+    def _over(self,now):
+        frames = self.frames
+        return len(frames) > self.max_frames or (frames and now - frames[0].time > self.latency_budget)
+
+    def _enforce(self,now):
+        if not self._over(now): return
+
+        # first: drop frames no other frame depends on
+        kept = collections.deque(au for au in self.frames if au.ref)
+        self.dropped_nonref += len(self.frames) - len(kept)
+        self.frames = kept
+        if not self._over(now): return
+
+        # then: restart from the newest queued IDR, or wait for the next one
+        for i in range(len(kept) - 1,0,-1):
+            if kept[i].idr:
+                for _ in range(i): kept.popleft()
+                self.dropped_skip += i
+                if not self._over(now): return
+                break
+        self.dropped_skip += len(kept)
+        kept.clear()
+        self.skip_to_idr = True
+
+    # get() - next access unit for the player, None when empty
+    def get(self):
+        if not self.frames: return None
+        self.frames_out += 1
+        return self.frames.popleft()
+
+# ------------------------------------------------------------------------------
+# LowLatencyRelay(sock,out_fd,read_size,max_frames,latency_budget)
+#
+# The receive side drains the socket as fast as it can and queues access
+# units, a writer task feeds the player from the jitter buffer. Backlog
+# therefore builds up in the bounded buffer, never in the socket.
+# ------------------------------------------------------------------------------
+class LowLatencyRelay(VideoRelay):
+
+    def __init__(self,sock,out_fd,read_size=RELAY_READ_SIZE,max_frames=JITTER_MAX_FRAMES,latency_budget=JITTER_LATENCY_BUDGET):
+        VideoRelay.__init__(self,sock,out_fd,read_size,RELAY_MODE_COPY)
+        self.mode = 'low-latency'
+        self.splitter = NalSplitter()
+        self.assembler = AccessUnitAssembler()
+        self.jitter = JitterBuffer(max_frames,latency_budget)
+        self.ready = None
+
+    @property
+    def frames_dropped(self):
+        return self.jitter.frames_dropped
+
+    # attach(sock) - the partial NAL unit and picture of the lost connection
+    # are discarded, queued pictures still play
+    def attach(self,sock):
+        VideoRelay.attach(self,sock)
+        self.splitter = NalSplitter()
+        self.assembler = AccessUnitAssembler()
+        self.jitter.skip_to_idr = True
+
+    async def run(self):
+        self.sock.setblocking(False)
+        os.set_blocking(self.out_fd,False)
+        self.ready = asyncio.Event()
+        reader = asyncio.ensure_future(self._run_copy())
+        writer = asyncio.ensure_future(self._write_loop())
+        try:
+            done,pending = await asyncio.wait((reader,writer),return_when=asyncio.FIRST_COMPLETED)
+            for task in done: task.result()
+            # stream ended: let the player have what is still queued
+            for nal in self.splitter.flush():
+                self._queue(self.assembler.feed(nal))
+            self._queue(self.assembler.flush())
+            while self.jitter.frames and not writer.done():
+                await asyncio.sleep(0.01)
+        finally:
+            reader.cancel()
+            writer.cancel()
+
+    async def consume(self,data):
+        for nal in self.splitter.feed(data):
+            self._queue(self.assembler.feed(nal))
+
+    # the assembler already tells pictures apart
+    def count_frames(self,n):
+        pass
+
+    def _queue(self,au):
+        if au is not None:
+            if self.monitor is not None: self.monitor.frame(au.time)
+            self.jitter.put(au)
+            self.ready.set()
+
+    async def _write_loop(self):
+        while True:
+            au = self.jitter.get()
+            if au is None:
+                self.ready.clear()
+                await self.ready.wait()
+                continue
+            for nal in au.nals:
+                await self.write(nal)
+
+# ------------------------------------------------------------------------------
+# StreamMonitor(window,stall_time) - rolling statistics of the incoming stream
+#
+# Counts go into MONITOR_BUCKET second buckets, stats() sums the buckets of
+# the last `window` seconds: nothing is kept per read or per frame.
+# ------------------------------------------------------------------------------
+class StreamMonitor:
+
+    def __init__(self,window=MONITOR_WINDOW,stall_time=STALL_TIME):
+        self.window = window
+        self.stall_time = stall_time
+        # [start, bytes, frames, largest frame gap, stalls, stall seconds]
+        self.buckets = collections.deque()
+        self.started = time.monotonic()
+        self.first_read = None
+        self.last_read = None
+        self.last_frame = None
+        self.framed = False
+        # totals
+        self.bytes_total = 0
+        self.frames_total = 0
+        self.stalls = 0
+        self.stall_time_total = 0.0
+        # end of the previous buffer, for start codes split across reads
+        self._tail = b''
+
+    def _bucket(self,now):
+        buckets = self.buckets
+        if not buckets or now - buckets[-1][0] >= MONITOR_BUCKET:
+            buckets.append([now,0,0,0.0,0,0.0])
+            while now - buckets[0][0] > self.window: buckets.popleft()
+        return buckets[-1]
+
+    # received(n,now) - n bytes read from the socket
+    def received(self,n,now=None):
+        if now is None: now = time.monotonic()
+        bucket = self._bucket(now)
+        bucket[1] += n
+        self.bytes_total += n
+        if self.last_read is not None and now - self.last_read >= self.stall_time:
+            bucket[4] += 1
+            bucket[5] += now - self.last_read
+            self.stalls += 1
+            self.stall_time_total += now - self.last_read
+        if self.first_read is None: self.first_read = now
+        self.last_read = now
+
+    # frame(now) - a picture started
+    def frame(self,now=None):
+        if now is None: now = time.monotonic()
+        bucket = self._bucket(now)
+        bucket[2] += 1
+        if self.last_frame is not None: bucket[3] = max(bucket[3],now - self.last_frame)
+        self.last_frame = now
+        self.frames_total += 1
+        self.framed = True
+
+    # parse(buffer,n) - count the pictures starting in buffer[:n]: slice NAL
+    # units with first_mb_in_slice 0. Searches the buffer in place.
+    def parse(self,buffer,n):
+        now = time.monotonic()
+        # start codes beginning in the previous read
+        edge = self._tail + bytes(buffer[:min(n,5)])
+        i = edge.find(START_CODE)
+        while 0 <= i < len(self._tail):
+            if i + 4 < len(edge) and edge[i + 3] & 0x1F in (NAL_SLICE,NAL_IDR) and edge[i + 4] & 0x80: self.frame(now)
+            i = edge.find(START_CODE,i + 1)
+        i = buffer.find(START_CODE,0,n)
+        while i >= 0:
+            if i + 4 < n and buffer[i + 3] & 0x1F in (NAL_SLICE,NAL_IDR) and buffer[i + 4] & 0x80: self.frame(now)
+            i = buffer.find(START_CODE,i + 3,n)
+        self._tail = bytes(buffer[max(0,n - 4):n])
+
+    # reset() - forget the statistics window, totals are kept
+    def reset(self):
+        self.buckets.clear()
+        self.started = time.monotonic()
+
+    # reconnected() - a new connection: the outage is not a stall
+    def reconnected(self):
+        self.reset()
+        self.last_read = None
+        self._tail = b''
+
+    # stats(now) - bits/s, frames/s (None when frames are not counted),
+    # largest frame gap, stalls and stall seconds over the window, and idle:
+    # seconds since the last read, an ongoing stall
+    def stats(self,now=None):
+        if now is None: now = time.monotonic()
+        span = min(self.window,now - self.started)
+        buckets = [b for b in self.buckets if now - b[0] <= self.window]
+        data = sum(b[1] for b in buckets)
+        frames = sum(b[2] for b in buckets)
+        return {
+            'span': span,
+            'bps': data * 8 / span if span > 0 else 0.0,
+            'fps': frames / span if self.framed and span > 0 else None,
+            'frame_gap': max((b[3] for b in buckets),default=0.0),
+            'stalls': sum(b[4] for b in buckets),
+            'stall_time': sum(b[5] for b in buckets),
+            'idle': now - (self.last_read if self.last_read is not None else self.started),
+        }
+
+# ------------------------------------------------------------------------------
+# parse_levels(spec) - encoder levels of 'bitrate[:WxH],...', best first:
+# [(bitrate,size)], size '' when the level keeps the resolution; raises
+# ValueError
+# ------------------------------------------------------------------------------
+def parse_levels(spec):
+    levels = []
+    for level in spec.split(','):
+        bitrate,sep,size = level.strip().partition(':')
+        bitrate = int(bitrate)
+        if bitrate <= 0: raise ValueError("bitrate not positive: {}".format(bitrate))
+        if sep:
+            width,x,height = size.partition('x')
+            if not (width.isdigit() and height.isdigit()): raise ValueError("size not WxH: {}".format(size))
+        levels.append((bitrate,size))
+    if [b for b,size in levels] != sorted((b for b,size in levels),reverse=True):
+        raise ValueError("levels not in decreasing bitrate order: {}".format(spec))
+    return levels
+
+# ------------------------------------------------------------------------------
+# BitrateController(levels,down_time,up_time) - encoder level from the
+# stream statistics
+#
+# update(stats,now) returns the level to ask the rover for, or None; the
+# caller reports the outcome with changed(level,now) or failed(now).
+# ------------------------------------------------------------------------------
+class BitrateController:
+
+    def __init__(self,levels,down_time=ADAPT_DOWN_TIME,up_time=ADAPT_UP_TIME):
+        self.levels = levels
+        self.down_time = down_time
+        self.up_time = up_time
+        self.level = 0
+        self.up_wait = up_time
+        self.low_since = None
+        self.good_since = None
+        self.changed_at = None
+        self.last_step = None
+        self.steps_down = 0
+        self.steps_up = 0
+
+    @property
+    def bitrate(self):
+        return self.levels[self.level][0]
+
+    def update(self,stats,now=None):
+        if now is None: now = time.monotonic()
+        if self.changed_at is not None and now - self.changed_at < ADAPT_HOLD_TIME: return None
+        # not enough of the stream seen since the last change
+        if stats['span'] < min(self.down_time,MONITOR_BUCKET * 4) and stats['idle'] < STALL_TIME: return None
+
+        stalled = stats['stalls'] > 0 or stats['idle'] >= STALL_TIME
+        low = stats['bps'] < ADAPT_DOWN_RATIO * self.bitrate
+        good = not stalled and stats['bps'] >= ADAPT_UP_RATIO * self.bitrate
+
+        self.low_since = (self.low_since or now) if low else None
+        self.good_since = (self.good_since or now) if good else None
+
+        if self.level < len(self.levels) - 1 and (stalled or (low and now - self.low_since >= self.down_time)):
+            return self.level + 1
+        if self.level > 0 and good and now - self.good_since >= self.up_wait:
+            return self.level - 1
+        # a level held for a while proves the link, steps up are tried at
+        # the normal pace again
+        if good and now - self.good_since >= self.up_wait: self.up_wait = self.up_time
+        return None
+
+    # changed(level,now) - the rover applied level
+    def changed(self,level,now=None):
+        if now is None: now = time.monotonic()
+        if level > self.level:
+            self.steps_down += 1
+            # the last step up did not hold: wait longer before the next one
+            if self.last_step == 'up' and now - self.changed_at < self.up_time:
+                self.up_wait = min(self.up_wait * 2,ADAPT_UP_MAX_TIME)
+            self.last_step = 'down'
+        elif level < self.level:
+            self.steps_up += 1
+            self.last_step = 'up'
+        self.level = level
+        self.changed_at = now
+        self.low_since = self.good_since = None
+
+    # failed(now) - the rover did not apply the level, retry after the hold
+    def failed(self,now=None):
+        self.changed_at = time.monotonic() if now is None else now
+
+# ------------------------------------------------------------------------------
+# find_sps(data,start) - offset of the first SPS NAL unit start code in data,
+# -1 when there is none
+# ------------------------------------------------------------------------------
+def find_sps(data,start=0):
+    i = data.find(START_CODE,start)
+    while 0 <= i < len(data) - 3:
+        if data[i + 3] & 0x1F == NAL_SPS:
+            # keep the leading zero of a 4-byte start code with its NAL unit
+            return i - 1 if i > 0 and data[i - 1] == 0 else i
+        i = data.find(START_CODE,i + 3)
+    return -1
+
+# ------------------------------------------------------------------------------
+# VideoRecorder(directory,segment_size,segment_time,queue_size)
+#
+# write() is called on the event loop with each buffer of the stream and
+# only queues a copy; a writer thread appends the queue to segment files.
+#
+# Drop policy: when queue_size bytes are already waiting for the disk, new
+# buffers are dropped and counted, queued data is kept. The segment being
+# written then ends, the next one starts at the next SPS, so every segment
+# is a stream a player can open. A segment is also closed at the first SPS
+# after segment_size bytes or segment_time seconds.
+#
+# A disk error (directory gone, disk full) ends the recording: error holds
+# the message, the queue is dropped and later buffers are ignored.
+# ------------------------------------------------------------------------------
+class VideoRecorder:
+
+    def __init__(self,directory,segment_size=RECORD_SEGMENT_SIZE,segment_time=RECORD_SEGMENT_TIME,queue_size=RECORD_QUEUE_SIZE):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.segment_time = segment_time
+        self.queue_size = queue_size
+        self.queue = collections.deque()
+        self.queued_bytes = 0
+        self.lock = threading.Condition()
+        self.closing = False
+        # counters
+        self.bytes_written = 0
+        self.bytes_dropped = 0
+        self.buffers_dropped = 0
+        self.queue_peak = 0
+        self.segments = 0
+        self.write_time = 0.0
+        self.path = None
+        self.error = None
+        self._file = None
+        self._segment_bytes = 0
+        self._segment_start = 0.0
+        os.makedirs(directory,exist_ok=True)
+        self.thread = threading.Thread(name='video-recorder',target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    # write(data) - queue a copy of data, never blocks
+    def write(self,data):
+        size = len(data)
+        with self.lock:
+            if self.closing: return
+            if self.queued_bytes + size > self.queue_size:
+                self.bytes_dropped += size
+                self.buffers_dropped += 1
+                # the segment on disk ends where the stream has a hole, one
+                # marker for a run of dropped buffers
+                if not self.queue or self.queue[-1] is not None: self.queue.append(None)
+                return
+            self.queue.append(bytes(data))
+            self.queued_bytes += size
+            self.queue_peak = max(self.queue_peak,self.queued_bytes)
+            self.lock.notify()
+
+    # gap() - the stream continues after a hole: the segment on disk ends,
+    # the next one starts at the next SPS
+    def gap(self):
+        with self.lock:
+            if self.closing: return
+            if not self.queue or self.queue[-1] is not None: self.queue.append(None)
+            self.lock.notify()
+
+    # close(wait) - write what is queued, then stop the writer thread
+    def close(self,wait=False):
+        with self.lock:
+            self.closing = True
+            self.lock.notify()
+        if wait: self.thread.join()
+
+    def _run(self):
+        try:
+            while True:
+                with self.lock:
+                    while not self.queue and not self.closing:
+                        self.lock.wait()
+                    if not self.queue: return
+                    data = self.queue.popleft()
+                    if data is not None: self.queued_bytes -= len(data)
+                if data is None:
+                    self._close_segment()
+                    continue
+                start = time.monotonic()
+                self._write(data)
+                self.write_time += time.monotonic() - start
+        except OSError as e:
+            self._failed(e)
+        finally:
+            try:
+                self._close_segment()
+            except OSError as e:
+                self._failed(e)
+
+    # _failed(e) - the disk failed: stop accepting buffers, drop the queue
+    def _failed(self,e):
+        with self.lock:
+            if self.error is None: self.error = str(e)
+            self.closing = True
+            self.bytes_dropped += self.queued_bytes
+            self.queued_bytes = 0
+            self.queue.clear()
+        self._file = None
+        rover_log.error('video',"recording in {} stopped: {}",self.directory,str(e))
+
+    def _write(self,data):
+        # start a segment at an SPS: after a gap, or once the current one is full
+        due = self._file is None or self._segment_bytes >= self.segment_size \
+            or time.monotonic() - self._segment_start >= self.segment_time
+        if due:
+            i = find_sps(data)
+            if i < 0:
+                if self._file is None: return
+            else:
+                if self._file is not None and i: self._append(data[:i])
+                self._close_segment()
+                self._open_segment()
+                data = data[i:]
+        self._append(data)
+
+    def _append(self,data):
+        self._file.write(data)
+        self._segment_bytes += len(data)
+        self.bytes_written += len(data)
+
+    def _open_segment(self):
+        self.segments += 1
+        name = "video-{}-{:03d}{}".format(time.strftime("%Y%m%d-%H%M%S"),self.segments,RECORD_SUFFIX)
+        self.path = os.path.join(self.directory,name)
+        self._file = open(self.path,'wb')
+        self._segment_bytes = 0
+        self._segment_start = time.monotonic()
+
+    def _close_segment(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
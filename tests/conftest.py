@@ -0,0 +1,19 @@
+# ##############################################################################
+#
+# Unit tests of the pure logic of the rover client modules
+#
+#   $ python3 -m pytest -q
+#
+# The modules sit at the top of the repository, next to this directory.
+#
+# ##############################################################################
+
+import os                       # Repository path
+import sys                      # Module search path
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import rover_log                # Event log
+
+# the event log of the modules stays off the test output
+rover_log.LOG.console = False
@@ -0,0 +1,99 @@
+# ##############################################################################
+#
+# rover_config: rover.conf parsing into fleet settings
+#
+# ##############################################################################
+
+import pytest
+import rover_config
+import rover_control
+import rover_system
+
+BASE = """\
+# ports every rover shares
+ROVER_IP = 192.168.99.1
+ROVER_SYSTEM_PORT = 10000
+ROVER_CONTROL_PORT = 10001
+ROVER_TELEMETRY_PORT = 10002
+CLIENT_TELEMETRY_PORT = 10003
+ROVER_VIDEO_PORT = 10004
+"""
+
+def load(tmp_path,text):
+    path = tmp_path / 'rover.conf'
+    path.write_text(BASE + text)
+    return rover_config.load_fleet(str(path))
+
+# error(tmp_path,text) - message of the ConfigError of a file
+def error(tmp_path,text):
+    with pytest.raises(rover_config.ConfigError) as e:
+        load(tmp_path,text)
+    return str(e.value)
+
+def test_defaults_and_conversions(tmp_path):
+    fleet = load(tmp_path,"CONTROL_MAX_RATE = 25\nGUI_SHOW_VIDEO = 0\n")
+    assert len(fleet) == 1
+    settings = fleet[0]
+    assert settings.NAME == rover_config.ROVER_DEFAULT_NAME
+    assert settings.ROVER_CONTROL_PORT == 10001
+    assert settings.CONTROL_MAX_RATE == 25.0 and settings.GUI_SHOW_VIDEO == 0
+    # the code defaults: raw system commands, csv control frames
+    assert settings.SYSTEM_PROTOCOL == rover_system.PROTOCOL_RAW
+    assert settings.CONTROL_FRAME_FORMAT == rover_control.FRAME_FORMAT_CSV
+    assert dict(settings.CONTROL_PROFILES) == dict(rover_control.DEFAULT_PROFILES)
+
+def test_rover_settings_override_the_shared_ones(tmp_path):
+    fleet = load(tmp_path,"ROVERS = scout, hauler\nhauler.ROVER_IP = 192.168.99.2\nhauler.CONTROL_MAX_RATE = 25\n")
+    scout,hauler = fleet
+    assert (scout.NAME,hauler.NAME) == ('scout','hauler')
+    assert scout.ROVERS == hauler.ROVERS == 'scout,hauler'
+    assert (scout.ROVER_IP,hauler.ROVER_IP) == ('192.168.99.1','192.168.99.2')
+    assert (scout.CONTROL_MAX_RATE,hauler.CONTROL_MAX_RATE) == (50,25.0)
+
+def test_profiles_of_a_rover_replace_the_shared_ones(tmp_path):
+    fleet = load(tmp_path,"ROVERS = scout,hauler\nPROFILE_fine = arcade expo=0.6\n"
+        "hauler.PROFILE_fine = tank\nhauler.CONTROL_PROFILE = fine\n")
+    scout,hauler = fleet
+    assert scout.CONTROL_PROFILES == (('legacy','legacy'),('fine','arcade expo=0.6'))
+    assert hauler.CONTROL_PROFILES == (('legacy','legacy'),('fine','tank'))
+    assert (scout.CONTROL_PROFILE,hauler.CONTROL_PROFILE) == ('legacy','fine')
+
+@pytest.mark.parametrize('text,message',[
+    ("CONTROL_MAX_RATE = fast\n",":8: CONTROL_MAX_RATE = fast: not a float"),
+    ("CONTROL_MAX_RATE = 0\n",":8: CONTROL_MAX_RATE = 0: not positive"),
+    ("SYSTEM_PROTOCOL = http\n",":8: SYSTEM_PROTOCOL = http"),
+    ("CONTROL_SPEED = 3\n",":8: unknown setting CONTROL_SPEED"),
+    ("ROVERS = scout\nhauler.ROVER_IP = 10.0.0.1\n",":9: unknown setting hauler.ROVER_IP"),
+    ("ROVERS = scout,scout\n","duplicate rover name"),
+    ("PROFILE_fine = arcade spin=1\n",":8: PROFILE_fine = arcade spin=1: unknown profile parameter"),
+    ("CONTROL_PROFILE = fine\n",":8: CONTROL_PROFILE = fine: no such profile"),
+    ("CONTROL_DELTA = 1\nCONTROL_DELTA = 2\n",":9: CONTROL_DELTA already set on line 8"),
+    ("CONTROL_DELTA\n",":8: expected NAME = value"),
+    ("VIDEO_ADAPTIVE = 1\n",":8: VIDEO_ADAPTIVE = 1: needs SYSTEM_PROTOCOL = framed"),
+])
+def test_errors_give_the_line(tmp_path,text,message):
+    assert message in error(tmp_path,text)
+
+def test_missing_setting(tmp_path):
+    path = tmp_path / 'rover.conf'
+    path.write_text("ROVER_IP = 192.168.99.1\n")
+    with pytest.raises(rover_config.ConfigError,match='missing setting ROVER_SYSTEM_PORT'):
+        rover_config.load_fleet(str(path))
+
+def test_load_settings_of_one_rover(tmp_path):
+    path = tmp_path / 'rover.conf'
+    path.write_text(BASE + "ROVERS = scout,hauler\n")
+    assert rover_config.load_settings(str(path)).NAME == 'scout'
+    assert rover_config.load_settings(str(path),'hauler').NAME == 'hauler'
+    with pytest.raises(rover_config.ConfigError):
+        rover_config.load_settings(str(path),'digger')
+
+def test_changes_lists_the_settings_that_differ(tmp_path):
+    before = load(tmp_path,"")[0]
+    after = load(tmp_path,"CONTROL_DELTA = 5\nLOG_LEVEL = debug\n")[0]
+    assert sorted(before.changes(after)) == ['CONTROL_DELTA','LOG_LEVEL']
+    assert before.changes(before) == []
+
+def test_shipped_rover_conf_loads():
+    fleet = rover_config.load_fleet(rover_config.os.path.join(rover_config.os.path.dirname(rover_config.__file__),'rover.conf'))
+    assert fleet and fleet[0].CONTROL_FRAME_FORMAT == rover_control.FRAME_FORMAT_CSV
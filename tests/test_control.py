@@ -0,0 +1,142 @@
+# ##############################################################################
+#
+# rover_control: transmit policy, drive profiles, reserved buttons
+#
+# ##############################################################################
+
+import pytest
+import rover_control
+
+MOVING = (0,60,0,60)
+STOP = rover_control.STOP_FRAME
+
+# ------------------------------------------------------------------------------
+# TransmitPolicy
+# ------------------------------------------------------------------------------
+
+def test_first_frame_is_sent():
+    policy = rover_control.TransmitPolicy(max_rate=50,delta=2,heartbeat=0.5)
+    assert policy.next_time() == 0.0
+    assert policy.update(STOP,now=10.0) == STOP
+    assert policy.last_kind == 'change'
+
+def test_change_below_delta_is_suppressed():
+    policy = rover_control.TransmitPolicy(max_rate=50,delta=2,heartbeat=0.5)
+    policy.update(MOVING,now=10.0)
+    assert policy.update((0,61,0,61),now=10.1) is None
+    assert policy.suppressed == 1
+    assert policy.update((0,62,0,60),now=10.2) == (0,62,0,60)
+    assert policy.sent_change == 2
+
+def test_change_sooner_than_max_rate_is_held_back():
+    policy = rover_control.TransmitPolicy(max_rate=10,delta=2,heartbeat=0.5)
+    policy.update(MOVING,now=10.0)
+    assert policy.update((0,80,0,80),now=10.05) is None
+    assert policy.pending
+    # woken at the end of the interval, the held back change goes out
+    assert policy.next_time() == pytest.approx(10.1)
+    assert policy.update((0,80,0,80),now=10.1) == (0,80,0,80)
+    assert not policy.pending
+
+def test_stop_is_sent_at_once():
+    policy = rover_control.TransmitPolicy(max_rate=10,delta=2,heartbeat=0.5)
+    policy.update(MOVING,now=10.0)
+    # within the max_rate interval
+    assert policy.update(STOP,now=10.01) == STOP
+    assert policy.last_kind == 'stop'
+    assert policy.sent_stop == 1
+    # a second stop is not a new stop
+    assert policy.update(STOP,now=10.02) is None
+
+def test_heartbeat_repeats_the_last_frame():
+    policy = rover_control.TransmitPolicy(max_rate=50,delta=2,heartbeat=0.5)
+    policy.update(MOVING,now=10.0)
+    assert policy.next_time() == pytest.approx(10.5)
+    assert policy.update((0,61,0,60),now=10.4) is None
+    # the small change is not sent, the last frame is
+    assert policy.update((0,61,0,60),now=10.5) == MOVING
+    assert policy.last_kind == 'heartbeat'
+    assert policy.sent_heartbeat == 1
+
+def test_configure_rejects_a_zero_rate():
+    with pytest.raises(ValueError):
+        rover_control.TransmitPolicy(max_rate=0)
+
+# ------------------------------------------------------------------------------
+# DriveProfile
+# ------------------------------------------------------------------------------
+
+def test_legacy_profile_matches_data_to_pwm():
+    profile = rover_control.DriveProfile.parse('legacy','legacy')
+    # on the lookup table steps
+    for a in (-1.0,-0.99,-0.5,0.0,0.42,0.98,0.99,1.0):
+        for b in (-1.0,-0.3,0.0,0.97,1.0):
+            assert profile.pwm(a,b) == rover_control.data_to_pwm(a,b)
+
+def test_tank_profile_deadzone_and_range():
+    profile = rover_control.DriveProfile.parse('tank','tank deadzone=0.1 min=20 max=60')
+    assert profile.pwm(0.0,0.0) == STOP
+    assert profile.pwm(-0.1,0.1) == STOP
+    # negative is forward, like the stick axes
+    assert profile.pwm(-1.0,1.0) == (60,0,0,60)
+    assert profile.pwm(-0.11,0.0) == (20,0,0,0)
+    # out of range axes are clamped
+    assert profile.pwm(-3.0,0.0) == (60,0,0,0)
+
+def test_expo_flattens_the_curve_around_centre():
+    linear = rover_control.DriveProfile('linear')
+    expo = rover_control.DriveProfile('expo',expo=1.0)
+    assert linear.pwm(-0.5,0.0) == (50,0,0,0)
+    assert expo.pwm(-0.5,0.0) == (13,0,0,0)
+    assert expo.pwm(-1.0,0.0) == (100,0,0,0)
+
+def test_trim_corrects_one_side():
+    profile = rover_control.DriveProfile('trim',trim=(0.0,-0.1))
+    assert profile.pwm(-0.5,-0.5) == (50,0,45,0)
+    assert profile.pwm(-1.0,-1.0) == (100,0,90,0)
+
+def test_arcade_profile_mixes_throttle_and_steering():
+    profile = rover_control.DriveProfile.parse('arcade','arcade')
+    assert profile.pwm(-1.0,0.0) == (100,0,100,0)
+    # full steering right while stopped spins on the spot, left side forward
+    assert profile.pwm(0.0,1.0) == (100,0,0,100)
+    # ratio kept when one side would exceed full speed
+    assert profile.pwm(-1.0,-0.5) == (33,0,100,0)
+
+def test_equal_frames_share_one_tuple():
+    profile = rover_control.DriveProfile('tank',deadzone=0.5).compile()
+    assert profile.pwm(0.1,0.2) is profile.pwm(-0.3,0.4)
+    assert len(profile.table) == rover_control.AXIS_STEPS ** 2
+
+@pytest.mark.parametrize('spec',['','spin','tank deadzone','tank speed=1','tank expo=fast','tank expo=2',
+    'tank deadzone=1','tank trim=0.6,0','tank trim=0.1','tank min=70 max=60','legacy expo=0.5'])
+def test_profile_parse_errors(spec):
+    with pytest.raises(ValueError):
+        rover_control.DriveProfile.parse('bad',spec)
+
+# ------------------------------------------------------------------------------
+# filter_buttons
+# ------------------------------------------------------------------------------
+
+RESERVED = (rover_control.SWITCH_BUTTON,rover_control.PROFILE_BUTTON)
+
+# buttons(kind,*down) - button message of an event kind, buttons down held
+def buttons(kind,*down):
+    return ",".join([str(kind)] + ['1' if b in down else '0' for b in range(rover_control.JOYSTICK_BUTTONS)])
+
+def test_reserved_button_edges_are_not_forwarded():
+    switch,profile = RESERVED
+    assert rover_control.filter_buttons(buttons(1539,switch),RESERVED,[switch]) == ""
+    assert rover_control.filter_buttons(buttons(1540),RESERVED,[switch]) == ""
+    assert rover_control.filter_buttons(buttons(1540,switch),RESERVED,[profile,profile]) == ""
+
+def test_other_buttons_of_the_batch_are_forwarded():
+    switch,profile = RESERVED
+    # pressed with a reserved button, or while one is held down
+    assert rover_control.filter_buttons(buttons(1539,0,switch),RESERVED,[switch,0]) == buttons(1539,0)
+    assert rover_control.filter_buttons(buttons(1540,profile),RESERVED,[2]) == buttons(1540)
+    assert rover_control.filter_buttons(buttons(1539,2),RESERVED,[2]) == buttons(1539,2)
+
+def test_hat_messages_are_unchanged():
+    assert rover_control.filter_buttons('1538,1,0',RESERVED,[rover_control.SWITCH_BUTTON]) == '1538,1,0'
+    assert rover_control.filter_buttons('',RESERVED,[]) == ''
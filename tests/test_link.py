@@ -0,0 +1,55 @@
+# ##############################################################################
+#
+# rover_link: link prober on the loopback interface
+#
+# ##############################################################################
+
+import asyncio
+import socket
+import rover_link
+import rover_net
+
+# probe(prober,seconds) - link state after the prober has run for seconds
+def probe(prober,seconds):
+    async def run():
+        task = asyncio.ensure_future(prober.run())
+        try:
+            await asyncio.sleep(seconds)
+            return prober.state()
+        finally:
+            task.cancel()
+            await asyncio.gather(task,return_exceptions=True)
+    return asyncio.run(run())
+
+def test_loopback_answers_probes():
+    # ICMP echo when the user may open ICMP sockets, the UDP echo service
+    # otherwise
+    echo = socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
+    echo.bind(('127.0.0.1',0))
+    echo.setblocking(False)
+    prober = rover_link.LinkProber('127.0.0.1',interval=0.02,timeout=0.5,udp_port=echo.getsockname()[1])
+    async def run():
+        loop = asyncio.get_running_loop()
+        def reply():
+            data,addr = echo.recvfrom(512)
+            echo.sendto(data,addr)
+        loop.add_reader(echo.fileno(),reply)
+        task = asyncio.ensure_future(prober.run())
+        try:
+            return await prober.wait_state()
+        finally:
+            task.cancel()
+            await asyncio.gather(task,return_exceptions=True)
+            loop.remove_reader(echo.fileno())
+    state = asyncio.run(run())
+    echo.close()
+    assert state.up and state.method in ('icmp','udp') and state.rtt < 0.5
+
+def test_socket_error_counts_as_lost_and_backs_off(monkeypatch):
+    monkeypatch.setattr(rover_net,'RECONNECT_BASE_DELAY',0.01)
+    # no such address: connect() fails for ICMP and UDP alike
+    prober = rover_link.LinkProber('0.0.0.256',interval=0.02)
+    state = probe(prober,0.2)
+    assert state.up is False and state.loss == 1.0
+    assert prober.reconnect.failures > 1 and prober.reconnect.state == rover_net.STATE_BACKOFF
+    assert prober._socket is None
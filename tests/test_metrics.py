@@ -0,0 +1,78 @@
+# ##############################################################################
+#
+# rover_metrics: round-trip latency histogram
+#
+# ##############################################################################
+
+import io
+import random
+import pytest
+import rover_metrics
+
+# the same values on every run
+rng = random.Random(19)
+
+# ------------------------------------------------------------------------------
+# HdrHistogram
+# ------------------------------------------------------------------------------
+
+def test_buckets_cover_every_value_once():
+    histogram = rover_metrics.HdrHistogram()
+    previous = -1
+    for us in list(range(4096)) + [rng.randrange(4096,60000000) for _ in range(2000)]:
+        i = histogram.index(us)
+        assert histogram.lowest(i) <= us <= histogram.highest_equivalent(i)
+        # a bucket is less than 1 / 2^sub_bits of its values wide
+        assert histogram.highest_equivalent(i) - histogram.lowest(i) <= us / histogram.sub_count
+        if us < 4096:
+            assert i >= previous
+            previous = i
+
+def test_percentiles_within_one_percent():
+    histogram = rover_metrics.HdrHistogram(window=60.0)
+    values = [rng.uniform(0.0005,0.5) for _ in range(20000)]
+    for v in values: histogram.record(v,now=100.0)
+    values.sort()
+    for p,measured in zip((50,90,99,99.9),histogram.percentiles((50,90,99,99.9),now=100.0)):
+        exact = values[max(0,int(p / 100 * len(values) + 0.999999) - 1)]
+        assert measured == pytest.approx(exact,rel=0.01)
+
+def test_percentiles_of_an_empty_window():
+    histogram = rover_metrics.HdrHistogram(window=60.0)
+    assert histogram.percentiles() is None
+    assert histogram.summary() == {'count':0}
+
+def test_summary_and_exact_max():
+    histogram = rover_metrics.HdrHistogram(window=60.0)
+    for ms in (1,2,3,4,1000): histogram.record(ms / 1000,now=10.0)
+    summary = histogram.summary(now=10.0)
+    assert summary['count'] == 5
+    assert summary['mean'] == pytest.approx(0.202)
+    assert summary['p50'] == pytest.approx(0.003,rel=0.01)
+    assert summary['max'] == 1.0 and summary['p99.9'] == 1.0
+
+def test_old_slices_leave_the_window():
+    histogram = rover_metrics.HdrHistogram(window=6.0,slices=6)
+    histogram.record(0.5,now=0.0)
+    histogram.record(0.001,now=3.0)
+    assert histogram.summary(now=5.0)['count'] == 2
+    assert histogram.summary(now=7.0)['count'] == 1
+    assert histogram.percentiles((100,),now=7.0) == [0.001]
+    assert histogram.total == 2
+
+def test_values_are_clamped_to_the_range():
+    histogram = rover_metrics.HdrHistogram(window=60.0,highest=1.0)
+    histogram.record(-0.5,now=0.0)
+    histogram.record(30.0,now=0.0)
+    assert histogram.percentiles((0,100),now=0.0) == [0.0,1.0]
+
+def test_export_ends_at_percentile_one():
+    histogram = rover_metrics.HdrHistogram(window=60.0)
+    for ms in range(1,101): histogram.record(ms / 1000,now=0.0)
+    f = io.StringIO()
+    histogram.export(f,now=0.0)
+    lines = f.getvalue().splitlines()
+    assert lines[0].split() == ['Value','Percentile','TotalCount','1/(1-Percentile)']
+    last = lines[-3].split()
+    assert float(last[0]) == pytest.approx(100.0) and float(last[1]) == 1.0 and last[2] == '100'
+    assert lines[-2].startswith('#[Mean') and 'Count' in lines[-2]
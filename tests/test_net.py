@@ -0,0 +1,85 @@
+# ##############################################################################
+#
+# rover_net: batched datagram receiver on the loopback interface
+#
+# ##############################################################################
+
+import asyncio
+import socket
+import pytest
+import rover_net
+
+# receive(datagrams,later,handler,**options) - the receiver, data handled
+# and the errors reported; datagrams are all sent before the loop reads any,
+# later ones once they are read. handler(data) runs before data is recorded
+def receive(datagrams,later=(),handler=None,**options):
+    handled = []
+    lost = []
+
+    def received(data,addr,now):
+        if handler: handler(data)
+        handled.append((data,addr))
+
+    # settle(receiver) - until a wait brings nothing more
+    async def settle(receiver):
+        count = -1
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if receiver.wakeups and receiver.datagrams + receiver.truncated == count: return
+            count = receiver.datagrams + receiver.truncated
+
+    async def run():
+        receiver = rover_net.DatagramReceiver(received,lost.append,**options)
+        receiver.open(('127.0.0.1',0))
+        port = receiver.sock.getsockname()[1]
+        with socket.socket(socket.AF_INET,socket.SOCK_DGRAM) as sender:
+            sender.bind(('127.0.0.1',0))
+            for data in datagrams: sender.sendto(data,('127.0.0.1',port))
+            await settle(receiver)
+            if later:
+                for data in later: sender.sendto(data,('127.0.0.1',port))
+                await settle(receiver)
+            receiver.close()
+            return receiver,sender.getsockname()
+
+    receiver,sender = asyncio.run(run())
+    assert all(addr == sender for data,addr in handled)
+    return receiver,[data for data,addr in handled],lost
+
+def test_datagrams_are_handled_in_order():
+    datagrams = [b'$MOT,%d,%d' % (i,i) for i in range(100)]
+    receiver,handled,lost = receive(datagrams)
+    assert handled == datagrams and not lost
+    assert receiver.datagrams == 100 and receiver.errors == 0
+    assert receiver.process_time > 0
+    assert receiver.sock is None
+
+def test_datagrams_are_read_in_batches():
+    receiver,handled,lost = receive([b'$MOT,1'] * 10,batch=4)
+    assert len(handled) == 10
+    assert receiver.wakeups == 3
+    assert receiver.reset_batch() == 4 and receiver.max_batch == 0
+
+@pytest.mark.skipif(not hasattr(socket,'CMSG_SPACE'),reason="no recvmsg")
+def test_truncated_datagrams_are_dropped():
+    receiver,handled,lost = receive([b'x' * 100,b'$MOT,1'],size=64)
+    assert handled == [b'$MOT,1']
+    assert receiver.truncated == 1
+
+def test_kernel_drops_are_counted():
+    # the drop count comes with the next datagram queued
+    receiver,handled,lost = receive([bytes(1000)] * 500,[b'$MOT,1'],rcvbuf=4096)
+    if not receiver.overflow: pytest.skip("no SO_RXQ_OVFL")
+    assert receiver.rcvbuf < 500 * 1000
+    assert handled[-1] == b'$MOT,1'
+    assert receiver.kernel_drops == 501 - len(handled) > 0
+
+def test_handler_error_does_not_end_the_batch():
+    def handler(data):
+        if data == b'bad': raise ValueError("bad datagram")
+    datagrams = [b'$MOT,1',b'bad',b'$MOT,2']
+    receiver,handled,lost = receive(datagrams,handler=handler)
+    assert handled == [b'$MOT,1',b'$MOT,2'] and not lost
+    assert receiver.wakeups == 1 and receiver.datagrams == 3
+    assert receiver.handler_errors == 1 and receiver.errors == 0
+    assert receiver.process_time > 0
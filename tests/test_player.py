@@ -0,0 +1,55 @@
+# ##############################################################################
+#
+# rover_player: standby decoder and the end of stream
+#
+# ##############################################################################
+
+import os
+import threading
+import pytest
+import rover_player
+
+# start(player) - the decoder thread on a pipe, without PyAV: a stream that
+# ends before any data never reaches the codec
+def start(player):
+    read_fd,player.fd = os.pipe()
+    player._thread = threading.Thread(target=player._run,args=(read_fd,None),daemon=True)
+    player._thread.start()
+    return player
+
+@pytest.fixture(autouse=True)
+def decoder_without_av(monkeypatch):
+    monkeypatch.setattr(rover_player.DecoderPlayer,'start',start)
+
+# end(player) - closes the stream and waits for the decoder thread
+def end(player):
+    player.close()
+    player._thread.join(5)
+    assert not player.alive()
+
+def test_closed_standby_does_not_end_the_stream():
+    posted = []
+    standby = rover_player.StandbyPlayer()
+    player = standby.prepare(rover_player.DecoderPlayer(posted.append,'scout'))
+    standby.close()
+    end(player)
+    assert posted == []
+
+def test_replaced_standby_does_not_end_the_stream():
+    posted = []
+    standby = rover_player.StandbyPlayer()
+    old = standby.prepare(rover_player.DecoderPlayer(posted.append,'scout'))
+    standby.prepare(rover_player.DecoderPlayer(posted.append,'hauler'))
+    old._thread.join(5)
+    assert not old.alive() and posted == []
+    standby.close()
+
+def test_taken_standby_ends_the_stream_of_its_channel():
+    standby_posted = []
+    posted = []
+    standby = rover_player.StandbyPlayer()
+    prepared = standby.prepare(rover_player.DecoderPlayer(standby_posted.append,'scout'))
+    player = standby.take(rover_player.DecoderPlayer(posted.append,'scout'))
+    assert player is prepared and standby.hits == 1
+    end(player)
+    assert posted == [None] and standby_posted == []
@@ -0,0 +1,103 @@
+# ##############################################################################
+#
+# rover_recorder: telemetry log files written and read back
+#
+# ##############################################################################
+
+import errno
+import glob
+import os
+import threading
+import pytest
+import rover_recorder
+
+FILE_SIZE = rover_recorder.DATA_START + 80000
+
+def datagram(i):
+    return '$MOT,{},{}'.format(i % 100,i).encode()
+
+def record(directory,count,step=0.01,index_interval=0.1):
+    recorder = rover_recorder.TelemetryRecorder(str(directory),FILE_SIZE,index_interval)
+    for i in range(count):
+        # the next file is prepared on a thread, not waited for by record()
+        recorder.ready()
+        assert recorder.record(100.0 + i * step,datagram(i))
+    recorder.close(wait=True)
+    return recorder,sorted(glob.glob(os.path.join(str(directory),'*' + rover_recorder.LOG_SUFFIX)))
+
+def test_recorder_rejects_a_file_too_small_for_a_datagram(tmp_path):
+    with pytest.raises(ValueError):
+        rover_recorder.TelemetryRecorder(str(tmp_path),rover_recorder.DATA_START + 1000)
+
+def test_records_round_trip_across_files(tmp_path):
+    recorder,paths = record(tmp_path,10000)
+    assert recorder.files == len(paths) > 1
+    logs = rover_recorder.open_session(paths)
+    try:
+        records = list(rover_recorder.session_records(logs))
+        assert len(records) == 10000
+        assert [bytes(data) for _,data in records] == [datagram(i) for i in range(10000)]
+        assert records[-1][0] == pytest.approx(99.99)
+    finally:
+        for log in logs: log.close()
+
+def test_closed_files_are_shrunk_to_their_records(tmp_path):
+    recorder,paths = record(tmp_path,100)
+    log = rover_recorder.TelemetryLog(paths[0])
+    try:
+        assert os.path.getsize(paths[0]) == log.end < FILE_SIZE
+        assert log.first_time() == 100.0
+        assert log.last_time() == pytest.approx(100.99)
+    finally:
+        log.close()
+
+def test_records_between_start_and_end(tmp_path):
+    recorder,paths = record(tmp_path,3000)
+    logs = rover_recorder.open_session(paths)
+    try:
+        records = list(rover_recorder.session_records(logs,start=10.0,end=12.0))
+        assert len(records) == pytest.approx(200,abs=1)
+        assert all(10.0 - 1e-9 <= t < 12.0 for t,_ in records)
+        assert bytes(records[0][1]) == datagram(round(records[0][0] * 100))
+    finally:
+        for log in logs: log.close()
+
+def test_log_rejects_other_files(tmp_path):
+    path = tmp_path / 'other.rtl'
+    path.write_bytes(b'\0' * 4096)
+    with pytest.raises(ValueError):
+        rover_recorder.TelemetryLog(str(path))
+
+def test_datagrams_are_dropped_until_a_file_is_ready(tmp_path,monkeypatch):
+    allowed = threading.Event()
+    create_file = rover_recorder.create_file
+    def slow_create_file(path,file_size):
+        allowed.wait(5)
+        return create_file(path,file_size)
+    monkeypatch.setattr(rover_recorder,'create_file',slow_create_file)
+    recorder = rover_recorder.TelemetryRecorder(str(tmp_path),FILE_SIZE)
+    assert not recorder.record(100.0,datagram(0))
+    allowed.set()
+    recorder.ready()
+    assert recorder.record(100.1,datagram(1))
+    recorder.close(wait=True)
+    assert (recorder.dropped,recorder.records,recorder.files) == (1,1,1)
+    assert len(glob.glob(os.path.join(str(tmp_path),'*' + rover_recorder.LOG_SUFFIX))) == 1
+
+def test_full_disk_ends_the_recording(tmp_path,monkeypatch):
+    def posix_fallocate(fd,offset,length):
+        raise OSError(errno.ENOSPC,os.strerror(errno.ENOSPC))
+    monkeypatch.setattr(os,'posix_fallocate',posix_fallocate,raising=False)
+    recorder = rover_recorder.TelemetryRecorder(str(tmp_path),FILE_SIZE)
+    recorder.ready()
+    assert not recorder.record(100.0,datagram(0))
+    assert recorder.error is not None and recorder.files == 0
+    # no sparse file left behind, later datagrams are ignored
+    assert os.listdir(str(tmp_path)) == []
+    assert not recorder.record(100.1,datagram(1))
+    recorder.close(wait=True)
+
+def test_sparse_file_without_posix_fallocate(tmp_path,monkeypatch):
+    monkeypatch.delattr(os,'posix_fallocate',raising=False)
+    recorder,paths = record(tmp_path,10)
+    assert recorder.error is None and len(paths) == 1
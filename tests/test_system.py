@@ -0,0 +1,104 @@
+# ##############################################################################
+#
+# rover_system: framed system commands against a loopback rover
+#
+# ##############################################################################
+
+import asyncio
+import socket
+import time
+import pytest
+import rover_system
+
+# serve(handler,test) - runs test(link) with a link started on a loopback
+# server whose connections go to handler(reader,writer)
+def serve(handler,test,timeout=1.0):
+    async def run():
+        server = await asyncio.start_server(handler,'127.0.0.1',0)
+        link = rover_system.SystemLink('127.0.0.1',server.sockets[0].getsockname()[1],rover_system.PROTOCOL_FRAMED,timeout)
+        task = asyncio.ensure_future(link.run())
+        try:
+            return await test(link)
+        finally:
+            task.cancel()
+            server.close()
+    return asyncio.run(run())
+
+# free_port() - a loopback port nobody listens on
+def free_port():
+    with socket.socket(socket.AF_INET,socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1',0))
+        return s.getsockname()[1]
+
+async def echo(reader,writer):
+    try:
+        while True:
+            frame_type,command_id,status,payload = await rover_system.read_frame(reader)
+            writer.write(rover_system.encode_frame(rover_system.FRAME_TYPE_REPLY,command_id,0,b'done ' + payload))
+            await writer.drain()
+    except asyncio.IncompleteReadError:
+        writer.close()
+
+async def silent(reader,writer):
+    await asyncio.sleep(10)
+
+def test_frame_round_trip():
+    frame = rover_system.encode_frame(rover_system.FRAME_TYPE_REQUEST,7,0,'reboot é'.encode())
+    async def read():
+        reader = asyncio.StreamReader()
+        reader.feed_data(frame)
+        return await rover_system.read_frame(reader)
+    assert asyncio.run(read()) == (rover_system.FRAME_TYPE_REQUEST,7,0,'reboot é'.encode())
+
+def test_request_at_start_up_waits_for_the_connection():
+    async def test(link):
+        replies = await asyncio.gather(link.request('ping'),link.request('status'))
+        return [(reply.status,reply.output) for reply in replies]
+    assert serve(echo,test) == [(0,'done ping'),(0,'done status')]
+
+def test_raw_command_is_sent_unconfirmed():
+    received = []
+    async def run():
+        done = asyncio.get_running_loop().create_future()
+        async def handler(reader,writer):
+            received.append(await reader.read())
+            writer.close()
+            done.set_result(None)
+        server = await asyncio.start_server(handler,'127.0.0.1',0)
+        link = rover_system.SystemLink('127.0.0.1',server.sockets[0].getsockname()[1],rover_system.PROTOCOL_RAW,1.0)
+        try:
+            reply = await link.request('reboot')
+            await asyncio.wait_for(done,1.0)
+            return reply
+        finally:
+            server.close()
+    reply = asyncio.run(run())
+    assert reply.status is rover_system.STATUS_UNCONFIRMED and reply.output == ''
+    assert received == [b'reboot']
+
+def test_request_without_rover_fails_at_once():
+    async def run():
+        link = rover_system.SystemLink('127.0.0.1',free_port(),rover_system.PROTOCOL_FRAMED,5.0)
+        task = asyncio.ensure_future(link.run())
+        try:
+            start = time.monotonic()
+            with pytest.raises(rover_system.NotConnectedError):
+                await link.request('ping')
+            # then in backoff, without waiting for the next attempt
+            with pytest.raises(rover_system.NotConnectedError):
+                await link.request('ping')
+            return time.monotonic() - start
+        finally:
+            task.cancel()
+    assert asyncio.run(run()) < 1.0
+
+def test_stalled_write_counts_in_the_timeout():
+    async def test(link):
+        await asyncio.sleep(0.1)
+        start = time.monotonic()
+        # far more than the socket buffers hold, the rover never reads
+        with pytest.raises(asyncio.TimeoutError):
+            await link.request('x' * 50000000)
+        assert not link.pending
+        return time.monotonic() - start
+    assert serve(silent,test,timeout=0.5) < 2.0
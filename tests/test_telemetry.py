@@ -0,0 +1,123 @@
+# ##############################################################################
+#
+# rover_telemetry: sentence decoding, ring buffers, telemetry store
+#
+# ##############################################################################
+
+import math
+import pytest
+import rover_telemetry
+
+# the decoders registered by a test are forgotten after it
+@pytest.fixture(autouse=True)
+def decoders(monkeypatch):
+    monkeypatch.setattr(rover_telemetry,'DECODERS',dict(rover_telemetry.DECODERS))
+    monkeypatch.setattr(rover_telemetry,'AUTO_TAGS',set())
+
+# ring buffers on NumPy when installed, and on array.array
+@pytest.fixture(params=['array','numpy'])
+def backend(request,monkeypatch):
+    numpy = pytest.importorskip('numpy') if request.param == 'numpy' else None
+    monkeypatch.setattr(rover_telemetry,'numpy',numpy)
+    monkeypatch.setattr(rover_telemetry,'numpy_loaded',True)
+    return request.param
+
+# ------------------------------------------------------------------------------
+# decode_sentence
+# ------------------------------------------------------------------------------
+
+def test_decode_known_sentence():
+    tag,record = rover_telemetry.decode_sentence(b'$MOT,42,7\r\n')
+    assert tag == b'$MOT'
+    assert record.motor == 42.0 and record.frame_id == 7.0
+
+def test_decode_missing_fields_are_nan():
+    tag,record = rover_telemetry.decode_sentence(b'$MOT,42')
+    assert record.motor == 42.0 and math.isnan(record.frame_id)
+    tag,record = rover_telemetry.decode_sentence(b'$MOT,,3')
+    assert math.isnan(record.motor) and record.frame_id == 3.0
+
+@pytest.mark.parametrize('datagram',[b'MOT,1',b'$MOT',b'',b'$MOT,fast'])
+def test_decode_rejects_malformed_sentences(datagram):
+    with pytest.raises(ValueError):
+        rover_telemetry.decode_sentence(datagram)
+
+def test_decode_registered_sentence():
+    rover_telemetry.register_decoder('$BAT',('volts','amps'))
+    tag,record = rover_telemetry.decode_sentence(b'$BAT,12.5,1.25,99')
+    assert type(record).__name__ == 'BAT'
+    assert record == (12.5,1.25)
+
+def test_decode_unknown_sentence_registers_numbered_fields():
+    tag,record = rover_telemetry.decode_sentence(b'$IMU,1,2,3')
+    assert record._fields == ('f1','f2','f3')
+    assert rover_telemetry.AUTO_TAGS == {b'$IMU'}
+
+def test_decode_unknown_sentences_over_the_limits(monkeypatch):
+    monkeypatch.setattr(rover_telemetry,'AUTO_TAGS_MAX',2)
+    monkeypatch.setattr(rover_telemetry,'AUTO_FIELDS_MAX',3)
+    with pytest.raises(rover_telemetry.TelemetryLimitError):
+        rover_telemetry.decode_sentence(b'$WIDE,1,2,3,4')
+    rover_telemetry.decode_sentence(b'$A,1')
+    rover_telemetry.decode_sentence(b'$B,1')
+    with pytest.raises(rover_telemetry.TelemetryLimitError):
+        rover_telemetry.decode_sentence(b'$C,1')
+    # known and already registered tags still decode
+    rover_telemetry.decode_sentence(b'$A,2')
+    rover_telemetry.decode_sentence(b'$MOT,2')
+    assert b'$C' not in rover_telemetry.DECODERS and b'$WIDE' not in rover_telemetry.DECODERS
+
+def test_decode_garbage_does_not_take_a_tag_slot(monkeypatch):
+    monkeypatch.setattr(rover_telemetry,'AUTO_TAGS_MAX',1)
+    for datagram in (b'$X1,abc',b'$X2,1,\xff',b'$1X,1'):
+        with pytest.raises(ValueError) as e:
+            rover_telemetry.decode_sentence(datagram)
+        assert not isinstance(e.value,rover_telemetry.TelemetryLimitError)
+    assert rover_telemetry.AUTO_TAGS == set()
+    assert not [tag for tag in rover_telemetry.DECODERS if tag != b'$MOT']
+    tag,record = rover_telemetry.decode_sentence(b'$IMU,1')
+    assert record == (1.0,)
+
+# ------------------------------------------------------------------------------
+# RingBuffer
+# ------------------------------------------------------------------------------
+
+def test_ring_buffer_keeps_the_newest_samples(backend):
+    ring = rover_telemetry.RingBuffer(('a','b'),capacity=4)
+    assert ring.latest() is None
+    for i in range(6): ring.append(float(i),(i * 10.0,-i))
+    assert len(ring) == 4
+    assert ring.latest() == (5.0,(50.0,-5.0))
+    assert list(ring.window('a')) == [20.0,30.0,40.0,50.0]
+
+def test_ring_buffer_window_and_stats(backend):
+    ring = rover_telemetry.RingBuffer(('a',),capacity=8)
+    for i in range(5): ring.append(float(i),(float(i),))
+    ring.append(5.0,(math.nan,))
+    assert list(ring.window('a',seconds=2,now=5.0)[:2]) == [3.0,4.0]
+    # NaN samples are left out of the statistics
+    assert ring.stats('a',seconds=2,now=5.0) == (3.5,3.0,4.0,2)
+    assert ring.stats('a',seconds=0.5,now=5.0)[3] == 0
+
+# ------------------------------------------------------------------------------
+# TelemetryStore
+# ------------------------------------------------------------------------------
+
+def test_store_counts_packets_and_errors(backend):
+    store = rover_telemetry.TelemetryStore(capacity=16)
+    store.ingest(b'$MOT,1,1',now=1.0)
+    store.ingest(b'$MOT,2,2',now=2.0)
+    with pytest.raises(ValueError):
+        store.ingest(b'garbage',now=3.0)
+    assert store.packets == 3 and store.decode_errors == 1 and store.rejected == 0
+    assert len(store.channel('$MOT')) == 2
+    assert store.channel('$BAT') is None
+
+def test_store_drops_sentences_over_the_limits(backend,monkeypatch):
+    monkeypatch.setattr(rover_telemetry,'AUTO_TAGS_MAX',1)
+    store = rover_telemetry.TelemetryStore(capacity=16)
+    store.ingest(b'$A,1',now=1.0)
+    with pytest.raises(rover_telemetry.TelemetryLimitError):
+        store.ingest(b'$B,1',now=1.0)
+    assert store.rejected == 1 and store.decode_errors == 1
+    assert set(store.channels) == {b'$A'}
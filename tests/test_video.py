@@ -0,0 +1,168 @@
+# ##############################################################################
+#
+# rover_video: NAL splitter, access unit assembler, jitter buffer, recorder
+#
+# ##############################################################################
+
+import glob
+import os
+import rover_video
+
+# nal(nal_type,ref,first) - NAL unit with its start code; first is the first
+# slice of a picture (first_mb_in_slice == 0)
+def nal(nal_type,ref=1,first=True,payload=b'\x11\x22'):
+    return rover_video.START_CODE + bytes(((ref << 5) | nal_type,0x80 if first else 0x40)) + payload
+
+# au(idr,ref,t) - access unit queued at time t
+def au(idr=False,ref=True,t=0.0):
+    unit = rover_video.AccessUnit()
+    unit.idr = idr
+    unit.ref = ref
+    unit.slices = 1
+    unit.time = t
+    return unit
+
+# ------------------------------------------------------------------------------
+# NalSplitter
+# ------------------------------------------------------------------------------
+
+def test_splitter_skips_bytes_before_the_first_start_code():
+    splitter = rover_video.NalSplitter()
+    sps,pps = nal(rover_video.NAL_SPS),nal(rover_video.NAL_PPS)
+    assert splitter.feed(b'\x42\x42' + sps + pps) == [sps]
+    assert splitter.flush() == [pps]
+
+def test_splitter_finds_start_codes_across_reads():
+    splitter = rover_video.NalSplitter()
+    units = [nal(rover_video.NAL_SPS),nal(rover_video.NAL_IDR,payload=bytes(range(40,200))),nal(rover_video.NAL_SLICE)]
+    stream = b''.join(units)
+    nals = []
+    # one byte at a time splits every start code
+    for i in range(len(stream)):
+        nals += splitter.feed(stream[i:i + 1])
+    assert nals + splitter.flush() == units
+
+def test_splitter_without_start_code_returns_nothing():
+    splitter = rover_video.NalSplitter()
+    assert splitter.feed(b'\x01\x02\x03\x04' * 100) == []
+    assert splitter.flush() == []
+
+# ------------------------------------------------------------------------------
+# AccessUnitAssembler
+# ------------------------------------------------------------------------------
+
+def test_assembler_groups_parameter_sets_with_their_picture():
+    assembler = rover_video.AccessUnitAssembler()
+    idr_units = [nal(rover_video.NAL_SPS),nal(rover_video.NAL_PPS),nal(rover_video.NAL_IDR),
+        nal(rover_video.NAL_IDR,first=False)]
+    assert [assembler.feed(n) for n in idr_units] == [None] * 4
+    done = assembler.feed(nal(rover_video.NAL_SLICE,ref=0))
+    assert done.nals == idr_units
+    assert done.idr and done.ref and done.slices == 2
+    last = assembler.flush()
+    assert not last.idr and not last.ref and last.slices == 1
+    assert assembler.flush() is None
+
+def test_assembler_closes_a_picture_on_an_access_unit_delimiter():
+    assembler = rover_video.AccessUnitAssembler()
+    assembler.feed(nal(rover_video.NAL_SLICE))
+    done = assembler.feed(nal(rover_video.NAL_AUD))
+    assert done.slices == 1 and done.ref
+    # the delimiter starts the next access unit, without a picture yet
+    assert assembler.flush() is None
+
+# ------------------------------------------------------------------------------
+# JitterBuffer
+# ------------------------------------------------------------------------------
+
+def test_jitter_buffer_starts_at_an_idr_frame():
+    buffer = rover_video.JitterBuffer(max_frames=8,latency_budget=1.0)
+    buffer.put(au())
+    buffer.put(au())
+    assert buffer.get() is None
+    assert buffer.dropped_skip == 2
+    idr = au(idr=True)
+    buffer.put(idr)
+    buffer.put(au())
+    assert buffer.get() is idr
+    assert buffer.frames_in == 4 and buffer.frames_out == 1
+
+def test_jitter_buffer_drops_non_reference_frames_first():
+    buffer = rover_video.JitterBuffer(max_frames=3,latency_budget=1.0)
+    frames = [au(idr=True),au(ref=False),au(),au(ref=False)]
+    for frame in frames: buffer.put(frame)
+    assert list(buffer.frames) == [frames[0],frames[2]]
+    assert buffer.dropped_nonref == 2 and buffer.dropped_skip == 0
+
+def test_jitter_buffer_restarts_at_the_newest_idr_over_budget():
+    buffer = rover_video.JitterBuffer(max_frames=8,latency_budget=0.2)
+    frames = [au(idr=True,t=0.0),au(t=0.1),au(idr=True,t=0.25),au(t=0.3)]
+    for frame in frames: buffer.put(frame)
+    assert list(buffer.frames) == frames[2:]
+    assert buffer.dropped_skip == 2
+
+def test_jitter_buffer_waits_for_the_next_idr_without_one_queued():
+    buffer = rover_video.JitterBuffer(max_frames=8,latency_budget=0.2)
+    for frame in (au(idr=True,t=0.0),au(t=0.1),au(t=0.3)): buffer.put(frame)
+    assert buffer.get() is None
+    assert buffer.skip_to_idr and buffer.frames_dropped == 3
+
+# ------------------------------------------------------------------------------
+# VideoRecorder
+# ------------------------------------------------------------------------------
+
+SPS = b'\x00\x00\x00\x01\x67\x42\x00\x1f'
+PPS = b'\x00\x00\x00\x01\x68\xce\x3c\x80'
+IDR = b'\x00\x00\x00\x01\x65' + bytes(200)
+SLICE = b'\x00\x00\x00\x01\x41' + bytes(100)
+
+# segments(directory) - contents of the recorded segments, in order
+def segments(directory):
+    paths = sorted(glob.glob(os.path.join(str(directory),'*' + rover_video.RECORD_SUFFIX)))
+    return [open(path,'rb').read() for path in paths]
+
+def test_segment_starts_at_the_first_sps(tmp_path):
+    recorder = rover_video.VideoRecorder(str(tmp_path))
+    # joined the stream in the middle of a picture
+    recorder.write(SLICE)
+    recorder.write(SLICE[:50] + SPS + PPS)
+    recorder.write(IDR)
+    recorder.write(SLICE)
+    recorder.close(wait=True)
+    assert segments(tmp_path) == [SPS + PPS + IDR + SLICE]
+    assert recorder.segments == 1 and recorder.error is None
+
+def test_gap_ends_the_segment_until_the_next_sps(tmp_path):
+    recorder = rover_video.VideoRecorder(str(tmp_path))
+    recorder.write(SPS + PPS + IDR)
+    recorder.gap()
+    # not decodable without the frames lost in the gap
+    recorder.write(SLICE)
+    recorder.write(SPS + PPS + IDR)
+    recorder.close(wait=True)
+    assert segments(tmp_path) == [SPS + PPS + IDR,SPS + PPS + IDR]
+
+def test_full_queue_drops_new_buffers_with_one_marker(tmp_path):
+    recorder = rover_video.VideoRecorder(str(tmp_path),queue_size=1000)
+    # the writer thread waits for the lock meanwhile
+    with recorder.lock:
+        recorder.write(SPS + PPS + IDR)
+        for _ in range(100): recorder.write(bytes(1000))
+        recorder.gap()
+        assert list(recorder.queue) == [SPS + PPS + IDR,None]
+        assert recorder.queued_bytes == len(SPS + PPS + IDR)
+    recorder.close(wait=True)
+    assert recorder.buffers_dropped == 100 and recorder.bytes_dropped == 100000
+    assert segments(tmp_path) == [SPS + PPS + IDR]
+
+def test_disk_error_stops_the_recording(tmp_path):
+    directory = tmp_path / 'video'
+    recorder = rover_video.VideoRecorder(str(directory))
+    os.rmdir(str(directory))
+    recorder.write(SPS + PPS + IDR)
+    recorder.thread.join(5)
+    assert not recorder.thread.is_alive()
+    assert recorder.error is not None and recorder.closing
+    # later buffers are ignored, not queued
+    recorder.write(SLICE)
+    assert not recorder.queue and recorder.queued_bytes == 0